@@ -12,6 +12,7 @@ import re
 import shutil
 import subprocess
 import sys
+from datetime import datetime
 from pathlib import Path
 from pprint import pformat
 
@@ -36,6 +37,7 @@ from cmd_utils import (
     setup_entry_stage,
     working_directory,
 )
+from pipeline.utils.cache import clear_cache, get_cache_dir, list_cache, prune_cache
 
 log = logging.getLogger()
 logging.basicConfig(level=logging.INFO)
@@ -182,6 +184,14 @@ CLI_run.add_argument(
     default=None,
     help="name of the config profile to be analyzed",
 )
+CLI_run.add_argument(
+    "--cores",
+    type=int,
+    nargs="?",
+    default=1,
+    help="number of CPU cores snakemake may use for the blocks "
+    "(e.g. for the processes of N_JOBS) [default: 1]",
+)
 
 # Stage
 CLI_stage = subparsers.add_parser(
@@ -204,6 +214,14 @@ CLI_stage.add_argument(
     default=None,
     help="name of the config profile to be analyzed",
 )
+CLI_stage.add_argument(
+    "--cores",
+    type=int,
+    nargs="?",
+    default=1,
+    help="number of CPU cores snakemake may use for the blocks "
+    "(e.g. for the processes of N_JOBS) [default: 1]",
+)
 
 # Block
 CLI_block = subparsers.add_parser(
@@ -232,6 +250,30 @@ CLI_block.add_argument(
     help="display the help text of the block script",
 )
 
+# Cache
+CLI_cache = subparsers.add_parser(
+    "cache",
+    help="inspect and prune the cache of block results",
+)
+CLI_cache.set_defaults(command="cache")
+CLI_cache.add_argument(
+    "action",
+    type=str,
+    nargs="?",
+    default="list",
+    choices=["list", "prune", "clear"],
+    help="list the cache entries, prune the least recently used entries "
+    "down to the size limit, or remove all entries [default: list]",
+)
+CLI_cache.add_argument(
+    "--size_limit",
+    type=float,
+    nargs="?",
+    default=None,
+    help="maximal cache size in GB for pruning "
+    "[default: setting 'cache_size_limit' or 50]",
+)
+
 
 def main():
     "Start main CLI entry point."
@@ -271,6 +313,10 @@ def main():
         log.info("executing Cobrawap block")
         run_block(**vars(args), block_args=unknown)
 
+    elif args.command == "cache":
+        log.info("inspecting the Cobrawap cache")
+        cache(**vars(args))
+
     elif args.command is None:
         CLI.print_help(sys.stderr)
         CLI.parse_args()
@@ -431,7 +477,7 @@ def add_profile(
     return None
 
 
-def run(profile=None, extra_args=None, **kwargs):
+def run(profile=None, cores=1, extra_args=None, **kwargs):
     # # allow for positional profile argument
     # if profile is None and extra_args and extra_args[0][0] != "-":
     #     profile = extra_args.pop(0)
@@ -443,7 +489,7 @@ def run(profile=None, extra_args=None, **kwargs):
     pipeline_path = Path(get_setting("pipeline_path"))
 
     # execute snakemake
-    snakemake_args = ["snakemake", "-c1", "--config", f"PROFILE={profile}"]
+    snakemake_args = ["snakemake", f"-c{cores}", "--config", f"PROFILE={profile}"]
     log.info(f'Executing `{" ".join(snakemake_args+extra_args)}`')
 
     with working_directory(pipeline_path):
@@ -452,7 +498,7 @@ def run(profile=None, extra_args=None, **kwargs):
     return None
 
 
-def run_stage(stage=None, profile=None, extra_args=None, **kwargs):
+def run_stage(stage=None, profile=None, cores=1, extra_args=None, **kwargs):
     # # allow for positional stage argument
     # if stage is None and extra_args and extra_args[0][0] != "-":
     #     stage = extra_args.pop(0)
@@ -505,7 +551,7 @@ def run_stage(stage=None, profile=None, extra_args=None, **kwargs):
     extra_args = extra_args + ["--configfile", f"{stage_config_path}"]
 
     # execute snakemake
-    snakemake_args = ["snakemake", "-c1", "--config", f"PROFILE={profile}"]
+    snakemake_args = ["snakemake", f"-c{cores}", "--config", f"PROFILE={profile}"]
     log.info(f'Executing `{" ".join(snakemake_args+extra_args)}`')
 
     with working_directory(pipeline_path):
@@ -534,5 +580,38 @@ def run_block(stage=None, block=None, block_args=None, block_help=False, **kwarg
     return None
 
 
+def cache(action="list", size_limit=None, **kwargs):
+    cache_dir = get_cache_dir()
+    if cache_dir is None:
+        return None
+
+    if action == "list":
+        entries = list_cache(cache_dir)
+        for entry in entries:
+            last_used = datetime.fromtimestamp(entry["last_used"])
+            print(
+                f"{entry['key'][:12]}  {entry['size']/1024**2:10.1f} MB  "
+                f"{last_used:%Y-%m-%d %H:%M}  {', '.join(entry['outputs'])}"
+            )
+        total_size = sum(entry["size"] for entry in entries)
+        log.info(
+            f"{len(entries)} cache entries ({total_size/1024**3:.2f} GB) "
+            f"in {cache_dir}"
+        )
+
+    elif action == "prune":
+        removed = prune_cache(cache_dir, size_limit=size_limit)
+        log.info(f"removed {len(removed)} cache entries")
+
+    elif action == "clear":
+        clear = (
+            input(f"Remove all cached results in {cache_dir}? [y/N] ").lower()
+            == "y"
+        )
+        if clear:
+            clear_cache(cache_dir)
+    return None
+
+
 if __name__ == "__main__":
     main()
@@ -28,7 +28,7 @@ if __name__ == '__main__':
 
     asig = block.segments[0].analogsignals[0]
 
-    imgseq = analogsignal_to_imagesequence(asig)
+    imgseq = analogsignal_to_imagesequence(asig, copy=False)
     asig2 = imagesequence_to_analogsignal(imgseq)
 
     if asig.shape != asig2.shape:
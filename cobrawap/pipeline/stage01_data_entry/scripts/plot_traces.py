@@ -62,8 +62,9 @@ if __name__ == '__main__':
 
     channels = parse_plot_channels(args.channels, args.data)
 
+    # only the plotted time window is loaded
     asig = time_slice(asig, t_start=args.t_start, t_stop=args.t_stop,
-                      lazy=True, channel_indexes=channels)
+                      lazy=True)
 
     ax = plot_traces(asig, channels)
     save_plot(args.output)
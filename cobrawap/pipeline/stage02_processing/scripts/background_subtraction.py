@@ -9,6 +9,7 @@ from pathlib import Path
 import os
 from utils.io_utils import load_neo, write_neo, save_plot
 from utils.parse import none_or_path
+from utils.spatial_grid import SpatialGrid
 
 CLI = argparse.ArgumentParser()
 CLI.add_argument("--data", nargs='?', type=Path, required=True,
@@ -20,13 +21,19 @@ CLI.add_argument("--output_img", nargs='?', type=none_or_path,
 CLI.add_argument("--output_array", nargs='?', type=none_or_path,
                  help="path of output numpy array", default=None)
 
-def shape_frame(value_array, xy_coords):
-    dim_x = np.max(xy_coords[:,0]) + 1
-    dim_y = np.max(xy_coords[:,1]) + 1
-    frame = np.empty((dim_y, dim_x)) * np.nan
-    for pixel, (x,y) in zip(value_array, xy_coords):
-        frame[int(y), int(x)] = pixel
-    return frame
+def subtract_background(asig):
+    signal = asig.as_array()
+    background = np.nanmean(signal, axis=0)
+    signal -= background
+
+    new_asig = asig.duplicate_with_new_data(signal)
+    new_asig.array_annotations = asig.array_annotations
+    new_asig.description += "The mean of each channel was subtracted ({})."\
+                        .format(os.path.basename(__file__))
+    return new_asig, background
+
+def shape_frame(value_array, grid):
+    return grid.to_grid(np.asarray(value_array, dtype=float))
 
 def plot_frame(frame):
     fig, ax = plt.subplots()
@@ -41,26 +48,16 @@ if __name__ == '__main__':
 
     block = load_neo(args.data)
     asig = block.segments[0].analogsignals[0]
-    signal = asig.as_array()
-    background = np.nanmean(signal, axis=0)
-    signal -= background
+    new_asig, background = subtract_background(asig)
 
     if args.output_img or args.output_array is not None:
-        xy_coords = np.array([(x,y) for x,y in
-                           zip(asig.array_annotations['x_coords'],
-                               asig.array_annotations['y_coords'])],
-                           dtype=int)
-        frame = shape_frame(background, xy_coords)
+        frame = shape_frame(background, SpatialGrid.from_signal(asig))
         if args.output_array is not None:
             np.save(args.output_array, frame)
         if args.output_img is not None:
             plot_frame(frame)
             save_plot(args.output_img)
 
-    new_asig = asig.duplicate_with_new_data(signal)
-    new_asig.array_annotations = asig.array_annotations
-    new_asig.description += "The mean of each channel was subtracted ({})."\
-                        .format(os.path.basename(__file__))
     block.segments[0].analogsignals[0] = new_asig
 
     write_neo(args.output, block)
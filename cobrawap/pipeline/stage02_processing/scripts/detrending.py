@@ -9,8 +9,9 @@ import argparse
 from pathlib import Path
 import os
 import warnings
-from utils.io_utils import load_neo, write_neo, save_plot
-from utils.parse import none_or_int
+from utils.io_utils import load_neo, save_plot
+from utils.parse import none_or_int, none_or_float
+from utils import streaming
 
 CLI = argparse.ArgumentParser()
 CLI.add_argument("--data", nargs='?', type=Path, required=True,
@@ -19,6 +20,9 @@ CLI.add_argument("--output", nargs='?', type=Path, required=True,
                  help="path of output file")
 CLI.add_argument("--order", nargs='?', type=int, default=1,
                  help="detrending order")
+CLI.add_argument("--streaming_chunk_duration", nargs='?', type=none_or_float,
+                 default=None, help="process the signal in time chunks of this "
+                                   "duration in s (None: all at once)")
 CLI.add_argument("--img_dir", nargs='?', type=Path, required=True,
                  help="path of output figure directory")
 CLI.add_argument("--img_name", nargs='?', type=str,
@@ -27,13 +31,25 @@ CLI.add_argument("--img_name", nargs='?', type=str,
 CLI.add_argument("--plot_channels", nargs='+', type=none_or_int, default=None,
                  help="list of channels to plot")
 
-def detrend(asig, order):
+def detrend(asig, order, chunk_duration=None, output=None):
     if (order != 0) and (order != 1):
         warnings.warn("Detrending order must be either 0 (constant) or 1 (linear)! Skip.")
         return asig
 
+    if chunk_duration is not None:
+        detrend_asig = streaming.detrend(asig, output, order=order,
+                                         chunk_duration=chunk_duration)
+    else:
+        detrend_asig = _detrend(asig, order)
+
+    detrend_asig.description += "Detrended by order {} ({}). "\
+                                .format(order, os.path.basename(__file__))
+    return detrend_asig
+
+
+def _detrend(asig, order):
     dtrend = 'linear' if order else 'constant'
-    detrended_signals = np.empty(asig.shape)
+    detrended_signals = np.empty(asig.shape, dtype=asig.dtype)
     detrended_signals.fill(np.nan)
 
     for channel in range(asig.shape[1]):
@@ -64,10 +80,15 @@ def plot_detrend(asig, detrend_asig, channel):
 if __name__ == '__main__':
     args, unknown = CLI.parse_known_args()
 
-    block = load_neo(args.data)
+    if args.streaming_chunk_duration is None:
+        block = load_neo(args.data)
+    else:
+        block = streaming.load_streamed(args.data)
     asig = block.segments[0].analogsignals[0]
 
-    detrend_asig = detrend(asig, args.order)
+    detrend_asig = detrend(asig, args.order,
+                           chunk_duration=args.streaming_chunk_duration,
+                           output=args.output)
 
     if args.plot_channels[0] is not None:
         for channel in args.plot_channels:
@@ -76,8 +97,6 @@ if __name__ == '__main__':
                                        args.img_name.replace('_channel0', f'_channel{channel}'))
             save_plot(output_path)
 
-    detrend_asig.description += "Detrended by order {} ({}). "\
-                        .format(args.order, os.path.basename(__file__))
     block.segments[0].analogsignals[0] = detrend_asig
 
-    write_neo(args.output, block)
+    streaming.write_streamed(args.output, block)
@@ -7,7 +7,8 @@ from pathlib import Path
 import quantities as pq
 import os
 from elephant.signal_processing import butter
-from utils.io_utils import load_neo, write_neo
+from utils.io_utils import load_neo
+from utils import streaming
 from utils.parse import none_or_float
 
 CLI = argparse.ArgumentParser()
@@ -23,30 +24,58 @@ CLI.add_argument("--order", nargs='?', type=int, default=2,
                  help="order of the filter function")
 CLI.add_argument("--filter_function", nargs='?', type=str, default='filtfilt',
                  help="filter function used in the scipy backend")
+CLI.add_argument("--streaming_chunk_duration", nargs='?', type=none_or_float,
+                 default=None, help="process the signal in time chunks of this "
+                                   "duration in s (None: all at once)")
+
+def frequency_filter(asig, highpass_frequency, lowpass_frequency, order,
+                     filter_function, chunk_duration=None, output=None):
+    if chunk_duration is None:
+        filt_asig = butter(asig,
+                           highpass_frequency=highpass_frequency*pq.Hz,
+                           lowpass_frequency=lowpass_frequency*pq.Hz,
+                           order=order,
+                           filter_function=filter_function)
+    else:
+        # the filter is applied in second-order sections
+        filt_asig = streaming.butter(asig, output,
+                                     highpass_frequency=highpass_frequency,
+                                     lowpass_frequency=lowpass_frequency,
+                                     order=order,
+                                     filter_function=filter_function,
+                                     chunk_duration=chunk_duration)
+
+    filt_asig.array_annotations = asig.array_annotations
+    filt_asig.annotate(highpass_frequency=highpass_frequency*pq.Hz,
+                       lowpass_frequency=lowpass_frequency*pq.Hz,
+                       filter_order=order)
+
+    filt_asig.description += "Frequency filtered with [{}, {}]Hz order {} "\
+                             .format(highpass_frequency,
+                                     lowpass_frequency,
+                                     order)\
+                           + " using {} scipy algorithm.({}). "\
+                             .format(filter_function,
+                                     os.path.basename(__file__))
+    return filt_asig
+
 
 if __name__ == '__main__':
     args, unknown = CLI.parse_known_args()
 
-    block = load_neo(args.data)
-
-    asig = butter(block.segments[0].analogsignals[0],
-                  highpass_frequency=args.highpass_frequency*pq.Hz,
-                  lowpass_frequency=args.lowpass_frequency*pq.Hz,
-                  order=args.order,
-                  filter_function=args.filter_function)
-
-    asig.array_annotations = block.segments[0].analogsignals[0].array_annotations
-    asig.annotate(highpass_frequency=args.highpass_frequency*pq.Hz,
-                  lowpass_frequency=args.lowpass_frequency*pq.Hz,
-                  filter_order=args.order)
-
-    asig.description += "Frequency filtered with [{}, {}]Hz order {} "\
-                        .format(args.highpass_frequency,
-                                args.lowpass_frequency,
-                                args.order)\
-                      + " using {} scipy algorithm.({}). "\
-                        .format(args.filter_function,
-                                os.path.basename(__file__))
+    if args.streaming_chunk_duration is None:
+        block = load_neo(args.data)
+    else:
+        block = streaming.load_streamed(args.data)
+
+    asig = frequency_filter(block.segments[0].analogsignals[0],
+                            highpass_frequency=args.highpass_frequency,
+                            lowpass_frequency=args.lowpass_frequency,
+                            order=args.order,
+                            filter_function=args.filter_function,
+                            chunk_duration=args.streaming_chunk_duration,
+                            output=args.output)
+
     block.segments[0].analogsignals[0] = asig
 
-    write_neo(args.output, block)
+    streaming.write_streamed(args.output, block)
@@ -0,0 +1,122 @@
+"""
+Apply the whole BLOCK_ORDER chain of processing blocks in a single process,
+passing the AnalogSignal in memory from one block to the next.
+Intermediate results are only written for the selected blocks.
+"""
+
+import argparse
+from pathlib import Path
+import quantities as pq
+import os
+from utils.io_utils import load_neo, write_neo
+from utils.parse import none_or_float, str_to_bool
+from background_subtraction import subtract_background
+from spatial_downsampling import spatial_downsampling
+from normalization import normalize
+from detrending import detrend
+from frequency_filter import frequency_filter
+from roi_selection import roi_selection
+from logMUA_estimation import logMUA_estimation
+from phase_transform import phase_transform
+from z_score import z_score
+from subsampling import subsample
+
+CLI = argparse.ArgumentParser()
+CLI.add_argument("--data", nargs='?', type=Path, required=True,
+                 help="path to input data in neo format")
+CLI.add_argument("--output", nargs='?', type=Path, required=True,
+                 help="path of output file")
+CLI.add_argument("--block_order", nargs='*', type=str, default=[],
+                 help="order of processing blocks to apply")
+CLI.add_argument("--save_intermediates", nargs='*', type=str, default=[],
+                 help="blocks of which to also write the output")
+CLI.add_argument("--macro_pixel_dim", nargs='?', type=int, default=2,
+                 help="smoothing factor")
+CLI.add_argument("--normalize_by", nargs='?', type=str, default='mean',
+                 help="division factor: 'max', 'mean', or 'median'")
+CLI.add_argument("--detrending_order", nargs='?', type=int, default=1,
+                 help="detrending order")
+CLI.add_argument("--highpass_frequency", nargs='?', type=none_or_float,
+                 default=None, help="lower bound of frequency band in Hz")
+CLI.add_argument("--lowpass_frequency", nargs='?', type=none_or_float,
+                 default=None, help="upper bound of frequency band in Hz")
+CLI.add_argument("--filter_order", nargs='?', type=int, default=2,
+                 help="order of the filter function")
+CLI.add_argument("--filter_function", nargs='?', type=str, default='filtfilt',
+                 help="filter function used in the scipy backend")
+CLI.add_argument("--intensity_threshold", nargs='?', type=float, default=0.5,
+                 help="threshold for mask [0,1]")
+CLI.add_argument("--crop_to_selection", nargs='?', type=str_to_bool,
+                 default=True, help="discard frame outside of ROI")
+CLI.add_argument("--mua_highpass_frequency", nargs='?', type=float,
+                 default=200, help="lower bound of MUA frequency band in Hz")
+CLI.add_argument("--mua_lowpass_frequency", nargs='?', type=float,
+                 default=1500, help="upper bound of MUA frequency band in Hz")
+CLI.add_argument("--logMUA_rate", nargs='?', type=none_or_float, default=None,
+                 help="rate of the signal after transformation")
+CLI.add_argument("--psd_overlap", nargs='?', type=float, default=0.5,
+                 help="overlap parameter for Welch's algorithm [0-1]")
+CLI.add_argument("--fft_slice", nargs='?', type=none_or_float, default=None,
+                 help="time window length used for power spectrum estimate, in s")
+CLI.add_argument("--target_rate", nargs='?', type=none_or_float, default=None,
+                 help="rate to subsample to in Hz")
+
+
+def apply_block(block_name, asig, args):
+    if block_name == 'background_subtraction':
+        asig, _ = subtract_background(asig)
+    elif block_name == 'spatial_downsampling':
+        asig = spatial_downsampling(asig, args.macro_pixel_dim)
+    elif block_name == 'normalization':
+        asig = normalize(asig, args.normalize_by)
+    elif block_name == 'detrending':
+        asig = detrend(asig, args.detrending_order)
+    elif block_name == 'frequency_filter':
+        asig = frequency_filter(asig,
+                                highpass_frequency=args.highpass_frequency,
+                                lowpass_frequency=args.lowpass_frequency,
+                                order=args.filter_order,
+                                filter_function=args.filter_function)
+    elif block_name == 'roi_selection':
+        asig, _, _ = roi_selection(asig,
+                                   intensity_threshold=args.intensity_threshold,
+                                   crop=args.crop_to_selection)
+    elif block_name == 'logMUA_estimation':
+        logMUA_rate = None if args.logMUA_rate is None \
+                      else args.logMUA_rate*pq.Hz
+        fft_slice = None if args.fft_slice is None \
+                    else args.fft_slice*pq.s
+        asig = logMUA_estimation(asig,
+                            highpass_frequency=args.mua_highpass_frequency*pq.Hz,
+                            lowpass_frequency=args.mua_lowpass_frequency*pq.Hz,
+                            logMUA_rate=logMUA_rate,
+                            psd_overlap=args.psd_overlap,
+                            fft_slice=fft_slice)
+    elif block_name == 'phase_transform':
+        asig = phase_transform(asig)
+    elif block_name in ['zscore', 'z_score']:
+        asig = z_score(asig)
+    elif block_name == 'subsampling':
+        asig = subsample(asig, args.target_rate)
+    else:
+        raise ValueError(f"Processing block '{block_name}' is not recognized!")
+    return asig
+
+
+if __name__ == '__main__':
+    args, unknown = CLI.parse_known_args()
+
+    block = load_neo(args.data)
+    asig = block.segments[0].analogsignals[0]
+
+    for block_name in args.block_order:
+        asig = apply_block(block_name, asig, args)
+        block.segments[0].analogsignals[0] = asig
+
+        if block_name in args.save_intermediates:
+            write_neo(args.output.parent / f'{block_name}{args.output.suffix}',
+                      block)
+
+    asig.description += "({}). ".format(os.path.basename(__file__))
+
+    write_neo(args.output, block)
@@ -16,6 +16,7 @@ from pathlib import Path
 from utils.io_utils import load_neo, write_neo, save_plot
 from utils.parse import none_or_float, none_or_int
 from utils.neo_utils import time_slice
+from utils.streaming import finite_channels
 
 CLI = argparse.ArgumentParser()
 CLI.add_argument("--data", nargs='?', type=Path, required=True,
@@ -76,9 +77,11 @@ def logMUA_estimation(asig, highpass_frequency, lowpass_frequency, logMUA_rate,
                                 asig.t_stop.rescale('s'),
                                 1/eff_logMUA_rate) * asig.t_start.units
 
-    non_nan_channels = [i for i in range(asig.shape[-1]) if np.isfinite(asig[:,i]).all()]
-    asig_channels = asig[:, non_nan_channels]
-    logMUA_signal = np.zeros((len(subsample_times), len(non_nan_channels)))
+    # checked in time chunks, and channels are only selected per time slice,
+    # to not copy the full (e.g. memory-mapped) signal
+    non_nan_channels = finite_channels(asig)
+    logMUA_signal = np.zeros((len(subsample_times), len(non_nan_channels)),
+                             dtype=asig.dtype)
 
     for i, t in enumerate(subsample_times):
         if t < asig.t_start.rescale('s') + fft_slice/2:
@@ -91,7 +94,8 @@ def logMUA_estimation(asig, highpass_frequency, lowpass_frequency, logMUA_rate,
         t_stop = np.min([t_start + fft_slice,
                          asig.t_stop.rescale('s')]) *pq.s
 
-        asig_slice = asig_channels.time_slice(t_start=t_start, t_stop=t_stop)
+        asig_slice = asig.time_slice(t_start=t_start, t_stop=t_stop)\
+                         [:, non_nan_channels]
 
         freqs, psd = welch_psd(asig_slice,
                                frequency_resolution=highpass_frequency,
@@ -110,7 +114,8 @@ def logMUA_estimation(asig, highpass_frequency, lowpass_frequency, logMUA_rate,
         avg_power_in_freq_band = np.mean(psd[:,1:high_idx], axis=-1)
         logMUA_signal[i] = np.squeeze(np.log(avg_power_in_freq_band/avg_power))
 
-    new_signals = np.empty((len(subsample_times), channel_num))
+    new_signals = np.empty((len(subsample_times), channel_num),
+                           dtype=logMUA_signal.dtype)
     new_signals.fill(np.nan)
     new_signals[:, non_nan_channels] = logMUA_signal
 
@@ -121,6 +126,10 @@ def logMUA_estimation(asig, highpass_frequency, lowpass_frequency, logMUA_rate,
                          psd_frequency_resolution = highpass_frequency,
                          psd_overlap = psd_overlap,
                          psd_fs = fs)
+    logMUA_asig.description += "Estimated logMUA signal [{}, {}] Hz ({}). "\
+                               .format(highpass_frequency.rescale('Hz').magnitude,
+                                       lowpass_frequency.rescale('Hz').magnitude,
+                                       os.path.basename(__file__))
     return logMUA_asig
 
 
@@ -185,9 +194,6 @@ if __name__ == '__main__':
                         / args.img_name.replace('_channel0', f'_channel{channel}')
             save_plot(output_path)
 
-    asig.description += "Estimated logMUA signal [{}, {}] Hz ({}). "\
-                        .format(args.highpass_frequency, args.lowpass_frequency,
-                                os.path.basename(__file__))
     block.segments[0].analogsignals[0] = asig
 
     write_neo(args.output, block)
@@ -42,6 +42,8 @@ def normalize(asig, normalize_by):
 
     new_asig = asig.duplicate_with_new_data(norm_asig, units='dimensionless')
     new_asig.array_annotations = asig.array_annotations
+    new_asig.description += "Normalized by {} ({})."\
+                            .format(normalize_by, os.path.basename(__file__))
     return new_asig
 
 
@@ -51,9 +53,6 @@ if __name__ == '__main__':
     block = load_neo(args.data)
 
     asig = normalize(block.segments[0].analogsignals[0], args.normalize_by)
-
-    asig.description += "Normalized by {} ({})."\
-                        .format(args.normalize_by, os.path.basename(__file__))
     block.segments[0].analogsignals[0] = asig
 
     write_neo(args.output, block)
@@ -7,27 +7,46 @@ from elephant.signal_processing import hilbert
 import argparse
 from pathlib import Path
 import os
-from utils.io_utils import load_neo, write_neo
+from utils.io_utils import load_neo
+from utils.parse import none_or_float
+from utils import streaming
 
 CLI = argparse.ArgumentParser()
 CLI.add_argument("--data", nargs='?', type=Path, required=True,
                  help="path to input data in neo format")
 CLI.add_argument("--output", nargs='?', type=Path, required=True,
                  help="path of output file")
+CLI.add_argument("--streaming_chunk_duration", nargs='?', type=none_or_float,
+                 default=None, help="process the signal in time chunks of this "
+                                   "duration in s (None: all at once)")
+
+def phase_transform(asig, chunk_duration=None, output=None):
+    if chunk_duration is None:
+        phase = np.angle(hilbert(asig).as_array())
+        phase_asig = asig.duplicate_with_new_data(phase)
+        phase_asig.array_annotations = asig.array_annotations
+    else:
+        # overlap-save, with one chunk duration of overlap on both sides
+        phase_asig = streaming.hilbert_phase(asig, output,
+                                             chunk_duration=chunk_duration)
+
+    phase_asig.description += "Phase signal ({}). "\
+                              .format(os.path.basename(__file__))
+    return phase_asig
+
 
 if __name__ == '__main__':
     args, unknown = CLI.parse_known_args()
 
-    block = load_neo(args.data)
-    asig = block.segments[0].analogsignals[0]
-
-    phase = np.angle(hilbert(asig).as_array())
+    if args.streaming_chunk_duration is None:
+        block = load_neo(args.data)
+    else:
+        block = streaming.load_streamed(args.data)
 
-    asig = asig.duplicate_with_new_data(phase)
-    asig.array_annotations = block.segments[0].analogsignals[0].array_annotations
+    asig = phase_transform(block.segments[0].analogsignals[0],
+                           chunk_duration=args.streaming_chunk_duration,
+                           output=args.output)
 
-    asig.description += "Phase signal ({}). "\
-                        .format(os.path.basename(__file__))
     block.segments[0].analogsignals[0] = asig
 
-    write_neo(args.output, block)
+    streaming.write_streamed(args.output, block)
@@ -131,11 +131,7 @@ def plot_roi(img, contour):
     return ax
 
 
-if __name__ == '__main__':
-    args, unknown = CLI.parse_known_args()
-
-    block = load_neo(args.data)
-    asig = block.segments[0].analogsignals[0]
+def roi_selection(asig, intensity_threshold, crop=True):
     imgseq = analogsignal_to_imagesequence(asig)
 
     # get average image
@@ -145,7 +141,7 @@ if __name__ == '__main__':
 
     # calculate mask
     contour = calculate_contour(img=avg_img,
-                                contour_limit=args.intensity_threshold)
+                                contour_limit=intensity_threshold)
     contour = close_contour(contour, num=100)
     mask = contour2mask(contour=contour,
                         dim_x=dim_x,
@@ -153,20 +149,30 @@ if __name__ == '__main__':
 
     # apply mask
     imgseq_array[:, np.bitwise_not(mask)] = np.nan
-    if args.crop_to_selection:
+    if crop:
         imgseq_array = crop_to_selection(imgseq_array)
 
     # replace analogsingal
-    tmp_blk = neo.Block()
-    tmp_seg = neo.Segment()
-    tmp_blk.segments.append(tmp_seg)
     tmp_imgseq = imgseq.duplicate_with_new_data(imgseq_array)
     new_asig = imagesequence_to_analogsignal(tmp_imgseq)
 
-    # save data and figure
     new_asig.description += "Border regions with mean intensity below "\
-                         + "{args.intensity_threshold} were discarded. "\
+                         + f"{intensity_threshold} were discarded. "\
                          + "({})".format(os.path.basename(__file__))
+    return new_asig, avg_img, contour
+
+
+if __name__ == '__main__':
+    args, unknown = CLI.parse_known_args()
+
+    block = load_neo(args.data)
+    asig = block.segments[0].analogsignals[0]
+
+    new_asig, avg_img, contour = roi_selection(asig,
+                                    intensity_threshold=args.intensity_threshold,
+                                    crop=args.crop_to_selection)
+
+    # save data and figure
     block.segments[0].analogsignals = [new_asig]
 
     plot_roi(avg_img, contour)
@@ -50,6 +50,11 @@ def spatial_smoothing(imgseq, macro_pixel_dim):
 
     return imgseq_reduced
 
+def spatial_downsampling(asig, macro_pixel_dim):
+    imgseq = analogsignal_to_imagesequence(asig, copy=False)
+    imgseq_reduced = spatial_smoothing(imgseq, macro_pixel_dim)
+    return imagesequence_to_analogsignal(imgseq_reduced)
+
 def plot_downsampled_image(image, output_path):
     plt.figure()
     plt.imshow(image, interpolation='nearest', cmap='viridis', origin='lower')
@@ -61,18 +66,13 @@ if __name__ == '__main__':
 
     block = load_neo(args.data)
     asig = block.segments[0].analogsignals[0]
-    imgseq = analogsignal_to_imagesequence(asig)
 
-    imgseq_reduced = spatial_smoothing(imgseq, args.macro_pixel_dim)
+    new_asig = spatial_downsampling(asig, args.macro_pixel_dim)
 
     if args.output_img is not None:
-        plot_downsampled_image(imgseq_reduced.as_array()[0], args.output_img)
-
-    new_block = neo.Block()
-    new_segment = neo.Segment()
-    new_block.segments.append(new_segment)
-    new_block.segments[0].imagesequences.append(imgseq_reduced)
-    new_asig = imagesequence_to_analogsignal(imgseq_reduced)
+        first_frame = analogsignal_to_imagesequence(new_asig[:1], copy=False)\
+                      .as_array()[0]
+        plot_downsampled_image(first_frame, args.output_img)
 
     block.segments[0].analogsignals[0] = new_asig
 
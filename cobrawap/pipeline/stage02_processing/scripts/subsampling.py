@@ -17,19 +17,24 @@ CLI.add_argument("--output", nargs='?', type=Path, required=True,
 CLI.add_argument("--target_rate", nargs='?', type=float, required=True,
                  help="rate to subsample to in Hz")
 
-if __name__ == '__main__':
-    args, unknown = CLI.parse_known_args()
-
-    block = load_neo(args.data)
-    asig = block.segments[0].analogsignals[0]
-
-    subsampling_order = asig.sampling_rate/(args.target_rate*pq.Hz)
+def subsample(asig, target_rate):
+    subsampling_order = asig.sampling_rate/(target_rate*pq.Hz)
     subsampling_order = int(np.round(subsampling_order.rescale('dimensionless')))
 
     sub_asig = asig.duplicate_with_new_data(asig.as_array()[::subsampling_order])
     sub_asig.sampling_rate = asig.sampling_rate/subsampling_order
 
     sub_asig.array_annotations = asig.array_annotations
+    return sub_asig
+
+
+if __name__ == '__main__':
+    args, unknown = CLI.parse_known_args()
+
+    block = load_neo(args.data)
+
+    sub_asig = subsample(block.segments[0].analogsignals[0], args.target_rate)
+
     block.segments[0].analogsignals[0] = sub_asig
 
     write_neo(args.output, block)
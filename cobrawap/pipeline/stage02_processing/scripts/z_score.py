@@ -5,19 +5,38 @@ Z-score the signal of each channel.
 import argparse
 from pathlib import Path
 from elephant.signal_processing import zscore
-from utils.io_utils import load_neo, write_neo
+from utils.io_utils import load_neo
+from utils.parse import none_or_float
+from utils import streaming
 
 CLI = argparse.ArgumentParser()
 CLI.add_argument("--data", nargs='?', type=Path, required=True,
                  help="path to input data in neo format")
 CLI.add_argument("--output", nargs='?', type=Path, required=True,
                  help="path of output file")
+CLI.add_argument("--streaming_chunk_duration", nargs='?', type=none_or_float,
+                 default=None, help="process the signal in time chunks of this "
+                                   "duration in s (None: all at once)")
+
+def z_score(asig, chunk_duration=None, output=None):
+    if chunk_duration is not None:
+        return streaming.zscore(asig, output, chunk_duration=chunk_duration)
+    zscore(asig, inplace=True)
+    return asig
+
 
 if __name__ == '__main__':
     args, unknown = CLI.parse_known_args()
 
-    block = load_neo(args.data)
+    if args.streaming_chunk_duration is None:
+        block = load_neo(args.data)
+    else:
+        block = streaming.load_streamed(args.data)
+
+    asig = z_score(block.segments[0].analogsignals[0],
+                   chunk_duration=args.streaming_chunk_duration,
+                   output=args.output)
 
-    zscore(block.segments[0].analogsignals[0], inplace=True)
+    block.segments[0].analogsignals[0] = asig
 
-    write_neo(args.output, block)
+    streaming.write_streamed(args.output, block)
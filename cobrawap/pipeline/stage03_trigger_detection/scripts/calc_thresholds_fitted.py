@@ -13,6 +13,7 @@ from scipy.optimize import OptimizeWarning
 import matplotlib.pyplot as plt
 from utils.io_utils import load_neo, save_plot
 from utils.parse import none_or_int
+from utils.neo_utils import load_channels
 
 CLI = argparse.ArgumentParser()
 CLI.add_argument("--data", nargs='?', type=Path, required=True,
@@ -131,20 +132,22 @@ def fit_amplitude_distribution(signal, sigma_factor, fit_function,
 if __name__ == '__main__':
     args, unknown = CLI.parse_known_args()
     
-    asig = load_neo(args.data, 'analogsignal')
-    signal = asig.as_array()
-    dim_t, dim_channels = signal.shape
-    non_nan_channels = [i for i in range(dim_channels) if np.isfinite(signal[:,i]).all()]
+    asig = load_neo(args.data, 'analogsignal', lazy=True)
+    dim_t, dim_channels = asig.shape
 
     thresholds = np.empty(dim_channels)
     thresholds.fill(np.nan)
 
-    for channel in non_nan_channels:
+    for channel in range(dim_channels):
+        # load the channels one by one, to not keep the full data in memory
+        signal = load_channels(asig, [channel]).as_array()[:,0]
+        if not np.isfinite(signal).all():
+            continue
         if channel in args.plot_channels:
             plot_channel = channel
         else:
             plot_channel = False
-        thresholds[channel] = fit_amplitude_distribution(signal[:,channel],
+        thresholds[channel] = fit_amplitude_distribution(signal,
                                                          args.sigma_factor,
                                                          args.fit_function,
                                                          args.bin_num,
@@ -18,7 +18,7 @@ CLI.add_argument("--threshold", nargs='?', type=float, required=True,
 if __name__ == '__main__':
     args, unknown = CLI.parse_known_args()
 
-    asig = load_neo(args.data, 'analogsignal')
+    asig = load_neo(args.data, 'analogsignal', lazy=True)
 
     dim_t, channel_num = asig.shape
 
@@ -13,7 +13,7 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from utils.io_utils import load_neo, write_neo, save_plot
 from utils.neo_utils import time_slice, remove_annotations
-from utils.parse import none_or_int, none_or_float
+from utils.parse import none_or_int, none_or_float, str_to_bool
 from pathlib import Path
 
 CLI = argparse.ArgumentParser()
@@ -34,6 +34,8 @@ CLI.add_argument("--plot_tstart", nargs='?', type=none_or_float, default=0,
                  help="start time in seconds")
 CLI.add_argument("--plot_tstop",  nargs='?', type=none_or_float, default=10,
                  help="stop time in seconds")
+CLI.add_argument("--delta_write", nargs='?', type=str_to_bool, default=False,
+                 help="only write the added objects, referencing the input file")
 
 def detect_transitions(asig, transition_phase):
     # ToDo: replace with elephant function
@@ -140,7 +142,8 @@ if __name__ == '__main__':
 
     block.segments[0].events.append(transition_event)
 
-    write_neo(args.output, block)
+    write_neo(args.output, block,
+              parent=args.data if args.delta_write else None)
 
     if args.plot_channels[0] is not None:
         for channel in args.plot_channels:
@@ -11,7 +11,7 @@ import argparse
 from pathlib import Path
 from utils.io_utils import load_neo, write_neo, save_plot
 from utils.neo_utils import remove_annotations, time_slice
-from utils.parse import none_or_int, none_or_float, none_or_str
+from utils.parse import none_or_int, none_or_float, none_or_str, str_to_bool
 import seaborn as sns
 import matplotlib.pyplot as plt
 
@@ -42,6 +42,8 @@ CLI.add_argument("--plot_tstart", nargs='?', type=none_or_float, default=0,
                  help="start time (s)")
 CLI.add_argument("--plot_tstop", nargs='?', type=none_or_float, default=10,
                  help="stop time (s)")
+CLI.add_argument("--delta_write", nargs='?', type=str_to_bool, default=False,
+                 help="only write the added objects, referencing the input file")
 
 def filter_minima_order(signal, mins, order=1):
     filtered_mins = np.array([], dtype=int)
@@ -210,7 +212,8 @@ if __name__ == '__main__':
 
     block.segments[0].events.append(transition_event)
 
-    write_neo(args.output, block)
+    write_neo(args.output, block,
+              parent=args.data if args.delta_write else None)
 
     if args.plot_channels[0] is not None:
         for channel in args.plot_channels:
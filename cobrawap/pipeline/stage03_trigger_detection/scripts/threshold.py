@@ -9,6 +9,7 @@ import argparse
 from pathlib import Path
 from utils.io_utils import load_neo, write_neo
 from utils.neo_utils import remove_annotations
+from utils.parse import str_to_bool
 
 CLI = argparse.ArgumentParser()
 CLI.add_argument("--data", nargs='?', type=Path, required=True,
@@ -17,6 +18,8 @@ CLI.add_argument("--output", nargs='?', type=Path, required=True,
                  help="path of output file")
 CLI.add_argument("--thresholds", nargs='?', type=str, required=True,
                  help="path of thresholds (numpy array)")
+CLI.add_argument("--delta_write", nargs='?', type=str_to_bool, default=False,
+                 help="only write the added objects, referencing the input file")
 
 def threshold(asig, threshold_array):
     dim_t, channel_num = asig.shape
@@ -75,4 +78,5 @@ if __name__ == '__main__':
 
     block.segments[0].events.append(transition_event)
 
-    write_neo(args.output, block)
+    write_neo(args.output, block,
+              parent=args.data if args.delta_write else None)
@@ -0,0 +1,179 @@
+"""
+Link the critical points of subsequent frames into trajectories.
+
+Each critical point is linked to an end of a track of the same type (label)
+within the maximum distance, which was last extended at most `max_frame_gap`
+frames before. In each frame, the links are chosen to continue as many tracks
+as possible with the smallest total distance. The track ids are added to the
+'critical_points' event as array_annotation 'track_id'.
+"""
+
+import argparse
+from itertools import chain
+from pathlib import Path
+import numpy as np
+import matplotlib.pyplot as plt
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial import cKDTree
+from utils.io_utils import load_neo, write_neo, save_plot
+from utils.parse import none_or_path
+
+CLI = argparse.ArgumentParser()
+CLI.add_argument("--data", nargs='?', type=Path, required=True,
+                 help="path to input data in neo format")
+CLI.add_argument("--output", nargs='?', type=Path, required=True,
+                 help="path of output file")
+CLI.add_argument("--output_img", nargs='?', type=none_or_path, default=None,
+                 help="path of output image file")
+CLI.add_argument("--max_distance", "--tracking_max_distance",
+                 "--TRACKING_MAX_DISTANCE", nargs='?', type=float, default=2,
+                 help="maximum distance (in grid sites) between linked "
+                      "critical points")
+CLI.add_argument("--max_frame_gap", "--tracking_max_frame_gap",
+                 "--TRACKING_MAX_FRAME_GAP", nargs='?', type=int, default=1,
+                 help="maximum number of frames between linked critical "
+                      "points (1 for subsequent frames only)")
+CLI.add_argument("--event_name", nargs='?', type=str, default='critical_points',
+                 help="name of neo.Event of the critical points")
+
+
+def link_to_track_ends(points, end_points, max_distance):
+    """
+    Links points to track ends within max_distance, so that each point and
+    each track end is linked at most once. The candidate pairs are taken
+    from a KD-tree of the track ends, and assigned by solving the linear
+    assignment problem, which maximizes the number of links and then
+    minimizes their total distance. A point that is not the closest to its
+    nearest track end can thereby continue its next-nearest one.
+    Returns the indices of the linked points and track ends.
+    """
+    neighbours = cKDTree(points).query_ball_tree(cKDTree(end_points),
+                                                 r=max_distance)
+    point_ids = np.repeat(np.arange(len(points)),
+                          [len(n) for n in neighbours])
+    end_ids = np.fromiter(chain.from_iterable(neighbours), dtype=int,
+                          count=len(point_ids))
+    if not len(point_ids):
+        return point_ids, end_ids
+
+    # assignment only among the points and ends with candidate pairs
+    point_ids, rows = np.unique(point_ids, return_inverse=True)
+    end_ids, cols = np.unique(end_ids, return_inverse=True)
+    distance = np.linalg.norm(points[point_ids[rows]]
+                              - end_points[end_ids[cols]], axis=-1)
+    # other pairs cost more than any set of candidate pairs, so that they
+    # are only assigned where no candidate pair is left
+    no_link = (max_distance + 1) * (min(len(point_ids), len(end_ids)) + 1)
+    cost = np.full((len(point_ids), len(end_ids)), no_link, dtype=float)
+    cost[rows, cols] = distance
+
+    rows, cols = linear_sum_assignment(cost)
+    is_link = cost[rows, cols] < no_link
+    return point_ids[rows[is_link]], end_ids[cols[is_link]]
+
+
+def track_critical_points(frame_ids, x, y, labels, max_distance=2,
+                          max_frame_gap=1):
+    """
+    Returns the track id of each critical point. The points are linked
+    frame by frame to the open track ends (see link_to_track_ends), the
+    points without a link start new tracks.
+    """
+    _, label_ids = np.unique(labels, return_inverse=True)
+    # points of different types are never within max_distance
+    points = np.stack([x, y, label_ids * 2 * (max_distance + 1)], axis=-1)
+
+    order = np.argsort(frame_ids, kind='stable')
+    frames, frame_starts = np.unique(frame_ids[order], return_index=True)
+    frame_stops = np.append(frame_starts[1:], len(order))
+
+    track_ids = np.full(len(frame_ids), -1, dtype=int)
+    num_tracks = 0
+    # open track ends: last point, last frame, and id
+    end_points = np.empty((0, 3))
+    end_frames = np.empty(0, dtype=int)
+    end_ids = np.empty(0, dtype=int)
+
+    for frame, start, stop in zip(frames, frame_starts, frame_stops):
+        idx = order[start:stop]
+
+        is_open = end_frames >= frame - max_frame_gap
+        end_points = end_points[is_open]
+        end_frames = end_frames[is_open]
+        end_ids = end_ids[is_open]
+
+        matches = np.full(len(idx), -1, dtype=int)
+        if len(end_ids):
+            matched_points, matched_ends = link_to_track_ends(
+                                            points[idx], end_points,
+                                            max_distance)
+            matches[matched_points] = matched_ends
+
+        is_new = matches < 0
+        new_ids = np.arange(num_tracks, num_tracks + np.sum(is_new))
+        num_tracks += len(new_ids)
+        track_ids[idx[is_new]] = new_ids
+        track_ids[idx[~is_new]] = end_ids[matches[~is_new]]
+
+        # continued tracks move their end, new tracks are appended
+        is_continued = np.zeros(len(end_ids), dtype=bool)
+        is_continued[matches[~is_new]] = True
+        end_points = np.concatenate([end_points[~is_continued], points[idx]])
+        end_frames = np.concatenate([end_frames[~is_continued],
+                                     np.full(len(idx), frame)])
+        end_ids = np.concatenate([end_ids[~is_continued], track_ids[idx]])
+    return track_ids
+
+
+def plot_track_lifetimes(times, labels, track_ids, ax=None):
+    if ax is None:
+        fig, ax = plt.subplots()
+    for label in np.unique(labels):
+        is_label = labels == label
+        _, inverse = np.unique(track_ids[is_label], return_inverse=True)
+        t = times[is_label]
+        t_start = np.full(inverse.max(initial=-1) + 1, np.inf)
+        t_stop = np.full(inverse.max(initial=-1) + 1, -np.inf)
+        np.minimum.at(t_start, inverse, t)
+        np.maximum.at(t_stop, inverse, t)
+        ax.hist(t_stop - t_start, bins=20, histtype='step', label=label)
+    ax.set_yscale('log')
+    ax.set_xlabel('track lifetime [s]')
+    ax.set_ylabel('# tracks')
+    ax.legend()
+    return ax
+
+
+if __name__ == '__main__':
+    args, unknown = CLI.parse_known_args()
+    block = load_neo(args.data)
+
+    evts = block.filter(name=args.event_name, objects="Event")
+    if not evts:
+        raise ValueError(f"Input does not contain an event with name "
+                         f"'{args.event_name}'!")
+    evt = evts[0]
+
+    asig = block.segments[0].analogsignals[0]
+    frame_ids = np.round(((evt.times - asig.t_start) * asig.sampling_rate)
+                         .simplified.magnitude).astype(int)
+    labels = evt.labels.astype(str)
+
+    track_ids = track_critical_points(frame_ids=frame_ids,
+                                      x=evt.array_annotations['x'],
+                                      y=evt.array_annotations['y'],
+                                      labels=labels,
+                                      max_distance=args.max_distance,
+                                      max_frame_gap=args.max_frame_gap)
+    evt.array_annotations['track_id'] = track_ids
+    evt.annotations.update(tracking_max_distance=args.max_distance,
+                           tracking_max_frame_gap=args.max_frame_gap)
+    print(f'{len(np.unique(track_ids))} tracks of {len(track_ids)} '
+          'critical points')
+
+    if args.output_img is not None:
+        plot_track_lifetimes(evt.times.rescale('s').magnitude, labels,
+                             track_ids)
+        save_plot(args.output_img)
+
+    write_neo(args.output, block)
@@ -4,197 +4,270 @@ time point.
 """
 
 import argparse
+from functools import lru_cache
 from pathlib import Path
 import numpy as np
 import neo
-import matplotlib.pyplot as plt
-from shapely.geometry import LineString
 from utils.io_utils import load_neo, write_neo, save_plot
 from utils.neo_utils import analogsignal_to_imagesequence
+from utils.parallel import SharedArray, attach, get_n_jobs, run_parallel
+from utils.parse import str_to_bool
 
 CLI = argparse.ArgumentParser()
 CLI.add_argument("--data", nargs='?', type=Path, required=True,
                  help="path to input data in neo format")
 CLI.add_argument("--output", nargs='?', type=Path, required=True,
                  help="path of output file")
+CLI.add_argument("--delta_write", nargs='?', type=str_to_bool, default=False,
+                 help="only write the added objects, referencing the input file")
+CLI.add_argument("--n_jobs", nargs='?', type=int, default=1,
+                 help='number of processes among which the frame chunks are '
+                      'distributed, <1 for all CPUs')
                     
-def detect_critical_points(imgseq, times):
+# number of frames whose cells are searched for critical points at once
+FRAME_CHUNK_SIZE = 64
+
+
+def detect_critical_points(imgseq, times, n_jobs=1):
     frames = imgseq.as_array()
-    if frames.dtype != np.complex128:
+    if not np.iscomplexobj(frames):
         raise ValueError("Vector field values must be complex numbers!")
 
-    dim_t, dim_x, dim_y = frames.shape
-
-    frame_ids = np.array([], dtype=int)
-    labels = np.array([], dtype=str)
-    x = np.array([], dtype=float)
-    y = np.array([], dtype=float)
-    trace = np.array([], dtype=float)
-    det = np.array([], dtype=float)
-    extend = np.array([], dtype=int)
-    winding_number = np.array([], dtype=int)
-    # winding_number = np.array([], dtype=float) # ToDo
-
-    for i in range(dim_t):
-        # ToDo: parallelize
-        Y, X = np.meshgrid(np.arange(dim_y), np.arange(dim_x), indexing='ij')
-        ZR = np.real(frames[i])
-        ZI = np.imag(frames[i])
-        contourR = plt.contour(X, Y, ZR, levels=[0])
-        contourI = plt.contour(X, Y, ZI, levels=[0])
-
-        for xy in get_line_intersections(contourR, contourI):
-            x = np.append(x, xy[0])
-            y = np.append(y, xy[1])
-            frame_ids = np.append(frame_ids, i)
-
-            J = jacobian(xy, ZR, ZI)
-            trace_i = np.trace(J)
-            det_i = np.linalg.det(J)
-            labels = np.append(labels, classify_critical_point(det=det_i,
-                                                               trace=trace_i))
-            trace = np.append(trace, trace_i)
-            det = np.append(det, det_i)
-
-            extend_i, winding_number_i = calc_winding_number(xy, frames[i])
-            extend = np.append(extend, extend_i)
-            winding_number = np.append(winding_number, winding_number_i)
+    chunks = [(start, min(start + FRAME_CHUNK_SIZE, len(frames)))
+              for start in range(0, len(frames), FRAME_CHUNK_SIZE)]
+    if get_n_jobs(n_jobs) > 1 and len(chunks) > 1:
+        # the frame chunks are analyzed in separate processes,
+        # reading the frames from shared memory
+        with SharedArray.from_array(frames) as shared_frames:
+            results = run_parallel(_analyze_shared_chunk,
+                                   [(shared_frames.descriptor, start, stop)
+                                    for start, stop in chunks],
+                                   n_jobs=n_jobs)
+    else:
+        results = [analyze_frame_chunk(frames, start, stop)
+                   for start, stop in chunks]
+
+    # the chunks are in time order
+    points = {key: np.concatenate([result[key] for result in results])
+              for key in results[0]} if results else analyze_frames(frames)
+    frame_ids = points.pop('frame_ids')
+    labels = points.pop('labels')
 
     evt = neo.Event(name='critical_points',
                     times=times[frame_ids],
                     labels=labels)
-    evt.array_annotations.update({'x':x, 'y':y, 
-                                  'trace':trace, 'det':det,
-                                  'extend':extend, 
-                                  'winding_number':winding_number})
+    evt.array_annotations.update(points)
     return evt
 
 
-def jacobian(xy, fA, fB):
+def analyze_frames(frames):
+    """
+    Critical points of a stack of vector fields: their frame indices,
+    positions, labels, Jacobian traces and determinants, and winding numbers.
+    """
+    frame_ids, x, y = find_zero_crossings(frames)
+
+    J = jacobian(frame_ids, x, y, np.real(frames), np.imag(frames))
+    trace = np.trace(J, axis1=1, axis2=2)
+    det = np.linalg.det(J)
+
+    extend, winding_number = calc_winding_number(frames, frame_ids, x, y)
+
+    return {'frame_ids': frame_ids,
+            'labels': classify_critical_point(det=det, trace=trace),
+            'x': x, 'y': y, 'trace': trace, 'det': det,
+            'extend': extend, 'winding_number': winding_number}
+
+
+def analyze_frame_chunk(frames, start, stop):
+    points = analyze_frames(frames[start:stop])
+    points['frame_ids'] += start
+    return points
+
+
+def _analyze_shared_chunk(descriptor, start, stop):
+    # worker process, operating on the shared frames
+    return analyze_frame_chunk(attach(descriptor), start, stop)
+
+
+def find_zero_crossings(frames):
+    """
+    Locates the points where both the real and the imaginary part of the
+    vector field vanish, in the bilinear interpolation of each grid cell.
+    Returns the frame indices and the x and y coordinates of the points.
+    """
+    U, V = np.real(frames), np.imag(frames)
+    dim_t, dim_y, dim_x = frames.shape
+
+    def sign_change(F):
+        corners = np.stack([F[:, :-1, :-1], F[:, :-1, 1:],
+                            F[:, 1:, :-1], F[:, 1:, 1:]])
+        return (np.min(corners, axis=0) <= 0) & (np.max(corners, axis=0) >= 0)
+
+    # only cells in which both components change sign (or vanish at a
+    # corner) can contain a zero, points on shared edges and corners are
+    # assigned to a single cell below
+    t_idx, y_idx, x_idx = np.where(sign_change(U) & sign_change(V))
+
+    def bilinear_coefficients(F):
+        # F(s, t) = c0 + c1*s + c2*t + c3*s*t, with s, t in [0, 1]
+        # along x and y of the cell
+        f00 = F[t_idx, y_idx, x_idx]
+        f10 = F[t_idx, y_idx, x_idx+1]
+        f01 = F[t_idx, y_idx+1, x_idx]
+        f11 = F[t_idx, y_idx+1, x_idx+1]
+        return f00, f10 - f00, f01 - f00, f11 - f10 - f01 + f00
+
+    a0, a1, a2, a3 = bilinear_coefficients(U)
+    b0, b1, b2, b3 = bilinear_coefficients(V)
+
+    # eliminating t from U(s, t) = V(s, t) = 0 leaves A*s^2 + B*s + C = 0
+    A = b1*a3 - b3*a1
+    B = b0*a3 + b1*a2 - b2*a1 - b3*a0
+    C = b0*a2 - b2*a0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        discriminant = B**2 - 4*A*C
+        sqrt_discriminant = np.sqrt(discriminant)
+        is_quadratic = A != 0
+        roots = [np.where(is_quadratic, (-B + sqrt_discriminant) / (2*A),
+                          -C / B),
+                 # a double root is a single point
+                 np.where(is_quadratic & (discriminant > 0),
+                          (-B - sqrt_discriminant) / (2*A), np.nan)]
+
+        cells, points_s, points_t = [], [], []
+        for s in roots:
+            # t from the component, whose t-coefficient is better conditioned
+            denom_U, denom_V = a2 + a3*s, b2 + b3*s
+            t = np.where(np.abs(denom_U) >= np.abs(denom_V),
+                         -(a0 + a1*s) / denom_U,
+                         -(b0 + b1*s) / denom_V)
+            # a point on the edge between two cells is only assigned to the
+            # cell with the edge at s=0 (t=0), except on the upper grid borders
+            is_inside = (s >= 0) & ((s < 1) | ((s == 1) & (x_idx == dim_x-2))) \
+                      & (t >= 0) & ((t < 1) | ((t == 1) & (y_idx == dim_y-2)))
+            cells.append(np.where(is_inside)[0])
+            points_s.append(s[is_inside])
+            points_t.append(t[is_inside])
+
+    cells = np.concatenate(cells)
+    order = np.argsort(cells, kind='stable')
+    cells = cells[order]
+    x = x_idx[cells] + np.concatenate(points_s)[order]
+    y = y_idx[cells] + np.concatenate(points_t)[order]
+    return t_idx[cells], x, y
+
+
+def jacobian(frame_ids, x, y, fA, fB):
+    """
+    Jacobians (n x 2 x 2) of the vector fields fA + i*fB at the grid sites
+    nearest to the points (x, y) in the frames `frame_ids`, by forward
+    differences (backward differences at the upper grid borders).
+    """
     # dA/dy  dA/dx
     # dB/dy  dB/dx
-    x, y = int(np.round(xy[0])), int(np.round(xy[1]))
-    J = np.zeros((2,2))
-    dim_y, dim_x = fA.shape
-    if y+1 < dim_y:
-        J[0,0] = fA[y+1, x] - fA[y, x]
-        J[1,0] = fB[y+1, x] - fB[y, x]
-    else:
-        J[0,0] = fA[y, x] - fA[y-1, x]
-        J[1,0] = fB[y, x] - fB[y-1, x]
-    if x+1 < dim_x:
-        J[0,1] = fA[y, x+1] - fA[y, x]
-        J[1,1] = fB[y, x+1] - fB[y, x]
-    else:
-        J[0,1] = fA[y, x] - fA[y, x-1]
-        J[1,1] = fB[y, x] - fB[y, x-1]
+    x, y = np.round(x).astype(int), np.round(y).astype(int)
+    dim_t, dim_y, dim_x = fA.shape
+    J = np.zeros((len(x), 2, 2))
+    y0 = np.where(y + 1 < dim_y, y, y - 1)
+    x0 = np.where(x + 1 < dim_x, x, x - 1)
+    for i, f in enumerate([fA, fB]):
+        J[:, i, 0] = f[frame_ids, y0+1, x] - f[frame_ids, y0, x]
+        J[:, i, 1] = f[frame_ids, y, x0+1] - f[frame_ids, y, x0]
     return J
 
 
 def classify_critical_point(det, trace):
-    if det > 0:
-        if trace**2 > 4*det:
-            if trace > 0 :
-                return 'node stable'
-            else:
-                return 'node unstable'
-        else:
-            if trace > 0:
-                return 'focus stable'
-            else:
-                return 'focus unstable'
-    else:
-        return 'saddle'
+    return np.select([(det > 0) & (trace**2 > 4*det) & (trace > 0),
+                      (det > 0) & (trace**2 > 4*det),
+                      (det > 0) & (trace > 0),
+                      det > 0],
+                     ['node stable', 'node unstable',
+                      'focus stable', 'focus unstable'],
+                     default='saddle')
 
 
-def calc_winding_number(xy, frame):
-    px, py = int(np.round(xy[0])), int(np.round(xy[1]))
-    dim_y, dim_x = frame.shape
-    max_r = np.ceil(min([dim_x, dim_y])/2)
-    prev_winding_number = 0
-    for r in range(1, int(max_r)):
-        # is circle intersecting with the image border?
-        if px + r >= dim_x or px - r <= 0:
-            break
-        elif py + r >= dim_y or py - r <= 0:
-            break
-        else:
-            Y, X = np.indices((dim_y, dim_x))
-            circle = np.abs(np.hypot(py-Y,px-X) - r) < 0.5
-
-        # extracting counter-clock-wise indices of circle with radius r
-        ccw = np.array([], dtype=[('x',int), ('y',int)])
-        # x0     x1     y0    y1     sx   sy
-        # 0  0   xp xp  0 py  py -1  + -  - -
-        # xp xp  -1 -1  0 py  py -1  + -  + +
-        for x0, x1, y0, y1 in zip([0 , px, px, 0], # Quadrants TL, BL, BR, TR
-                                  [px, -1, -1, px],
-                                  [0 ,  0, py, py],
-                                  [py, py, -1, -1]):
-            circle_yi, circle_xi = np.where(circle[y0:y1, x0:x1])
-            circle_xi += x0
-            circle_yi += y0
-            circle_idx = np.array([(-np.sign(x1)*yi, np.sign(y1)*xi)
-                                    for xi,yi in zip(circle_xi, circle_yi)],
-                                  dtype=[('x', int), ('y', int)])
-            ccw = np.append(ccw, np.sort(circle_idx, order=['y', 'x']))
-
-        # sum differences of subsequent vector angles around circle
-        circle_values = frame[np.abs(ccw['y']), np.abs(ccw['x'])]
-        circle_angles = np.angle(circle_values) + np.pi
-        circle_angles = np.append(circle_angles, circle_angles[0])
-
-        # ToDo: solve more pythonic
-        sum_angles = 0
-        for i, phi in enumerate(circle_angles[:-1]):
-            dphi = circle_angles[i+1] - phi
-            if dphi > np.pi:
-                dphi -= 2*np.pi
-            elif dphi < -np.pi:
-                dphi += 2*np.pi
-            sum_angles += dphi
-        winding_number = sum_angles/(2*np.pi)
-
-        winding_number = np.round(winding_number)
-        if r != 1 and prev_winding_number != winding_number:
+@lru_cache(maxsize=None)
+def ring_offsets(radius):
+    """
+    Offsets (dy, dx) of the grid sites within 0.5 of the circle with the
+    given radius, in counter-clockwise order in the (y, x) coordinates of
+    jacobian(), so that saddles have the winding number -1.
+    """
+    extent = np.arange(-radius, radius+1)
+    dy, dx = np.meshgrid(extent, extent, indexing='ij')
+    on_circle = np.abs(np.hypot(dy, dx) - radius) < 0.5
+    dy, dx = dy[on_circle], dx[on_circle]
+    order = np.argsort(np.arctan2(dx, dy), kind='stable')
+    return dy[order], dx[order]
+
+
+def calc_winding_number(frames, frame_ids, x, y):
+    """
+    Winding numbers of the vector fields around the points (x, y) in the
+    frames `frame_ids`, on rings of increasing radius around the nearest grid
+    sites. The radius grows until the winding number changes or the ring
+    reaches the grid border, and its extend is the last radius with a
+    consistent winding number.
+    """
+    px, py = np.round(x).astype(int), np.round(y).astype(int)
+    dim_t, dim_y, dim_x = frames.shape
+    max_r = int(np.ceil(min([dim_x, dim_y])/2))
+
+    extend = np.full(len(px), max(max_r - 2, 0), dtype=int)
+    winding_number = np.zeros(len(px), dtype=int)
+    is_growing = np.ones(len(px), dtype=bool)
+
+    for r in range(1, max_r):
+        # does the ring intersect with the grid border?
+        is_outside = (px + r >= dim_x) | (px - r <= 0) \
+                   | (py + r >= dim_y) | (py - r <= 0)
+        stops = is_growing & is_outside
+        extend[stops] = r - 1
+        is_growing &= ~is_outside
+        idx = np.where(is_growing)[0]
+        if not len(idx):
             break
-        else:
-            prev_winding_number = winding_number
-    return r-1, prev_winding_number
-
-
-def get_line_intersections(contourA, contourB):
-    points = []
-    for path in contourA.collections[0].get_paths():
-        if len(path.vertices) > 1:
-            lineA = LineString(path.vertices)
-        else:
-            lineA = None
-
-        for path in contourB.collections[0].get_paths():
-            if len(path.vertices) > 1 and lineA is not None:
-                lineB = LineString(path.vertices)
-
-                intersection = lineA.intersection(lineB)
-
-                if not intersection.is_empty:
-                    if intersection.type == 'MultiPoint':
-                        points += [(i.x, i.y) for i in intersection]
-                    elif intersection.type == 'Point':
-                        points += [(intersection.x, intersection.y)]
-    return points
+
+        # sum of the differences of subsequent vector angles around the ring
+        dy, dx = ring_offsets(r)
+        ring_values = frames[frame_ids[idx, np.newaxis],
+                             py[idx, np.newaxis] + dy,
+                             px[idx, np.newaxis] + dx]
+        ring_angles = np.angle(ring_values)
+        dphi = np.diff(ring_angles, axis=1, append=ring_angles[:, :1])
+        dphi = np.where(dphi > np.pi, dphi - 2*np.pi, dphi)
+        dphi = np.where(dphi < -np.pi, dphi + 2*np.pi, dphi)
+        ring_winding_number = np.round(np.sum(dphi, axis=1) / (2*np.pi))
+
+        if r != 1:
+            changes = ring_winding_number != winding_number[idx]
+            extend[idx[changes]] = r - 1
+            is_growing[idx[changes]] = False
+            idx = idx[~changes]
+            ring_winding_number = ring_winding_number[~changes]
+        winding_number[idx] = ring_winding_number
+    return extend, winding_number
 
 
 if __name__ == '__main__':
     args, unknown = CLI.parse_known_args()
     block = load_neo(args.data)
 
-    asig = block.filter(name='optical_flow', objects="AnalogSignal")[0]
-    imgseq = analogsignal_to_imagesequence(asig)
+    asigs = block.filter(name='optical_flow', objects="AnalogSignal")
+    if not asigs:
+        raise ValueError("Input does not contain an AnalogSignal with name "
+                         "'optical_flow'! The critical points require the "
+                         "optical flow of all frames (WINDOW_EVENT: 'None').")
+    asig = asigs[0]
+    imgseq = analogsignal_to_imagesequence(asig, copy=False)
 
     crit_point_evt = detect_critical_points(imgseq,
-                                    block.segments[0].analogsignals[0].times)
+                                    block.segments[0].analogsignals[0].times,
+                                    n_jobs=args.n_jobs)
 
     block.segments[0].events.append(crit_point_evt)
 
-    write_neo(args.output, block)
+    write_neo(args.output, block,
+              parent=args.data if args.delta_write else None)
@@ -21,6 +21,8 @@ if __name__ == '__main__':
     waves_block = load_neo(args.data)
 
     asig_names = [asig.name for asig in waves_block.segments[0].analogsignals]
+    isig_names = [isig.name for isig
+                  in waves_block.segments[0].irregularlysampledsignals]
     event_names = [event.name for event in waves_block.segments[0].events]
 
     if not args.properties or not args.properties[0]:
@@ -32,7 +34,16 @@ if __name__ == '__main__':
         for asig in block.segments[0].analogsignals:
             if asig.name not in asig_names:
                 waves_block.segments[0].analogsignals.append(asig)
+                asig_names.append(asig.name)
 
+        # e.g. the event-windowed optical flow
+        for isig in block.segments[0].irregularlysampledsignals:
+            if isig.name not in isig_names:
+                waves_block.segments[0].irregularlysampledsignals.append(isig)
+                isig_names.append(isig.name)
+
+        # events of the same name, e.g. 'critical_points' from both the
+        # critical_points and the critical_point_tracking block, are merged
         for event in block.segments[0].events:
             if event.name in event_names:
                 waves_evt = waves_block.filter(name=event.name, objects="Event")[0]
@@ -44,6 +55,7 @@ if __name__ == '__main__':
                         waves_evt.array_annotations[key] = value
             else:
                 waves_block.segments[0].events.append(event)
+                event_names.append(event.name)
 
         del block
 
@@ -15,6 +15,8 @@ from utils.io_utils import load_neo, write_neo, save_plot
 from utils.parse import none_or_path, none_or_str, str_to_bool
 from utils.neo_utils import imagesequence_to_analogsignal, analogsignal_to_imagesequence
 from utils.convolve import phase_conv2d, get_kernel, conv, norm_angle
+from utils.parallel import SharedArray, attach, get_n_jobs, run_parallel
+from utils.spatial_grid import NEIGHBOUR_OFFSETS
 
 CLI = argparse.ArgumentParser()
 CLI.add_argument("--data", nargs='?', type=Path, required=True,
@@ -35,124 +37,509 @@ CLI.add_argument("--derivative_filter", nargs='?', type=none_or_str, default=Non
                  help='Filter kernel to use for calculating spatial derivatives')
 CLI.add_argument("--use_phases", nargs='?', type=str_to_bool, default=False,
                  help='whether to use signal phase instead of amplitude')
-
-def horn_schunck_step(frame, next_frame, alpha, max_Niter, convergence_limit,
-                      kernelHS, kernelT, kernelX, kernelY,
-                      are_phases=False, kernel_center=None):
+CLI.add_argument("--warm_start", nargs='?', type=str_to_bool, default=False,
+                 help='whether to initialize the vector field of each frame '
+                      'with the one of the previous frame')
+CLI.add_argument("--solver", nargs='?', type=str, default='jacobi',
+                 choices=['jacobi', 'multigrid'],
+                 help='iterative solver of the Horn-Schunck equations')
+CLI.add_argument("--window_event", nargs='?', type=none_or_str, default=None,
+                 help='name of the neo.Event (e.g. transitions) around which '
+                      'the optical flow is computed, None for all frames')
+CLI.add_argument("--window_padding", nargs='?', type=float, default=0.1,
+                 help='time (in s) before and after each event, within '
+                      'which the optical flow is computed')
+CLI.add_argument("--n_jobs", nargs='?', type=int, default=1,
+                 help='number of processes among which the frame pairs are '
+                      'distributed, <1 for all CPUs')
+
+# number of frame pairs of which the vector fields are optimized at once
+FRAME_CHUNK_SIZE = 100
+# 'multigrid' solver: Jacobi sweeps before and after each coarse grid
+# correction, minimal size (in sites) of the coarsest grid, and sweeps on it
+MULTIGRID_SWEEPS = 2
+MIN_GRID_SIZE = 8
+COARSEST_GRID_SWEEPS = 50
+
+def horn_schunck_step(fx, fy, ft, alpha, max_Niter, convergence_limit,
+                      kernelHS, initial_flow=None):
     """
+    Iteratively optimizes the vector fields of a stack of frame pairs at
+    once. Each frame pair stops being updated as soon as it converged.
+
     Parameters
     ----------
-    frame: numpy.ndarray
-        image at t=0
-    next_frame: numpy.ndarray
-        image at t=1
+    fx, fy, ft: numpy.ndarray
+        spatial and temporal derivatives of the frame pairs (t, y, x)
+        (see compute_derivatives)
     alpha: float
         regularization constant
     max_Niter: int
         maximum number of iteration
     convergence_limit: float
         the maximum absolute change between iterations defining convergence
+    initial_flow: numpy.ndarray (complex)
+        initial vector fields, default zeros
+
+    Returns
+    -------
+    vector fields (complex), and per frame pair the number of iterations and
+    the residual, i.e. the maximum absolute change of the last iteration
     """
     # set up initial velocities
-    vx = np.zeros_like(frame)
-    vy = np.zeros_like(frame)
-
-    # estimate derivatives
-    [fx, fy, ft] = compute_derivatives(frame, next_frame,
-                                       kernelX=kernelX,
-                                       kernelY=kernelY,
-                                       kernelT=kernelT,
-                                       are_phases=are_phases)
+    if initial_flow is None:
+        vx = np.zeros_like(fx)
+        vy = np.zeros_like(fx)
+    else:
+        vx = np.real(initial_flow).astype(fx.dtype)
+        vy = np.imag(initial_flow).astype(fx.dtype)
+
+    # 2D kernel applied to each frame
+    kernelHS = kernelHS[np.newaxis]
+    denominator = alpha**2 + fx**2 + fy**2
+    # indices of the not yet converged frame pairs
+    active = np.arange(len(fx))
+    iterations = np.zeros(len(fx), dtype=int)
+    residuals = np.full(len(fx), np.nan)
+
     # iteration to reduce error
     for i in range(max_Niter):
+        if active.size == len(fx):
+            fx_a, fy_a, ft_a, denom_a = fx, fy, ft, denominator
+            vx_a, vy_a = vx, vy
+        else:
+            fx_a, fy_a, ft_a = fx[active], fy[active], ft[active]
+            denom_a = denominator[active]
+            vx_a, vy_a = vx[active], vy[active]
         # Compute local averages of the flow vectors (smoothness constraint)
-        vx_avg = conv(vx, kernelHS)
-        vy_avg = conv(vy, kernelHS)
+        vx_avg = conv(vx_a, kernelHS)
+        vy_avg = conv(vy_a, kernelHS)
         # common part of update step (brightness constancy)
-        der = (fx*vx_avg + fy*vy_avg + ft) / (alpha**2 + fx**2 + fy**2)
+        der = (fx_a*vx_avg + fy_a*vy_avg + ft_a) / denom_a
         # iterative step
-        new_vx = vx_avg - fx * der
-        new_vy = vy_avg - fy * der
-        # check convergence
-        max_dv = np.max([np.max(np.abs(vx-new_vx)),
-                         np.max(np.abs(vy-new_vy))])
-        vx, vy = new_vx, new_vy
-        if max_dv < convergence_limit:
+        new_vx = vx_avg - fx_a * der
+        new_vy = vy_avg - fy_a * der
+        # check convergence per frame pair
+        max_dv = np.maximum(np.max(np.abs(vx_a-new_vx), axis=(1,2)),
+                            np.max(np.abs(vy_a-new_vy), axis=(1,2)))
+        vx[active], vy[active] = new_vx, new_vy
+        iterations[active] += 1
+        residuals[active] = max_dv
+        active = active[max_dv >= convergence_limit]
+        if not active.size:
             break
-    return vx + vy*1j
+    return vx + vy*1j, iterations, residuals
+
 
+def restrict(frames):
+    """ Halves the resolution of a (t, y, x) stack by averaging 2x2 sites """
+    frames = np.pad(frames, ((0, 0), (0, frames.shape[1] % 2),
+                             (0, frames.shape[2] % 2)), mode='edge')
+    t, y, x = frames.shape
+    return frames.reshape(t, y//2, 2, x//2, 2).mean(axis=(2, 4))
+
+
+def prolong(frames, shape):
+    """ Doubles the resolution of a (t, y, x) stack, cropped to `shape` """
+    return frames.repeat(2, axis=1).repeat(2, axis=2)[:, :shape[0], :shape[1]]
+
+
+def jacobi_sweeps(J, rhs, alpha2, vx, vy, kernelHS, n_sweeps):
+    """
+    Jacobi sweeps for the Horn-Schunck equations in the general form
+        (alpha2 + J) v - alpha2 v_avg = rhs
+    at each site, with v = (vx, vy), the local average v_avg (kernelHS), and
+    the symmetric tensor J = (Jxx, Jxy, Jyy). On the finest grid, J is the
+    outer product of the spatial derivatives, rhs = -ft * (fx, fy), and a
+    sweep is the update step of horn_schunck_step.
+    """
+    Jxx, Jxy, Jyy = J
+    det = (alpha2 + Jxx) * (alpha2 + Jyy) - Jxy**2
+    for i in range(n_sweeps):
+        bx = alpha2 * conv(vx, kernelHS) + rhs[0]
+        by = alpha2 * conv(vy, kernelHS) + rhs[1]
+        vx, vy = ((alpha2 + Jyy) * bx - Jxy * by) / det, \
+                 ((alpha2 + Jxx) * by - Jxy * bx) / det
+    return vx, vy
+
+
+def multigrid_cycle(J, rhs, alpha2, vx, vy, kernelHS):
+    """
+    V-cycle for the equations of jacobi_sweeps: pre-smoothing, correction by
+    the error estimated on the grid of halved resolution (recursively), and
+    post-smoothing. On the coarser grid, J and the residual are averaged over
+    2x2 sites, and alpha2 is divided by 4, since the smoothness term scales
+    with the squared grid spacing.
+    """
+    shape = vx.shape[1:]
+    if min(shape) < 2*MIN_GRID_SIZE:
+        return jacobi_sweeps(J, rhs, alpha2, vx, vy, kernelHS,
+                             n_sweeps=COARSEST_GRID_SWEEPS)
+
+    vx, vy = jacobi_sweeps(J, rhs, alpha2, vx, vy, kernelHS,
+                           n_sweeps=MULTIGRID_SWEEPS)
+    Jxx, Jxy, Jyy = J
+    residual_x = rhs[0] - (alpha2 + Jxx) * vx - Jxy * vy \
+               + alpha2 * conv(vx, kernelHS)
+    residual_y = rhs[1] - Jxy * vx - (alpha2 + Jyy) * vy \
+               + alpha2 * conv(vy, kernelHS)
+
+    coarse_J = tuple(restrict(Ji) for Ji in J)
+    coarse_v = np.zeros_like(coarse_J[0])
+    error_x, error_y = multigrid_cycle(coarse_J,
+                                       (restrict(residual_x),
+                                        restrict(residual_y)),
+                                       alpha2=alpha2 / 4,
+                                       vx=coarse_v, vy=coarse_v,
+                                       kernelHS=kernelHS)
+    vx = vx + prolong(error_x, shape)
+    vy = vy + prolong(error_y, shape)
+    return jacobi_sweeps(J, rhs, alpha2, vx, vy, kernelHS,
+                         n_sweeps=MULTIGRID_SWEEPS)
+
+
+def horn_schunck_multigrid_step(fx, fy, ft, alpha, max_Niter,
+                                convergence_limit, kernelHS,
+                                initial_flow=None):
+    """
+    Multigrid variant of horn_schunck_step, solving the same equations by
+    V-cycles (see multigrid_cycle). The smooth components of the vector
+    fields, which converge slowly in the Jacobi iteration, are solved on the
+    coarse grids. The iterations count the sweeps on the finest grid
+    (2*MULTIGRID_SWEEPS per cycle), and the convergence is checked after each
+    cycle. Parameters and returns as horn_schunck_step.
+    """
+    if min(fx.shape[1:]) < 2*MIN_GRID_SIZE:
+        # too small to be coarsened
+        return horn_schunck_step(fx, fy, ft, alpha=alpha, max_Niter=max_Niter,
+                                 convergence_limit=convergence_limit,
+                                 kernelHS=kernelHS, initial_flow=initial_flow)
+    # set up initial velocities
+    if initial_flow is None:
+        vx = np.zeros_like(fx)
+        vy = np.zeros_like(fx)
+    else:
+        vx = np.real(initial_flow).astype(fx.dtype)
+        vy = np.imag(initial_flow).astype(fx.dtype)
+
+    kernelHS = kernelHS[np.newaxis]
+    J = (fx*fx, fx*fy, fy*fy)
+    rhs = (-fx*ft, -fy*ft)
+    sweeps_per_cycle = 2*MULTIGRID_SWEEPS
+    # indices of the not yet converged frame pairs
+    active = np.arange(len(fx))
+    iterations = np.zeros(len(fx), dtype=int)
+    residuals = np.full(len(fx), np.nan)
+
+    for i in range(max(max_Niter // sweeps_per_cycle, 1)):
+        if active.size == len(fx):
+            J_a, rhs_a, vx_a, vy_a = J, rhs, vx, vy
+        else:
+            J_a = tuple(Ji[active] for Ji in J)
+            rhs_a = tuple(rhs_i[active] for rhs_i in rhs)
+            vx_a, vy_a = vx[active], vy[active]
+        new_vx, new_vy = multigrid_cycle(J_a, rhs_a, alpha**2, vx_a, vy_a,
+                                         kernelHS=kernelHS)
+        # check convergence per frame pair
+        max_dv = np.maximum(np.max(np.abs(vx_a-new_vx), axis=(1,2)),
+                            np.max(np.abs(vy_a-new_vy), axis=(1,2)))
+        vx[active], vy[active] = new_vx, new_vy
+        iterations[active] += sweeps_per_cycle
+        residuals[active] = max_dv
+        active = active[max_dv >= convergence_limit]
+        if not active.size:
+            break
+    return vx + vy*1j, iterations, residuals
+
+
+def compute_derivatives(frames, kernelX, kernelY, kernelT, are_phases=False,
+                        pairs=None):
+    """
+    Derivatives of the frame pairs (pairs[i], pairs[i]+1) of the (t, y, x)
+    stack, by default of all pairs of consecutive frames.
+    Returns fx, fy, ft of shape (len(pairs), y, x).
+    """
+    if pairs is None:
+        pairs = np.arange(len(frames)-1)
+    # each involved frame is convolved only once
+    frame_ids, inverse = np.unique(np.concatenate((pairs, pairs+1)),
+                                   return_inverse=True)
+    first, second = inverse[:len(pairs)], inverse[len(pairs):]
+    if len(frame_ids) == frame_ids[-1] - frame_ids[0] + 1:
+        frames = frames[frame_ids[0]:frame_ids[-1]+1]
+    else:
+        frames = frames[frame_ids]
 
-def compute_derivatives(frame, next_frame, kernelX, kernelY,
-                        kernelT, are_phases=False):
     if are_phases:
-        fx = phase_conv2d(frame, kernelX) \
-           + phase_conv2d(next_frame, kernelX)
-        fy = phase_conv2d(frame, kernelY) \
-           + phase_conv2d(next_frame, kernelY)
-        ft = norm_angle(frame - next_frame)
+        dx = phase_conv2d(frames, kernelX)
+        dy = phase_conv2d(frames, kernelY)
+        ft = norm_angle(frames[first] - frames[second])
     else:
-        fx = conv(frame, kernelX) + conv(next_frame, kernelX)
-        fy = conv(frame, kernelY) + conv(next_frame, kernelY)
+        # 2D kernels applied to each frame
+        dx = conv(frames, kernelX[np.newaxis])
+        dy = conv(frames, kernelY[np.newaxis])
         # ft = conv(frame, kernelT) + conv(next_frame, -kernelT)
-        ft = frame - next_frame
-    return fx, fy, ft
+        ft = frames[first] - frames[second]
+    return dx[first] + dx[second], dy[first] + dy[second], ft
+
+def frame_pair_shards(pairs, warm_start=False, n_shards=1):
+    """
+    Splits the frame pairs (given by the indices of their first frames) into
+    batches, whose vector fields are optimized at once, and distributes the
+    batches over `n_shards` independent shards. Within a shard, the batches
+    are processed in order.
+    """
+    num_pairs = len(pairs)
+    if warm_start:
+        # The frame pairs are split into FRAME_CHUNK_SIZE blocks of
+        # consecutive pairs. The blocks are solved in parallel, pair by
+        # pair, each starting from the vector field of the previous pair.
+        block_length = max(int(np.ceil(num_pairs / FRAME_CHUNK_SIZE)), 1)
+        block_starts = np.arange(0, num_pairs, block_length)
+        shards = []
+        for starts in np.array_split(block_starts, n_shards):
+            batches = [starts + k for k in range(block_length)]
+            shards.append([pairs[batch[batch < num_pairs]]
+                           for batch in batches])
+    else:
+        batches = [pairs[start:start + FRAME_CHUNK_SIZE]
+                   for start in range(0, num_pairs, FRAME_CHUNK_SIZE)]
+        shards = [batches[i::n_shards] for i in range(n_shards)]
+    return [shard for shard in shards
+            if any(len(batch) for batch in shard)]
+
+
+def solve_frame_pairs(frames, vector_frames, iterations, residuals, batches,
+                      alpha, max_Niter, convergence_limit,
+                      kernelHS, kernelT, kernelX, kernelY,
+                      are_phases=False, warm_start=False, solver='jacobi'):
+    # writes the vector fields and the convergence of the batches of frame
+    # pairs into vector_frames, iterations, and residuals
+    solver_step = SOLVERS[solver]
+    for k, pairs in enumerate(batches):
+        if not len(pairs):
+            continue
+        fx, fy, ft = compute_derivatives(frames, pairs=pairs,
+                                         kernelX=kernelX,
+                                         kernelY=kernelY,
+                                         kernelT=kernelT,
+                                         are_phases=are_phases)
+        initial_flow = vector_frames[pairs-1] if warm_start and k else None
+        vector_frames[pairs], iterations[pairs], residuals[pairs] \
+            = solver_step(fx, fy, ft,
+                          alpha=alpha,
+                          max_Niter=max_Niter,
+                          convergence_limit=convergence_limit,
+                          kernelHS=kernelHS,
+                          initial_flow=initial_flow)
+    return None
+
+
+def _solve_shard(descriptors, batches, kwargs):
+    # worker process, operating on the shared frames and result arrays
+    solve_frame_pairs(*[attach(descriptor) for descriptor in descriptors],
+                      batches, **kwargs)
+    return None
+
 
 def horn_schunck(frames, alpha, max_Niter, convergence_limit,
                  kernelHS, kernelT, kernelX, kernelY,
-                 are_phases=False):
-
+                 are_phases=False, warm_start=False, solver='jacobi',
+                 n_jobs=1, pairs=None):
+    """
+    Returns the vector fields of the frames, and per frame pair the number of
+    iterations and the residual (maximum absolute change of the last
+    iteration). Only the frame pairs starting at the frame indices `pairs`
+    are computed, by default all.
+    """
     nan_channels = np.where(np.bitwise_not(np.isfinite(frames[0])))
     frames = interpolate_empty_sites(frames, are_phases)
 
-    vector_frames = np.zeros(frames.shape, dtype=complex)
-
-    for i, frame in enumerate(frames[:-1]):
-        next_frame = frames[i+1]
+    num_pairs = len(frames) - 1
+    # complex64 for float32 frames, complex128 for float64 frames
+    vector_dtype = np.result_type(frames.dtype, np.complex64)
+    solver_kwargs = dict(alpha=alpha, max_Niter=max_Niter,
+                         convergence_limit=convergence_limit,
+                         kernelHS=kernelHS, kernelT=kernelT,
+                         kernelX=kernelX, kernelY=kernelY,
+                         are_phases=are_phases, warm_start=warm_start,
+                         solver=solver)
+
+    if pairs is None:
+        pairs = np.arange(num_pairs)
+    n_jobs = get_n_jobs(n_jobs)
+    shards = frame_pair_shards(pairs, warm_start=warm_start,
+                               n_shards=n_jobs)
+
+    if len(shards) > 1:
+        # the shards are solved in separate processes, writing into the
+        # shared result arrays
+        with SharedArray.from_array(frames) as shared_frames, \
+             SharedArray.zeros(frames.shape, vector_dtype) as shared_vectors, \
+             SharedArray.zeros(num_pairs, int) as shared_iterations, \
+             SharedArray.zeros(num_pairs, float) as shared_residuals:
+            shared_arrays = (shared_frames, shared_vectors,
+                             shared_iterations, shared_residuals)
+            descriptors = [shared.descriptor for shared in shared_arrays]
+            run_parallel(_solve_shard,
+                         [(descriptors, shard, solver_kwargs)
+                          for shard in shards],
+                         n_jobs=n_jobs)
+            vector_frames = shared_vectors.array.copy()
+            iterations = shared_iterations.array.copy()
+            residuals = shared_residuals.array.copy()
+    else:
+        vector_frames = np.zeros(frames.shape, dtype=vector_dtype)
+        iterations = np.zeros(num_pairs, dtype=int)
+        residuals = np.zeros(num_pairs, dtype=float)
+        for shard in shards:
+            solve_frame_pairs(frames, vector_frames, iterations, residuals,
+                              shard, **solver_kwargs)
 
-        vector_frames[i] = horn_schunck_step(frame,
-                                             next_frame,
-                                             alpha=alpha,
-                                             max_Niter=max_Niter,
-                                             convergence_limit=convergence_limit,
-                                             kernelHS=kernelHS,
-                                             kernelT=kernelT,
-                                             kernelX=kernelX,
-                                             kernelY=kernelY,
-                                             are_phases=are_phases)
-        vector_frames[i][nan_channels] = np.nan + np.nan*1j
+    vector_frames[:-1, nan_channels[0], nan_channels[1]] = np.nan + np.nan*1j
 
     frames[:,nan_channels[0],nan_channels[1]] = np.nan
-    return vector_frames
+    return vector_frames, iterations, residuals
+
+
+def event_window_frames(times, event_times, padding):
+    """
+    Indices of the frames within `padding` before and after the event times,
+    including the first frame at or after each event time, at which the
+    optical flow is looked up for the event.
+    """
+    starts = np.searchsorted(times, event_times - padding, side='left')
+    stops = np.maximum(np.searchsorted(times, event_times + padding,
+                                       side='right'),
+                       np.searchsorted(times, event_times, side='left') + 1)
+    # union of the windows [start, stop)
+    window_count = np.zeros(len(times) + 2, dtype=int)
+    np.add.at(window_count, np.minimum(starts, len(times)), 1)
+    np.add.at(window_count, np.minimum(stops, len(times) + 1), -1)
+    return np.where(np.cumsum(window_count)[:len(times)] > 0)[0]
+
+
+def window_event_times(block, event_name):
+    # UP transitions mark the wave triggers
+    evt = block.filter(name=event_name, objects="Event")[0]
+    labels = evt.labels.astype(str)
+    if 'UP' in labels:
+        evt = evt[labels == 'UP']
+    return evt.times
+
+
+def irregular_vector_signal(vector_frames, times, imgseq, **kwargs):
+    """
+    Vector fields of the (not equidistant) frames at `times` as
+    IrregularlySampledSignal, with the same grid coordinates and annotations
+    as the AnalogSignal by imagesequence_to_analogsignal().
+    """
+    dim_t, dim_y, dim_x = vector_frames.shape
+    y_coords, x_coords = np.meshgrid(range(dim_y), range(dim_x),
+                                     indexing='ij')
+    annotations = copy(imgseq.annotations)
+    for key in ['nix_name', 'neo_name', 'array_annotations']:
+        annotations.pop(key, None)
+    annotations.update(spatial_scale=imgseq.spatial_scale)
+    annotations.update(kwargs)
+    return neo.IrregularlySampledSignal(
+                            times=times,
+                            signal=vector_frames.reshape(dim_t, dim_y*dim_x),
+                            units='dimensionless',
+                            dtype=vector_frames.dtype,
+                            name='optical_flow',
+                            file_origin=imgseq.file_origin,
+                            array_annotations={'x_coords': x_coords.ravel(),
+                                               'y_coords': y_coords.ravel()},
+                            **annotations)
+
+
+def convergence_event(times, iterations, residuals, convergence_limit,
+                      **annotations):
+    """
+    Event at the first frame (`times`) of each frame pair, labeled whether the
+    optimization of its vector field 'converged' or reached the maximum
+    number of iterations ('max_Niter').
+    """
+    labels = np.where(residuals < convergence_limit, 'converged', 'max_Niter')
+    evt = neo.Event(times=times,
+                    labels=labels,
+                    name='optical_flow_convergence',
+                    description='Number of iterations and residual (maximum '
+                                'absolute change of the last iteration) of '
+                                'the vector field of each frame pair',
+                    convergence_limit=convergence_limit,
+                    **annotations)
+    evt.array_annotations.update({'iterations': iterations,
+                                  'residuals': residuals})
+    return evt
+
+
+def fill_plan(is_finite):
+    """
+    Order in which the nan sites of a frame are filled, given its mask of
+    finite sites: a list of layers (targets, neighbours, is_used), with the
+    flat indices of the nan sites filled in this layer, the flat indices of
+    their 8 neighbour sites, and whether a neighbour is inside the frame and
+    already finite. Sites without finite neighbour are filled in a later
+    layer, thus the nan regions are filled from the edges inwards.
+    """
+    is_finite = is_finite.copy()
+    dim_y, dim_x = is_finite.shape
+    offsets = np.array(NEIGHBOUR_OFFSETS[8])
+    plan = []
+    while not is_finite.all():
+        y, x = np.where(~is_finite)
+        ny = y[:, np.newaxis] + offsets[:, 0]
+        nx = x[:, np.newaxis] + offsets[:, 1]
+        inside = (ny >= 0) & (ny < dim_y) & (nx >= 0) & (nx < dim_x)
+        neighbours = np.where(inside, ny * dim_x + nx, 0)
+        is_used = inside & is_finite.ravel()[neighbours]
+        is_target = is_used.any(axis=1)
+        if not is_target.any():
+            # no finite site to fill from
+            break
+        y, x = y[is_target], x[is_target]
+        plan.append((y * dim_x + x, neighbours[is_target], is_used[is_target]))
+        is_finite[y, x] = True
+    return plan
+
+
+def apply_fill_plan(frames, plan, are_phases=False):
+    """
+    Fills the nan sites of the (t, y, x) stack in place, with the sum of the
+    finite neighbour values, or for phases their circular mean.
+    """
+    for start in range(0, len(frames), FRAME_CHUNK_SIZE):
+        # flat view on the chunk
+        chunk = frames[start:start+FRAME_CHUNK_SIZE]
+        chunk = chunk.reshape(len(chunk), -1)
+        for targets, neighbours, is_used in plan:
+            values = chunk[:, neighbours]
+            if are_phases:
+                vectors = np.where(is_used, np.exp(1j*values), 0)
+                chunk[:, targets] = np.angle(np.sum(vectors, axis=-1))
+            else:
+                chunk[:, targets] = np.sum(np.where(is_used, values, 0),
+                                           axis=-1)
+    return frames
 
 
 def interpolate_empty_sites(frames, are_phases=False):
-    if np.isfinite(frames).all():
+    is_finite = np.isfinite(frames)
+    if is_finite.all():
         return frames
-    dim_y, dim_x = frames[0].shape
-    grid_y, grid_x = np.meshgrid([-1,0,1],[-1,0,1], indexing='ij')
-
-    for i, frame in enumerate(frames):
-        new_frame = copy(frame)
-        while not np.isfinite(new_frame).all():
-            y, x = np.where(np.bitwise_not(np.isfinite(new_frame)))
-            # loop over nan-sites
-            for xi, yi in zip(x,y):
-                neighbours = []
-                # collect neighbours of each site
-                for dx, dy in zip(grid_x.flatten(), grid_y.flatten()):
-                    xn = xi+dx
-                    yn = yi+dy
-                    if (0 <= xn) & (xn < dim_x) & (0 <= yn) & (yn < dim_y):
-                        neighbours.append(frames[i, yn, xn])
-                # average over neihbour values
-                if np.isfinite(neighbours).any():
-                    if are_phases:
-                        vectors = np.exp(1j*np.array(neighbours))
-                        new_frame[yi,xi] = np.angle(np.nansum(vectors))
-                    else:
-                        new_frame[yi,xi] = np.nansum(neighbours)
-            frames[i] = new_frame
-    return frames
+    # frames may be a view on the input signal
+    filled_frames = frames.copy()
+    # assume constant nan sites over time, frames with other nan sites
+    # are filled separately
+    apply_fill_plan(filled_frames, fill_plan(is_finite[0]), are_phases)
+    is_constant = (is_finite == is_finite[0]).all(axis=(1,2))
+    for i in np.where(~is_constant)[0]:
+        filled_frames[i] = frames[i]
+        apply_fill_plan(filled_frames[i:i+1], fill_plan(is_finite[i]),
+                        are_phases)
+    return filled_frames
 
 
 def smooth_frames(frames, sigma):
@@ -211,6 +598,10 @@ def plot_opticalflow(frame, vec_frame, skip_step=None, are_phases=False):
     ax.set_yticks([])
     return ax
 
+SOLVERS = {'jacobi': horn_schunck_step,
+           'multigrid': horn_schunck_multigrid_step}
+
+
 def is_phase_signal(signal, use_phases):
     vmin = np.nanmin(signal)
     vmax = np.nanmax(signal)
@@ -234,7 +625,7 @@ if __name__ == '__main__':
     block = load_neo(args.data)
 
     asig = block.segments[0].analogsignals[0]
-    imgseq = analogsignal_to_imagesequence(asig)
+    imgseq = analogsignal_to_imagesequence(asig, copy=False)
 
     frames = imgseq.as_array()
     # frames /= np.nanmax(np.abs(frames))
@@ -243,50 +634,98 @@ if __name__ == '__main__':
         args.use_phases = True
     elif args.use_phases:
         analytic_frames = hilbert(frames, axis=0)
-        frames = np.angle(analytic_frames)
+        frames = np.angle(analytic_frames).astype(frames.dtype)
 
     kernelHS = np.array([[1, 2, 1],
                          [2, 0, 2],
-                         [1, 2, 1]], dtype=float) * 1/12
+                         [1, 2, 1]], dtype=frames.dtype) * 1/12
     kernel = get_kernel(args.derivative_filter)
-    kernelT = np.ones_like(kernel.x, dtype=float)
+    kernelT = np.ones_like(kernel.x, dtype=frames.dtype)
     kernelT /= np.sum(kernelT)
 
-    vector_frames = horn_schunck(frames=frames,
-                                 alpha=args.alpha,
-                                 max_Niter=args.max_Niter,
-                                 convergence_limit=args.convergence_limit,
-                                 kernelX=kernel.x,
-                                 kernelY=kernel.y,
-                                 kernelT=kernelT,
-                                 kernelHS=kernelHS,
-                                 are_phases=args.use_phases)
+    if args.window_event is None:
+        frame_ids = np.arange(len(frames))
+        pairs = frame_ids[:-1]
+    else:
+        event_times = window_event_times(block, args.window_event)
+        frame_ids = event_window_frames(
+                            asig.times.rescale('s').magnitude,
+                            event_times.rescale('s').magnitude,
+                            padding=args.window_padding)
+        pairs = frame_ids[frame_ids < len(frames) - 1]
+        print(f'The optical flow is computed for {len(pairs)} of '
+              f'{len(frames) - 1} frame pairs, within {args.window_padding} s '
+              f'of the {len(event_times)} {args.window_event} events.')
+
+    vector_frames, iterations, residuals \
+        = horn_schunck(frames=frames,
+                       alpha=args.alpha,
+                       max_Niter=args.max_Niter,
+                       convergence_limit=args.convergence_limit,
+                       kernelX=kernel.x.astype(frames.dtype),
+                       kernelY=kernel.y.astype(frames.dtype),
+                       kernelT=kernelT,
+                       kernelHS=kernelHS,
+                       are_phases=args.use_phases,
+                       warm_start=args.warm_start,
+                       solver=args.solver,
+                       n_jobs=args.n_jobs,
+                       pairs=pairs)
+    iterations, residuals = iterations[pairs], residuals[pairs]
+    print(f'{np.sum(residuals < args.convergence_limit)} of {len(residuals)} '
+          f'frame pairs converged ({args.solver} solver, '
+          f'{np.mean(iterations):.1f} iterations on average)')
 
     if np.sum(args.gaussian_sigma):
-        vector_frames = smooth_frames(vector_frames, sigma=args.gaussian_sigma)
-
-    vec_imgseq = neo.ImageSequence(vector_frames,
-                                   units='dimensionless',
-                                   dtype=complex,
-                                   t_start=imgseq.t_start,
-                                   spatial_scale=imgseq.spatial_scale,
-                                   sampling_rate=imgseq.sampling_rate,
-                                   name='optical_flow',
-                                   description='Horn-Schunck estimation of optical flow',
-                                   file_origin=imgseq.file_origin)
-   
-    vec_imgseq.annotations = copy(imgseq.annotations)
+        # windows of consecutive frames are smoothed separately
+        for window in np.split(frame_ids,
+                               np.where(np.diff(frame_ids) > 1)[0] + 1):
+            window = slice(window[0], window[-1] + 1)
+            vector_frames[window] = smooth_frames(vector_frames[window],
+                                                  sigma=args.gaussian_sigma)
 
     if args.output_img is not None:
-        ax = plot_opticalflow(frames[10], vector_frames[10],
+        plot_id = frame_ids[min(10, len(frame_ids) - 1)]
+        ax = plot_opticalflow(frames[plot_id], vector_frames[plot_id],
                               skip_step=None, are_phases=args.use_phases)
         ax.set_ylabel(f'pixel size: {imgseq.spatial_scale} ')
-        ax.set_xlabel('{:.3f} s'.format(asig.times[0].rescale('s').magnitude))
+        ax.set_xlabel('{:.3f} s'.format(asig.times[plot_id]
+                                        .rescale('s').magnitude))
         save_plot(args.output_img)
 
-    # block.segments[0].imagesequences = [vec_imgseq]
-    vec_asig = imagesequence_to_analogsignal(vec_imgseq)
+    if args.window_event is None:
+        vec_imgseq = neo.ImageSequence(vector_frames,
+                                       units='dimensionless',
+                                       dtype=vector_frames.dtype,
+                                       t_start=imgseq.t_start,
+                                       spatial_scale=imgseq.spatial_scale,
+                                       sampling_rate=imgseq.sampling_rate,
+                                       name='optical_flow',
+                                       description='Horn-Schunck estimation of optical flow',
+                                       file_origin=imgseq.file_origin)
+
+        vec_imgseq.annotations = copy(imgseq.annotations)
 
-    block.segments[0].analogsignals.append(vec_asig)
+        # block.segments[0].imagesequences = [vec_imgseq]
+        vec_asig = imagesequence_to_analogsignal(vec_imgseq)
+
+        block.segments[0].analogsignals.append(vec_asig)
+    else:
+        vec_isig = irregular_vector_signal(
+                        vector_frames[frame_ids],
+                        times=asig.times[frame_ids],
+                        imgseq=imgseq,
+                        description='Horn-Schunck estimation of optical flow '
+                                    f'within {args.window_padding} s of the '
+                                    f'{args.window_event} events',
+                        window_event=args.window_event,
+                        window_padding=args.window_padding)
+        block.segments[0].irregularlysampledsignals.append(vec_isig)
+
+    block.segments[0].events.append(
+                    convergence_event(asig.times[pairs], iterations, residuals,
+                                      convergence_limit=args.convergence_limit,
+                                      solver=args.solver,
+                                      max_Niter=args.max_Niter))
 
     write_neo(args.output, block)
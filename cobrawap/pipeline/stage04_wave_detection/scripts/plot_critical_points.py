@@ -51,7 +51,7 @@ if __name__ == '__main__':
         raise ValueError("Input does not contain a signal with name " \
                        + "'optical_flow'!")
    
-    imgseq = analogsignal_to_imagesequence(asig)
+    imgseq = analogsignal_to_imagesequence(asig, copy=False)
 
     crit_point_evt = [evt for evt in block.segments[0].events
                       if evt.name == "critical_points"]
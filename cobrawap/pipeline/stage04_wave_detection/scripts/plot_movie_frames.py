@@ -64,7 +64,7 @@ def get_opticalflow(block, imgseq_name="optical_flow"):
     asigs = block.filter(name=imgseq_name, objects="AnalogSignal")
     if len(asigs):
         # Normalize?
-        return analogsignal_to_imagesequence(asigs[0])
+        return analogsignal_to_imagesequence(asigs[0], copy=False)
     else:
         return None
 
@@ -120,7 +120,7 @@ if __name__ == '__main__':
 
     blk = load_neo(args.data)
     asig = blk.segments[0].analogsignals[0]
-    imgseq = analogsignal_to_imagesequence(asig)
+    imgseq = analogsignal_to_imagesequence(asig, copy=False)
     
     optical_flow = get_opticalflow(blk)
 
@@ -10,6 +10,7 @@ from pathlib import Path
 import matplotlib.pyplot as plt
 from utils.io_utils import load_neo, save_plot
 from utils.neo_utils import analogsignal_to_imagesequence
+from utils.spatial_grid import SpatialGrid
 
 CLI = argparse.ArgumentParser()
 CLI.add_argument("--data", nargs='?', type=Path,
@@ -86,10 +87,18 @@ if __name__ == '__main__':
     block = load_neo(args.data)
 
     asig = block.segments[0].analogsignals[0]
-    vec_asig = block.filter(name='optical_flow', objects="AnalogSignal")[0]
-
-    frames = analogsignal_to_imagesequence(asig).as_array()
-    vec_frames = analogsignal_to_imagesequence(vec_asig).as_array()
+    vec_asig = block.filter(name='optical_flow',
+                            objects=["AnalogSignal",
+                                     "IrregularlySampledSignal"])[0]
+
+    frames = analogsignal_to_imagesequence(asig, copy=False).as_array()
+    # the event-windowed optical flow only covers a subset of the frames
+    vec_frames = np.full(frames.shape, np.nan, dtype=vec_asig.dtype)
+    vec_ids = np.searchsorted(asig.times.magnitude,
+                              vec_asig.times.rescale(asig.times.units)
+                                            .magnitude)
+    vec_frames[vec_ids] = SpatialGrid.from_signal(vec_asig).to_grid(
+                                                        vec_asig.as_array())
 
     waves_event = block.filter(name='wavefronts', objects="Event")[0]
 
@@ -4,12 +4,20 @@ Detect waves by clustering triggers that are close to each other in time and spa
 
 import neo
 import numpy as np
+import pandas as pd
 import quantities as pq
 import argparse
+import itertools
 from pathlib import Path
+from warnings import warn
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components
 from sklearn.cluster import DBSCAN
+from sklearn.neighbors import KDTree, NearestNeighbors
 from utils.io_utils import load_neo, write_neo
 from utils.neo_utils import remove_annotations
+from utils.parallel import SharedArray, attach, get_n_jobs, run_parallel
+from utils.parse import str_to_bool, none_or_float
 
 CLI = argparse.ArgumentParser()
 CLI.add_argument("--data", nargs='?', type=Path, required=True,
@@ -24,9 +32,42 @@ CLI.add_argument("--neighbour_distance", nargs='?', type=float, default=30,
                  help="eps parameter in sklearn.cluster.DBSCAN")
 CLI.add_argument("--min_samples", nargs='?', type=int, default=10,
                  help="minimum number of trigger times to form a wavefront")
-                    
-def cluster_triggers(event, metric, neighbour_distance, min_samples,
-                     time_space_ratio, sampling_rate):
+CLI.add_argument("--delta_write", nargs='?', type=str_to_bool, default=False,
+                 help="only write the added objects, referencing the input file")
+CLI.add_argument("--window_length", "--clustering_window_length", nargs='?',
+                 type=none_or_float, default=None,
+                 help="length (in s) of the time windows, which are clustered "
+                      "separately and stitched, None for a single DBSCAN fit")
+CLI.add_argument("--algorithm", "--clustering_algorithm", nargs='?', type=str,
+                 default='auto', choices=['auto', 'ball_tree', 'kd_tree', 'brute'],
+                 help="algorithm of sklearn.neighbors.NearestNeighbors to "
+                      "compute the neighbour graph")
+CLI.add_argument("--n_jobs", nargs='?', type=int, default=1,
+                 help='number of parallel jobs computing the neighbour graph '
+                      '(or processing the time windows), <1 for all CPUs')
+CLI.add_argument("--sweep_neighbour_distance", "--SWEEP_NEIGHBOUR_DISTANCE",
+                 nargs='+', type=float, default=None,
+                 help="neighbour_distance values of the parameter sweep")
+CLI.add_argument("--sweep_min_samples", "--SWEEP_MIN_SAMPLES",
+                 nargs='+', type=int, default=None,
+                 help="min_samples values of the parameter sweep")
+CLI.add_argument("--sweep_time_space_ratio", "--SWEEP_TIME_SPACE_RATIO",
+                 nargs='+', type=float, default=None,
+                 help="time_space_ratio values of the parameter sweep. "
+                      "When any sweep values are given, the clustering "
+                      "statistics of all parameter combinations are written "
+                      "as csv table to the output path instead of the waves.")
+
+# metrics, for which the time difference is bounded by the distance
+WINDOWED_METRICS = ['euclidean', 'l2', 'manhattan', 'l1', 'cityblock',
+                    'chebyshev', 'infinity']
+
+
+def trigger_coordinates(event, time_space_ratio, sampling_rate):
+    """
+    Returns the indices of the UP transitions of the event, and their
+    (x, y, t) coordinates, with t in frames scaled by the time_space_ratio.
+    """
     up_idx = np.where(event.labels == 'UP')[0]
     # build 3D array of trigger times
     triggers = np.zeros((len(up_idx), 3))
@@ -34,24 +75,195 @@ def cluster_triggers(event, metric, neighbour_distance, min_samples,
     triggers[:,1] = event.array_annotations['y_coords'][up_idx]
     triggers[:,2] = event.times[up_idx].rescale('s') \
                     * sampling_rate.rescale('Hz') * time_space_ratio
+    return up_idx, triggers
+
+
+def neighbour_graph(triggers, radius, metric='euclidean', algorithm='auto',
+                    n_jobs=1):
+    """
+    Sparse graph (CSR) of the distances between all triggers within `radius`,
+    queried in parallel from a KD-tree or ball tree. The graph serves as
+    precomputed input for the DBSCAN clustering with any eps <= radius.
+    """
+    model = NearestNeighbors(radius=radius, metric=metric,
+                             algorithm=algorithm, n_jobs=get_n_jobs(n_jobs))
+    model.fit(triggers)
+    return model.radius_neighbors_graph(triggers, mode='distance',
+                                        sort_results=True)
+
+
+def dbscan_labels(graph, eps, min_samples):
+    # only the graph entries within eps are neighbours
+    clustering = DBSCAN(eps=eps, min_samples=min_samples,
+                        metric='precomputed')
+    return clustering.fit(graph).labels_
+
+
+def _neighbors_model(eps, metric, algorithm='auto'):
+    # the tree-based radius queries compare the same pairwise distances
+    # regardless of which points are in the tree
+    if algorithm not in ['kd_tree', 'ball_tree']:
+        algorithm = 'kd_tree' if metric in KDTree.valid_metrics \
+                    else 'ball_tree'
+    return NearestNeighbors(radius=eps, metric=metric, algorithm=algorithm)
+
+
+def _window_neighbourhoods(points, start, stop, eps, metric, algorithm):
+    # neighbourhoods of points[start:stop] among all points of the window
+    model = _neighbors_model(eps, metric, algorithm).fit(points)
+    return model.radius_neighbors(points[start:stop], return_distance=False)
+
+
+def _count_neighbours(points, start, stop, eps, metric, algorithm):
+    neighbourhoods = _window_neighbourhoods(points, start, stop, eps, metric,
+                                            algorithm)
+    return np.array([len(neighbours) for neighbours in neighbourhoods],
+                    dtype=int)
+
+
+def _link_core_points(points, is_core, start, stop, eps, metric, algorithm):
+    """
+    Connects the core points of points[start:stop] with their core neighbours
+    in the window. Returns the edges of each connected core point to the
+    first core point of its local component, and the (border point, core
+    neighbour) pairs of the non-core points, as window indices.
+    """
+    neighbourhoods = _window_neighbourhoods(points, start, stop, eps, metric,
+                                            algorithm)
+    sources = np.repeat(np.arange(start, stop),
+                        [len(neighbours) for neighbours in neighbourhoods])
+    targets = np.concatenate(neighbourhoods) if len(neighbourhoods) \
+              else np.empty(0, dtype=int)
+    is_core_edge = is_core[targets]
+    targets, sources = targets[is_core_edge], sources[is_core_edge]
+
+    is_core_source = is_core[sources]
+    num_points = len(points)
+    graph = coo_matrix((np.ones(np.sum(is_core_source), dtype=bool),
+                        (sources[is_core_source], targets[is_core_source])),
+                       shape=(num_points, num_points))
+    _, components = connected_components(graph, directed=False)
+    linked = np.unique(targets[is_core_source])
+    first_point = np.full(num_points, num_points)
+    np.minimum.at(first_point, components[linked], linked)
+    core_edges = np.stack([linked, first_point[components[linked]]])
+    border_pairs = np.stack([sources[~is_core_source],
+                             targets[~is_core_source]])
+    return core_edges, border_pairs
+
+
+def dbscan_windowed(points, eps, min_samples, metric, window_length,
+                    algorithm='auto', n_jobs=1):
+    """
+    Returns the labels of the DBSCAN clustering of the points, whose last
+    coordinate is time, as a single sklearn.cluster.DBSCAN fit would.
+    The points are clustered in separate time windows, each extended by eps
+    before and after, and the cluster labels are stitched across the windows.
+    """
+    num_points = len(points)
+    if not num_points:
+        return np.empty(0, dtype=int)
+    order = np.argsort(points[:, -1], kind='stable')
+    points = points[order]
+    t = points[:, -1]
+
+    num_windows = int((t[-1] - t[0]) // window_length) + 1
+    window_starts = np.unique(np.searchsorted(
+                        t, t[0] + window_length * np.arange(num_windows),
+                        side='left'))
+    window_stops = np.append(window_starts[1:], num_points)
+    # neighbours are at most eps apart in time
+    halo_starts = np.searchsorted(t, t[window_starts] - eps, side='left')
+    halo_stops = np.searchsorted(t, t[window_stops - 1] + eps, side='right')
+    windows = list(zip(halo_starts, halo_stops,
+                       window_starts - halo_starts, window_stops - halo_starts))
 
-    clustering = DBSCAN(eps=neighbour_distance,
-                        min_samples=min_samples,
-                        metric=metric)
-    clustering.fit(triggers)
+    counts = run_parallel(_count_neighbours,
+                          [(points[lo:hi], start, stop, eps, metric,
+                            algorithm)
+                           for lo, hi, start, stop in windows],
+                          n_jobs=n_jobs)
+    is_core = np.concatenate(counts) >= min_samples
 
-    if len(np.unique(clustering.labels_)) < 1:
+    results = run_parallel(_link_core_points,
+                           [(points[lo:hi], is_core[lo:hi], start, stop,
+                             eps, metric, algorithm)
+                            for lo, hi, start, stop in windows],
+                           n_jobs=n_jobs)
+    core_edges = np.concatenate([edges + lo for (edges, _), (lo, *_)
+                                 in zip(results, windows)], axis=1)
+    border_pairs = np.concatenate([pairs + lo for (_, pairs), (lo, *_)
+                                   in zip(results, windows)], axis=1)
+
+    # stitching the local components of the windows
+    graph = coo_matrix((np.ones(core_edges.shape[1], dtype=bool),
+                        (core_edges[0], core_edges[1])),
+                       shape=(num_points, num_points))
+    _, components = connected_components(graph, directed=False)
+
+    # clusters are numbered in the order of their first core point,
+    # as by sklearn
+    labels = np.full(num_points, -1, dtype=int)
+    core_idx = np.where(is_core)[0]
+    first_index = np.full(num_points, np.iinfo(int).max)
+    np.minimum.at(first_index, components[core_idx], order[core_idx])
+    cluster_components = np.unique(components[core_idx])
+    cluster_ids = np.empty(num_points, dtype=int)
+    cluster_ids[cluster_components] = np.argsort(np.argsort(
+                        first_index[cluster_components], kind='stable'))
+    labels[core_idx] = cluster_ids[components[core_idx]]
+
+    # border points join the first expanded cluster of their core neighbours
+    border_labels = np.full(num_points, np.iinfo(int).max)
+    np.minimum.at(border_labels, border_pairs[0], labels[border_pairs[1]])
+    is_border = border_labels < np.iinfo(int).max
+    labels[is_border] = border_labels[is_border]
+
+    unsorted_labels = np.empty(num_points, dtype=int)
+    unsorted_labels[order] = labels
+    return unsorted_labels
+
+
+def cluster_triggers(event, metric, neighbour_distance, min_samples,
+                     time_space_ratio, sampling_rate, window_length=None,
+                     algorithm='auto', n_jobs=1):
+    up_idx, triggers = trigger_coordinates(event, time_space_ratio,
+                                           sampling_rate)
+
+    if window_length is not None and metric not in WINDOWED_METRICS:
+        warn(f"The time windows are not supported for the metric '{metric}'! "
+              "Using a single DBSCAN fit instead.")
+        window_length = None
+
+    if window_length is None:
+        graph = neighbour_graph(triggers, radius=neighbour_distance,
+                                metric=metric, algorithm=algorithm,
+                                n_jobs=n_jobs)
+        cluster_labels = dbscan_labels(graph, eps=neighbour_distance,
+                                       min_samples=min_samples)
+    else:
+        cluster_labels = dbscan_windowed(triggers,
+                                eps=neighbour_distance,
+                                min_samples=min_samples,
+                                metric=metric,
+                                window_length=window_length \
+                                    * sampling_rate.rescale('Hz').magnitude \
+                                    * time_space_ratio,
+                                algorithm=algorithm,
+                                n_jobs=n_jobs)
+
+    if len(np.unique(cluster_labels)) < 1:
         raise ValueError("No clusters found, please adapt the parameters!")
 
     # remove unclassified trigger points (label == -1)
-    cluster_idx = np.where(clustering.labels_ != -2)[0]
+    cluster_idx = np.where(cluster_labels != -2)[0]
     if not len(cluster_idx):
         raise ValueError("Clusters couldn't be classified, please adapt the parameters!")
 
     wave_idx = up_idx[cluster_idx]
 
     evt = neo.Event(times=event.times[wave_idx],
-                    labels=clustering.labels_[cluster_idx].astype(str),
+                    labels=cluster_labels[cluster_idx].astype(str),
                     name='wavefronts',
                     array_annotations={'channels':event.array_annotations['channels'][wave_idx],
                                        'x_coords':triggers[:,0][cluster_idx].astype(int),
@@ -69,6 +281,79 @@ def cluster_triggers(event, metric, neighbour_distance, min_samples,
     evt.annotations.update(event.annotations)
     return evt
 
+
+def sweep_statistics(labels):
+    """
+    Number of waves, fraction of unclustered triggers, and the statistics
+    of the number of triggers per wave of a clustering.
+    """
+    is_wave = labels >= 0
+    _, wave_sizes = np.unique(labels[is_wave], return_counts=True)
+    num_waves = len(wave_sizes)
+    if not num_waves:
+        wave_sizes = np.array([np.nan])
+    return {'num_waves': num_waves,
+            'noise_fraction': np.mean(~is_wave) if len(labels) else np.nan,
+            'wave_size_mean': np.mean(wave_sizes),
+            'wave_size_median': np.median(wave_sizes),
+            'wave_size_min': np.min(wave_sizes),
+            'wave_size_max': np.max(wave_sizes)}
+
+
+def _sweep_shared_graph(descriptors, eps, min_samples):
+    # worker process, operating on the shared CSR arrays of the graph
+    data, indices, indptr = [attach(descriptor)
+                             for descriptor in descriptors]
+    num_triggers = len(indptr) - 1
+    graph = csr_matrix((data, indices, indptr),
+                       shape=(num_triggers, num_triggers))
+    return sweep_statistics(dbscan_labels(graph, eps, min_samples))
+
+
+def parameter_sweep(event, sampling_rate, neighbour_distances, min_samples,
+                    time_space_ratios, metric='euclidean', algorithm='auto',
+                    n_jobs=1):
+    """
+    Returns a table of the clustering statistics of all combinations of
+    neighbour_distances, min_samples, and time_space_ratios. The neighbour
+    graph is computed once per time_space_ratio, for the largest
+    neighbour_distance, and reused by all DBSCAN fits with smaller eps.
+    """
+    combinations = list(itertools.product(sorted(set(neighbour_distances)),
+                                          sorted(set(min_samples))))
+    rows = []
+    for time_space_ratio in sorted(set(time_space_ratios)):
+        _, triggers = trigger_coordinates(event, time_space_ratio,
+                                          sampling_rate)
+        graph = neighbour_graph(triggers,
+                                radius=max(neighbour_distances),
+                                metric=metric, algorithm=algorithm,
+                                n_jobs=n_jobs)
+        if get_n_jobs(n_jobs) > 1 and len(combinations) > 1:
+            # the combinations are clustered in separate processes,
+            # reading the graph from shared memory
+            with SharedArray.from_array(graph.data) as data, \
+                 SharedArray.from_array(graph.indices) as indices, \
+                 SharedArray.from_array(graph.indptr) as indptr:
+                descriptors = (data.descriptor, indices.descriptor,
+                               indptr.descriptor)
+                stats = run_parallel(_sweep_shared_graph,
+                                     [(descriptors, eps, samples)
+                                      for eps, samples in combinations],
+                                     n_jobs=n_jobs)
+        else:
+            stats = [sweep_statistics(dbscan_labels(graph, eps, samples))
+                     for eps, samples in combinations]
+
+        rows += [{'time_space_ratio': time_space_ratio,
+                  'neighbour_distance': eps,
+                  'min_samples': samples,
+                  'num_triggers': len(triggers),
+                  **stat}
+                 for (eps, samples), stat in zip(combinations, stats)]
+    return pd.DataFrame(rows)
+
+
 if __name__ == '__main__':
     args, unknown = CLI.parse_known_args()
 
@@ -77,18 +362,41 @@ if __name__ == '__main__':
 
     evts = block.filter(name='transitions', objects="Event")[0]
 
-    if len(evts):
-        wave_evt = cluster_triggers(event=evts,
-                                    metric=args.metric,
-                                    neighbour_distance=args.neighbour_distance,
-                                    min_samples=args.min_samples,
-                                    time_space_ratio=args.time_space_ratio,
-                                    sampling_rate=asig.sampling_rate)
+    sweep_values = [args.sweep_neighbour_distance, args.sweep_min_samples,
+                    args.sweep_time_space_ratio]
+    if any(values is not None for values in sweep_values):
+        # parameters without sweep values are kept fixed
+        df = parameter_sweep(event=evts,
+                             sampling_rate=asig.sampling_rate,
+                             neighbour_distances=args.sweep_neighbour_distance \
+                                                 or [args.neighbour_distance],
+                             min_samples=args.sweep_min_samples \
+                                         or [args.min_samples],
+                             time_space_ratios=args.sweep_time_space_ratio \
+                                               or [args.time_space_ratio],
+                             metric=args.metric,
+                             algorithm=args.algorithm,
+                             n_jobs=args.n_jobs)
+        print(df.to_string(index=False))
+        df.to_csv(args.output, index=False)
 
     else:
-        wave_evt = neo.Event(name='wavefronts', 
-                             times=np.array([])*pq.s, labels=[])
+        if len(evts):
+            wave_evt = cluster_triggers(event=evts,
+                                        metric=args.metric,
+                                        neighbour_distance=args.neighbour_distance,
+                                        min_samples=args.min_samples,
+                                        time_space_ratio=args.time_space_ratio,
+                                        sampling_rate=asig.sampling_rate,
+                                        window_length=args.window_length,
+                                        algorithm=args.algorithm,
+                                        n_jobs=args.n_jobs)
+
+        else:
+            wave_evt = neo.Event(name='wavefronts', 
+                                 times=np.array([])*pq.s, labels=[])
 
-    block.segments[0].events.append(wave_evt)
+        block.segments[0].events.append(wave_evt)
 
-    write_neo(args.output, block)
+        write_neo(args.output, block,
+                  parent=args.data if args.delta_write else None)
@@ -21,6 +21,7 @@ import matplotlib.pyplot as plt
 from utils.io_utils import load_neo, write_neo, save_plot
 from utils.parse import none_or_int, none_or_path
 from utils.neo_utils import analogsignal_to_imagesequence, remove_annotations
+from utils.spatial_grid import SpatialGrid
 
 CLI = argparse.ArgumentParser()
 CLI.add_argument("--data", nargs='?', type=Path, required=True,
@@ -52,29 +53,29 @@ CLI.add_argument("--interpolation_smoothing", "--INTERPOLATION_SMOOTHING",
                  help="0: no smoothing, >0: more smoothing")
 
 def build_timelag_dataframe(waves_evt, normalize=True):
-    wave_ids = np.unique(waves_evt.labels).astype(int)
-    channel_ids = np.unique(waves_evt.array_annotations['channels'])
+    wave_ids, wave_pos = np.unique(waves_evt.labels, return_inverse=True)
+    wave_ids = wave_ids.astype(int)
+    channel_ids, channel_pos = np.unique(
+                                    waves_evt.array_annotations['channels'],
+                                    return_inverse=True)
 
-    # init dataframe
+    # use only first trigger per channel and wave
+    _, first_idx = np.unique(wave_pos * len(channel_ids) + channel_pos,
+                             return_index=True)
+
+    # fill timelag matrix
     timelag_matrix = np.empty((len(wave_ids), len(channel_ids))) * np.nan
+    timelag_matrix[wave_pos[first_idx], channel_pos[first_idx]] \
+                                        = waves_evt.magnitude[first_idx]
+
+    if normalize:
+        timelag_matrix -= np.nanmean(timelag_matrix, axis=1, keepdims=True)
+
     timelag_df = pd.DataFrame(timelag_matrix,
                               index=wave_ids,
                               columns=channel_ids)
     timelag_df.index.name = 'wave_ids'
     timelag_df.columns.name = 'channel_ids'
-
-    # fill timelag dataframe
-    for i, trigger in enumerate(waves_evt):
-        wave_id = int(trigger.labels)
-        channel_id = waves_evt.array_annotations['channels'][i]
-        # use only first trigger per channel and wave
-        if np.isnan(timelag_df[channel_id][wave_id]):
-            timelag_df[channel_id][wave_id] = trigger.magnitude
-
-    if normalize:
-        norm_func = lambda row: row - np.nanmean(row)
-        timelag_df = timelag_df.apply(norm_func, axis=1)
-
     return timelag_df
 
 def fill_nan_sites_from_similar_waves(timelag_df, num_neighbours=5,
@@ -172,23 +173,21 @@ def build_cluster_timelag_dataframe(timelag_df, cluster_labels):
     return cluster_timelag_df
 
 def arange_on_grid(df, channels, x_coords, y_coords):
-    dim_x, dim_y = np.max(x_coords)+1, np.max(y_coords)+1
-    grid = np.empty((df.index.size, dim_y, dim_x)) * np.nan
-    for row, wave in enumerate(df.iterrows()):
-        wave = wave[1]
-        for channel_id, timelag in zip(wave.index, wave):
-            i = np.where(channel_id == channels)[0]
-            x, y = x_coords[i], y_coords[i]
-            grid[row,y,x] = timelag
-    return grid
+    grid = SpatialGrid(x_coords, y_coords)
+    # position of the dataframe columns (channel ids) in channels
+    channels = np.asarray(channels)
+    order = np.argsort(channels, kind='stable')
+    pos = np.searchsorted(channels, df.columns.values, sorter=order)
+    pos = order[np.minimum(pos, len(channels)-1)]
+    is_channel = channels[pos] == df.columns.values
+    values = np.empty((df.index.size, len(channels))) * np.nan
+    values[:, pos[is_channel]] = df.values[:, is_channel]
+    return grid.to_grid(values)
 
 def wave_to_grid(wave_evt):
     timelag_df = build_timelag_dataframe(wave_evt)
-    channels = np.unique(wave_evt.array_annotations['channels']).astype(int)
-    annotation_idx = [np.argmax(wave_evt.array_annotations['channels']==channel) for channel in channels]
-    x_coords = wave_evt.array_annotations['x_coords'][annotation_idx].astype(int)
-    y_coords = wave_evt.array_annotations['y_coords'][annotation_idx].astype(int)
-    grids = arange_on_grid(timelag_df, channels, x_coords, y_coords)
+    grid, channels = SpatialGrid.from_event(wave_evt)
+    grids = arange_on_grid(timelag_df, channels, grid.x_coords, grid.y_coords)
     return grids
 
 def sample_wave_pattern(pattern_func, dim_x, dim_y, step):
@@ -372,7 +371,7 @@ if __name__ == '__main__':
 
     # add clustered wave modes as additional event 'wavemodes'
     n_modes, inter_dim_y, inter_dim_x = interpolated_mode_grids.shape
-    imgseq = analogsignal_to_imagesequence(asig)
+    imgseq = analogsignal_to_imagesequence(asig, copy=False)
 
     site_grid = np.isfinite(imgseq[0].as_array())
     interpolated_site_grid = resize(site_grid,
@@ -47,7 +47,8 @@ if __name__ == '__main__':
     evt.array_annotations['y_coords']
     evt.annotations['spatial_scale']
 
-    optical_flow = block.filter(name='optical_flow', objects="AnalogSignal")
+    optical_flow = block.filter(name='optical_flow',
+                                objects=["AnalogSignal", "IrregularlySampledSignal"])
     if not len(optical_flow):
         warnings.warn('No Optical-Flow signal available!')
 
@@ -28,21 +28,27 @@ if __name__ == '__main__':
     evt = block.filter(name=args.event_name, objects="Event")[0]
     evt = evt[evt.labels.astype('str') != '-1']
 
-    optical_flow = block.filter(name='optical_flow', objects="AnalogSignal")[0]
+    # AnalogSignal, or IrregularlySampledSignal for event-windowed flow
+    optical_flow = block.filter(name='optical_flow',
+                                objects=["AnalogSignal",
+                                         "IrregularlySampledSignal"])[0]
+
+    # first optical flow frame at or after each trigger,
+    # as np.argmax(optical_flow.times >= trigger)
+    t_idx = np.searchsorted(optical_flow.times.magnitude,
+                            evt.times.rescale(optical_flow.times.units)
+                                     .magnitude,
+                            side='left')
+    t_idx[t_idx == len(optical_flow.times)] = 0
+    channels = evt.array_annotations['channels'].astype(int)
+    directions = optical_flow.as_array()[t_idx, channels]
 
     df_dict = {f'{args.event_name}_id': evt.labels,
                'channel_id': evt.array_annotations['channels'],
-               'flow_direction_local_x': np.empty(len(evt), dtype=float),
-               'flow_direction_local_y': np.empty(len(evt), dtype=float),
+               'flow_direction_local_x': np.real(directions).astype(float),
+               'flow_direction_local_y': np.imag(directions).astype(float),
                }
 
-    for i, trigger in enumerate(evt):
-        t_idx = np.argmax(optical_flow.times >= trigger)
-        channel_id = evt.array_annotations['channels'][i],
-        direction = optical_flow[t_idx, channel_id]
-        df_dict['flow_direction_local_x'][i] = np.real(direction)
-        df_dict['flow_direction_local_y'][i] = np.imag(direction)
-
     df = pd.DataFrame(df_dict)
     df.to_csv(args.output)
 
@@ -61,7 +61,7 @@ if __name__ == '__main__':
 
     block = load_neo(args.data)
     asig = block.segments[0].analogsignals[0]
-    imgseq = analogsignal_to_imagesequence(asig)
+    imgseq = analogsignal_to_imagesequence(asig, copy=False)
 
     evts = block.filter(name=args.event_name, objects="Event")[0]
     evts = evts[evts.labels != '-1']
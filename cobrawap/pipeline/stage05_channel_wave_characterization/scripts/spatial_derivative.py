@@ -16,6 +16,7 @@ from scipy.interpolate import RBFInterpolator
 from utils.convolve import get_kernel, nan_conv2d
 from utils.io_utils import load_neo, save_plot
 from utils.parse import none_or_path, none_or_str, str_to_bool
+from utils.spatial_grid import SpatialGrid
 
 CLI = argparse.ArgumentParser()
 CLI.add_argument("--data", nargs='?', type=Path, required=True,
@@ -54,43 +55,52 @@ def sample_wave_pattern(pattern_func, dim_x, dim_y):
 
 def calc_spatial_derivative(evts, kernel_name, interpolate=False, smoothing=0):
     labels = evts.labels.astype(int)
-    dim_x = int(max(evts.array_annotations['x_coords']))+1
-    dim_y = int(max(evts.array_annotations['y_coords']))+1
-
-    spatial_derivative_df = pd.DataFrame()
-
-    for wave_id in np.unique(labels):
-        wave_trigger_evts = evts[labels == wave_id]
-
-        x_coords = wave_trigger_evts.array_annotations['x_coords'].astype(int)
-        y_coords = wave_trigger_evts.array_annotations['y_coords'].astype(int)
-        channels = wave_trigger_evts.array_annotations['channels'].astype(int)
-
-        trigger_collection = np.empty([dim_y, dim_x]) * np.nan
-        trigger_collection[y_coords, x_coords] = wave_trigger_evts.times
-
-        if interpolate:
+    grid, _ = SpatialGrid.from_event(evts)
+    dim_x, dim_y = grid.dim_x, grid.dim_y
+    all_x_coords = evts.array_annotations['x_coords'].astype(int)
+    all_y_coords = evts.array_annotations['y_coords'].astype(int)
+    all_channels = evts.array_annotations['channels'].astype(int)
+    times = evts.times.magnitude
+
+    # triggers sorted by wave
+    order = np.argsort(labels, kind='stable')
+    wave_ids, starts, counts = np.unique(labels[order], return_index=True,
+                                         return_counts=True)
+    wave_pos = np.repeat(np.arange(len(wave_ids)), counts)
+    x_coords = all_x_coords[order]
+    y_coords = all_y_coords[order]
+    channels = all_channels[order]
+
+    trigger_collections = np.empty([len(wave_ids), dim_y, dim_x]) * np.nan
+    trigger_collections[wave_pos, y_coords, x_coords] = times[order]
+
+    if interpolate:
+        for i, trigger_collection in enumerate(trigger_collections):
             try:
                 pattern_func = interpolate_grid(trigger_collection, smoothing)
-                trigger_collection = sample_wave_pattern(pattern_func,
+                trigger_collections[i] = sample_wave_pattern(pattern_func,
                                                          dim_x=dim_x, dim_y=dim_y)
             except ValueError as ve:
                 warn(repr(ve))
                 warn('Continuing without interpolation.')
 
-        kernel = get_kernel(kernel_name)
-        d_horizont = -1 * nan_conv2d(trigger_collection, kernel.x) # is -1 correct?
-        d_vertical = -1 * nan_conv2d(trigger_collection, kernel.y)
-
-        dt_y = d_vertical[y_coords, x_coords]
-        dt_x = d_horizont[y_coords, x_coords]
-
-        df = pd.DataFrame(list(zip(dt_x, dt_y, x_coords, y_coords, channels)),
-                          columns=['dt_x', 'dt_y', 'x_coords', 'y_coords', 'channel_id'])
-        df[f'{evts.name}_id'] = wave_id
-
-        spatial_derivative_df = pd.concat([spatial_derivative_df, df],
-                                          ignore_index=True)
+    # derivatives of all waves at once
+    kernel = get_kernel(kernel_name)
+    d_horizonts = -1 * nan_conv2d(trigger_collections, kernel.x) # is -1 correct?
+    d_verticals = -1 * nan_conv2d(trigger_collections, kernel.y)
+
+    spatial_derivative_df = pd.DataFrame(
+                {'dt_x': d_horizonts[wave_pos, y_coords, x_coords],
+                 'dt_y': d_verticals[wave_pos, y_coords, x_coords],
+                 'x_coords': x_coords,
+                 'y_coords': y_coords,
+                 'channel_id': channels,
+                 f'{evts.name}_id': wave_ids[wave_pos]})
+
+    # plot the last wave
+    wave_id = wave_ids[-1]
+    trigger_collection = trigger_collections[-1]
+    d_vertical, d_horizont = d_verticals[-1], d_horizonts[-1]
 
     fig, ax = plt.subplots(ncols=3, figsize=(15,5))
     img = ax[0].imshow(trigger_collection, cmap='viridis', origin='lower')
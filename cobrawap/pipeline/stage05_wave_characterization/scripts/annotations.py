@@ -9,7 +9,7 @@ import numpy as np
 import pandas as pd
 import quantities as pq
 import re
-from utils.io_utils import load_neo, save_plot
+from utils.io_utils import load_neo, load_event_table, save_plot
 from utils.parse import none_or_path, none_or_str
 from utils.neo_utils import remove_annotations
 
@@ -47,16 +47,16 @@ def get_corresponding_array_values(a, b):
     '''
     a -> b
     '''
-    a_labels = np.unique(a)
-    mapping = {}
-    for i, a_label in enumerate(a_labels):
-        idx = np.where(a_label == a)[0]
-        b_label_values = b[idx]
-        if (b_label_values == b_label_values[0]).all():
-            mapping[a_label] = b_label_values[0]
-        else:
-            return False
-    return mapping
+    if not len(a):
+        return {}
+    order = np.argsort(a, kind='stable')
+    a_sorted, b_sorted = a[order], b[order]
+    starts = np.flatnonzero(np.r_[True, a_sorted[1:] != a_sorted[:-1]])
+    # b must be constant within each group of a
+    group_starts = np.repeat(starts, np.diff(np.r_[starts, len(a)]))
+    if not (b_sorted == b_sorted[group_starts]).all():
+        return False
+    return dict(zip(a_sorted[starts], b_sorted[starts]))
 
 def add_array_annotations_to_df(df, array_annotations, labels, index_name,
                                 include_keys=[]):
@@ -84,20 +84,20 @@ if __name__ == '__main__':
     block = load_neo(args.data)
 
     asig = block.segments[0].analogsignals[0]
-    evts = block.filter(name=args.event_name, objects="Event")[0]
-    evts = evts[evts.labels.astype(str) != '-1']
+    evts = load_event_table(args.data, args.event_name)
+    evts = evts[~evts.is_noise()]
 
     remove_annotations(evts, del_keys=['nix_name', 'neo_name']+args.ignore_keys)
     remove_annotations(asig, del_keys=['nix_name', 'neo_name']+args.ignore_keys)
 
-    ids = np.sort(np.unique(evts.labels).astype(int))
+    ids = np.unique(evts.labels)
     df = pd.DataFrame(ids, columns=[f'{args.event_name}_id'])
 
     for annotations in [evts.annotations, asig.annotations]:
         df = add_annotations_to_df(df, annotations, args.include_keys)
 
     df = add_array_annotations_to_df(df, evts.array_annotations,
-                                     labels=evts.labels.astype(int),
+                                     labels=evts.labels,
                                      index_name=f'{args.event_name}_id',
                                      include_keys=args.include_keys)
 
@@ -57,7 +57,8 @@ if __name__ == '__main__':
     evt.array_annotations['y_coords']
     evt.annotations['spatial_scale']
 
-    evts = block.filter(name='optical_flow', objects="AnalogSignal")
+    evts = block.filter(name='optical_flow',
+                        objects=["AnalogSignal", "IrregularlySampledSignal"])
     if not len(evts):
         warnings.warn('No Optical-Flow signal available!')
 
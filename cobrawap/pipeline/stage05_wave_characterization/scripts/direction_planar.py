@@ -15,7 +15,7 @@ from pathlib import Path
 import scipy
 import pandas as pd
 import seaborn as sns
-from utils.io_utils import load_neo, save_plot
+from utils.io_utils import load_neo, load_event_table, save_plot
 from utils.parse import none_or_path
 
 CLI = argparse.ArgumentParser()
@@ -39,35 +39,37 @@ def calc_displacement(times, locations):
 
 def trigger_interpolation(evts):
     spatial_scale = evts.annotations['spatial_scale']
-    wave_ids = np.unique(evts.labels)
+    wave_ids, wave_idx = evts.groups()
     dx_avg, dy_avg = np.zeros(len(wave_ids)), np.zeros(len(wave_ids))
     dx_std, dy_std = np.zeros(len(wave_ids)), np.zeros(len(wave_ids))
 
     # loop over waves
-    for i, wave_i in enumerate(wave_ids):
+    for i, idx in enumerate(wave_idx):
         # Fit wave displacement
-        idx = np.where(evts.labels == wave_i)[0]
-        dx_avg[i], dx_std[i] = calc_displacement(evts.times[idx].magnitude,
+        dx_avg[i], dx_std[i] = calc_displacement(evts.times[idx],
                                    evts.array_annotations['x_coords'][idx]
                                  * spatial_scale.magnitude)
-        dy_avg[i], dy_std[i] = calc_displacement(evts.times[idx].magnitude,
+        dy_avg[i], dy_std[i] = calc_displacement(evts.times[idx],
                                    evts.array_annotations['y_coords'][idx]
                                  * spatial_scale.magnitude)
     return dx_avg, dy_avg, dx_std, dy_std
 
 
 def times2ids(time_array, times_selection):
-    return np.array([np.argmax(time_array>=t) for t in times_selection])
+    # index of the first time >= t, as np.argmax(time_array >= t)
+    ids = np.searchsorted(time_array, times_selection, side='left')
+    ids[ids == len(time_array)] = 0
+    return ids
 
 def calc_flow_direction(evts, asig):
-    wave_ids = np.unique(evts.labels.astype(int))
+    wave_ids, wave_idx = evts.groups()
     dx_avg, dy_avg = np.zeros(len(wave_ids)), np.zeros(len(wave_ids))
     dx_std, dy_std = np.zeros(len(wave_ids)), np.zeros(len(wave_ids))
     signals = asig.as_array()
+    times = evts.rescaled_times(asig.times.units).magnitude
 
-    for i, wave_i in enumerate(wave_ids):
-        idx = np.where(evts.labels.astype(int) == wave_i)[0]
-        t_idx = times2ids(asig.times, evts.times[idx])
+    for i, idx in enumerate(wave_idx):
+        t_idx = times2ids(asig.times.magnitude, times[idx])
         channels = evts.array_annotations['channels'][idx]
         flow_vectors = signals[t_idx, channels]
         flow_vectors /= np.abs(flow_vectors)
@@ -140,32 +142,37 @@ def plot_directions(dataframe, wave_ids,
 if __name__ == '__main__':
     args, unknown = CLI.parse_known_args()
 
-    block = load_neo(args.data)
-
     if args.method == 'optical_flow':
         if args.event_name == 'wavemodes':
             warnings.warn('The planar direction of wavemodes can not be '
                           'calculated with the optical_flow method. '
                           'Using trigger_interpolation instead.')
             args.method = 'trigger_interpolation'
-        elif not len(block.filter(name='optical_flow', objects="AnalogSignal")):
-            warnings.warn('No optical_flow signal could be found for the '
-                          'calculation of planar directions. '
-                          'Using trigger_interpolation instead.')
-            args.method = 'trigger_interpolation'
-
-    evts = block.filter(name=args.event_name, objects="Event")[0]
-    evts = evts[evts.labels.astype('str') != '-1']
+        else:
+            # the signals are only required for the optical_flow method
+            block = load_neo(args.data)
+            if not len(block.filter(name='optical_flow',
+                                    objects=["AnalogSignal",
+                                             "IrregularlySampledSignal"])):
+                warnings.warn('No optical_flow signal could be found for the '
+                              'calculation of planar directions. '
+                              'Using trigger_interpolation instead.')
+                args.method = 'trigger_interpolation'
+
+    evts = load_event_table(args.data, args.event_name)
+    evts = evts[~evts.is_noise()]
+    wave_ids = np.unique(evts.labels)
 
     if args.method == 'trigger_interpolation':
         dx_avg, dy_avg, dx_std, dy_std = trigger_interpolation(evts)
     elif args.method == 'optical_flow':
-        asig = block.filter(name='optical_flow', objects="AnalogSignal")[0]
+        asig = block.filter(name='optical_flow',
+                            objects=["AnalogSignal", "IrregularlySampledSignal"])[0]
         dx_avg, dy_avg, dx_std, dy_std = calc_flow_direction(evts, asig)
     else:
         raise NameError(f'Method name {args.method} is not recognized!')
 
-    df = pd.DataFrame(np.unique(evts.labels.astype(int)),
+    df = pd.DataFrame(wave_ids,
                       columns=[f'{args.event_name}_id'])
     df['direction_x'] = dx_avg
     df['direction_y'] = dy_avg
@@ -174,7 +181,7 @@ if __name__ == '__main__':
 
     if args.output_img is not None:
         plot_directions(df,
-                        wave_ids=np.unique(evts.labels.astype(int)),
+                        wave_ids=wave_ids,
                         orientation_top=evts.annotations['orientation_top'],
                         orientation_right=evts.annotations['orientation_right'])
         save_plot(args.output_img)
@@ -6,7 +6,7 @@ import numpy as np
 import argparse
 from pathlib import Path
 import pandas as pd
-from utils.io_utils import load_neo, save_plot
+from utils.io_utils import load_event_table, save_plot
 from utils.parse import none_or_path
 
 CLI = argparse.ArgumentParser()
@@ -22,23 +22,17 @@ CLI.add_argument("--event_name", "--EVENT_NAME", nargs='?', type=str, default='w
 if __name__ == '__main__':
     args, unknown = CLI.parse_known_args()
 
-    block = load_neo(args.data)
+    evts = load_event_table(args.data, args.event_name)
+    evts = evts[~evts.is_noise()]
 
-    asig = block.segments[0].analogsignals[0]
-    evts = block.filter(name=args.event_name, objects="Event")[0]
-
-    wave_ids = np.sort(np.unique(evts.labels).astype(int))
-    if wave_ids[0] == -1:
-        wave_ids = np.delete(wave_ids, 0)
+    wave_ids, wave_idx = evts.groups()
 
     durations = np.empty(len(wave_ids), dtype=float)
 
-    t_unit = evts.times[0].dimensionality.string
+    t_unit = evts.units
 
-    for i, wave_id in enumerate(wave_ids):
-        idx = np.where(evts.labels == str(wave_id))[0]
-        tmin, tmax = np.min(evts.times[idx]), np.max(evts.times[idx])
-        durations[i] = tmax - tmin
+    for i, idx in enumerate(wave_idx):
+        durations[i] = np.ptp(evts.times[idx])
 
     # transform to DataFrame
     df = pd.DataFrame(durations, columns=['duration'])
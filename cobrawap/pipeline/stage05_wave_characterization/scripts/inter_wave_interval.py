@@ -12,7 +12,7 @@ import os
 import argparse
 import scipy
 import pandas as pd
-from utils.io_utils import load_neo, save_plot
+from utils.io_utils import load_event_table, save_plot
 from utils.parse import none_or_path
 
 CLI = argparse.ArgumentParser()
@@ -28,31 +28,26 @@ CLI.add_argument("--event_name", "--EVENT_NAME", nargs='?', type=str, default='w
 if __name__ == '__main__':
     args, unknown = CLI.parse_known_args()
 
-    block = load_neo(args.data)
+    evts = load_event_table(args.data, 'wavefronts')
+    evts = evts[~evts.is_noise()]
 
-    asig = block.segments[0].analogsignals[0]
-    evts = block.filter(name='wavefronts', objects="Event")[0]
-    num_nonnan_channels = np.sum(np.isfinite(asig[0]).astype(int))
+    wave_ids, wave_idx = evts.groups()
+    wave_idx = dict(zip(wave_ids, wave_idx))
+    channels = evts.array_annotations['channels'].astype(int)
+    num_channels = np.max(channels) + 1 if len(channels) else 0
 
-    wave_ids = np.sort(np.unique(evts.labels).astype(int))
-    if wave_ids[0] == -1:
-        wave_ids = np.delete(wave_ids, 0)
-
-    wave_times = np.empty((2, asig.shape[1]), dtype=float)
+    wave_times = np.empty((2, num_channels), dtype=float)
 
     IWIs = np.empty((len(wave_ids),2))
     IWIs.fill(np.nan)
 
-    t_unit = evts.times[0].dimensionality.string
+    t_unit = evts.units
 
     for wave_id in wave_ids[:-1]:
         wave_times.fill(np.nan)
         for i, wi in enumerate([wave_id, wave_id+1]):
-            idx = np.where(evts.labels == str(wi))[0]
-            trigger_channels = evts.array_annotations['channels'][idx]
-            trigger_times = evts.times[idx]
-            for channel, t in zip(trigger_channels, trigger_times):
-                wave_times[i, int(channel)] = t
+            idx = wave_idx.get(wi, [])
+            wave_times[i, channels[idx]] = evts.times[idx]
         inter_wave_intervals = wave_times[1] - wave_times[0]
         IWIs[wave_id, 0] = np.nanmean(inter_wave_intervals)
         IWIs[wave_id, 1] = np.nanstd(inter_wave_intervals)
@@ -11,8 +11,8 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import copy
 import seaborn as sns
-from utils.io_utils import load_neo, save_plot
-from utils.neo_utils import analogsignal_to_imagesequence
+from utils.io_utils import load_neo, load_event_table, save_plot
+from utils.spatial_grid import SpatialGrid
 from utils.parse import none_or_path
 
 CLI = argparse.ArgumentParser()
@@ -27,15 +27,20 @@ CLI.add_argument("--alignment_threshold", nargs='?', type=float, default=.85,
 CLI.add_argument("--event_name", "--EVENT_NAME", nargs='?', type=str, default='wavefronts',
                  help="name of neo.Event to analyze (must contain waves)")
                     
+def times2ids(time_array, times_selection):
+    # index of the first time >= t, as np.argmax(time_array >= t)
+    ids = np.searchsorted(time_array, times_selection, side='left')
+    ids[ids == len(time_array)] = 0
+    return ids
+
+
 def label_planar(waves_event, vector_field, times, threshold):
-    labels = np.unique(waves_event.labels)
+    labels, wave_idx = waves_event.groups()
     planarity = np.zeros(len(labels), dtype=float)
+    event_times = waves_event.rescaled_times(times.units).magnitude
 
-    for i, label in enumerate(labels):
-        idx = np.where(label == waves_event.labels)[0]
-
-        t_idx = [np.argmax(times >= t) for t
-                 in waves_event.times[idx]]
+    for i, idx in enumerate(wave_idx):
+        t_idx = times2ids(times.magnitude, event_times[idx])
         x = waves_event.array_annotations['x_coords'][idx]
         y = waves_event.array_annotations['y_coords'][idx]
 
@@ -52,13 +57,13 @@ def label_planar(waves_event, vector_field, times, threshold):
     return df
 
 
-def plot_planarity(waves_event, vector_field, times, wave_id, skip_step=1, ax=None):
-    label = np.unique(waves_event.labels)[wave_id]
-
-    idx = np.where(label == waves_event.labels)[0]
+def plot_planarity(waves_event, vector_field, times, wave_id, skip_step=1,
+                   spatial_scale=None, ax=None):
+    _, wave_idx = waves_event.groups()
+    idx = wave_idx[wave_id]
+    event_times = waves_event.rescaled_times(times.units)
 
-    t_idx = np.array([np.argmax(times >= t) for t
-                      in waves_event.times[idx]])
+    t_idx = times2ids(times.magnitude, event_times[idx].magnitude)
     x = waves_event.array_annotations['x_coords'][idx]
     y = waves_event.array_annotations['y_coords'][idx]
 
@@ -81,7 +86,7 @@ def plot_planarity(waves_event, vector_field, times, wave_id, skip_step=1, ax=No
         xi = x[frame_i]
         yi = y[frame_i]
         ti = t_idx[frame_i]
-        frame = vector_field[ti, yi.astype(int), xi.astype(int)].magnitude
+        frame = vector_field[ti, yi.astype(int), xi.astype(int)]
         ax.quiver(xi, yi, np.real(frame), np.imag(frame),
                   # units='width', scale=max(frame.shape)/(10*skip_step),
                   # width=0.15/max(frame.shape),
@@ -91,9 +96,9 @@ def plot_planarity(waves_event, vector_field, times, wave_id, skip_step=1, ax=No
     ax.axis('image')
     ax.set_xticks([])
     ax.set_yticks([])
-    ax.set_ylabel(f'pixel size {vector_field.spatial_scale:.2f}')
-    start_t = np.min(waves_event.times[idx]).rescale('s').magnitude
-    stop_t = np.max(waves_event.times[idx]).rescale('s').magnitude
+    ax.set_ylabel(f'pixel size {spatial_scale:.2f}')
+    start_t = np.min(event_times[idx]).rescale('s').magnitude
+    stop_t = np.max(event_times[idx]).rescale('s').magnitude
     ax.set_xlabel('{:.3f} - {:.3f} s'.format(start_t, stop_t))
     ax.set_title('planarity {:.3f}'.format(np.linalg.norm(np.mean(wave_directions))))
     plt.legend(bbox_to_anchor=(1,1), loc='upper left')
@@ -105,11 +110,14 @@ if __name__ == '__main__':
 
     block = load_neo(args.data)
 
-    vec_asig = block.filter(name='optical_flow', objects="AnalogSignal")[0]
-    optical_flow = analogsignal_to_imagesequence(vec_asig)
+    # AnalogSignal, or IrregularlySampledSignal for event-windowed flow
+    vec_asig = block.filter(name='optical_flow',
+                            objects=["AnalogSignal", "IrregularlySampledSignal"])[0]
+    optical_flow = SpatialGrid.from_signal(vec_asig).to_grid(
+                                                        vec_asig.as_array())
     
-    wavefront_evt = block.filter(name=args.event_name, objects="Event")[0]
-    wavefront_evt = wavefront_evt[wavefront_evt.labels.astype('str') != '-1']
+    wavefront_evt = load_event_table(args.data, args.event_name)
+    wavefront_evt = wavefront_evt[~wavefront_evt.is_noise()]
 
 
     planar_labels = label_planar(waves_event=wavefront_evt,
@@ -128,6 +136,7 @@ if __name__ == '__main__':
                        vector_field=optical_flow,
                        times=vec_asig.times,
                        skip_step=skip_step,
+                       spatial_scale=vec_asig.annotations['spatial_scale'],
                        wave_id=i,
                        ax=ax)
         save_plot(os.path.join(os.path.dirname(args.output),
@@ -6,7 +6,7 @@ import numpy as np
 import argparse
 from pathlib import Path
 import pandas as pd
-from utils.io_utils import load_neo, save_plot
+from utils.io_utils import load_event_table, save_plot
 from utils.parse import none_or_path
 
 CLI = argparse.ArgumentParser()
@@ -22,18 +22,11 @@ CLI.add_argument("--event_name", "--EVENT_NAME", nargs='?', type=str, default='w
 if __name__ == '__main__':
     args, unknown = CLI.parse_known_args()
 
-    block = load_neo(args.data)
+    evts = load_event_table(args.data, args.event_name)
 
-    asig = block.segments[0].analogsignals[0]
-    evts = block.filter(name=args.event_name, objects="Event")[0]
+    wave_ids, counts = np.unique(evts.labels, return_counts=True)
 
-    wave_ids = np.sort(np.unique(evts.labels).astype(int))
-
-    number_of_triggers = np.empty(len(wave_ids), dtype=float)
-
-    for i, wave_id in enumerate(wave_ids):
-        idx = np.where(evts.labels == str(wave_id))[0]
-        number_of_triggers[i] = len(evts.times[idx])
+    number_of_triggers = counts.astype(float)
 
     # transform to DataFrame
     df = pd.DataFrame(number_of_triggers, columns=['number_of_triggers'])
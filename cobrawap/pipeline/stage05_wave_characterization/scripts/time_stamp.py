@@ -7,7 +7,7 @@ import matplotlib.pyplot as plt
 import argparse
 from pathlib import Path
 import pandas as pd
-from utils.io_utils import load_neo, save_plot
+from utils.io_utils import load_event_table, save_plot
 from utils.parse import none_or_path
 
 CLI = argparse.ArgumentParser()
@@ -25,8 +25,6 @@ CLI.add_argument("--event_name", "--EVENT_NAME", nargs='?', type=str, default='w
 if __name__ == '__main__':
     args, unknown = CLI.parse_known_args()
 
-    block = load_neo(args.data)
-
     if args.time_point == 'start':
         time_stamp_func = np.min
     elif args.time_point == 'end':
@@ -36,24 +34,21 @@ if __name__ == '__main__':
     else:
         raise InputError('')
 
-    asig = block.segments[0].analogsignals[0]
-    evts = block.filter(name=args.event_name, objects="Event")[0]
-    evts = evts[evts.labels.astype('str') != '-1']
+    evts = load_event_table(args.data, args.event_name)
+    evts = evts[~evts.is_noise()]
 
-    wave_ids = np.sort(np.unique(evts.labels).astype(int))
+    wave_ids, wave_idx = evts.groups()
 
     time_stamps = np.empty(len(wave_ids), dtype=float)
 
-    t_unit = evts.times[0].dimensionality.string
+    t_unit = evts.units
 
-    for i, wave_id in enumerate(wave_ids):
-        idx = np.where(evts.labels == str(wave_id))[0]
+    for i, idx in enumerate(wave_idx):
         time_stamps[i] = time_stamp_func(evts.times[idx])
 
 
     fig, ax = plt.subplots(figsize=(15,2))
-    for i, wave_id in enumerate(wave_ids):
-        idx = np.where(evts.labels == str(wave_id))[0]
+    for idx in wave_idx:
         t0, t1 = np.min(evts.times[idx]), np.max(evts.times[idx])
         ax.plot([t0,t1], [1,1], marker='|', color='b')
     ax.set_ylim((0,2))
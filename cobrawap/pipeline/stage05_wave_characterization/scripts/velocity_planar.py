@@ -7,8 +7,9 @@ import numpy as np
 import matplotlib.pyplot as plt
 import argparse
 import scipy
+import quantities as pq
 import pandas as pd
-from utils.io_utils import load_neo, save_plot
+from utils.io_utils import load_event_table, save_plot
 from utils.parse import none_or_path
 
 CLI = argparse.ArgumentParser()
@@ -31,9 +32,10 @@ def linregress(times, locations):
 
 def calc_planar_velocities(evts):
     spatial_scale = evts.annotations['spatial_scale']
-    v_unit = (spatial_scale.units/evts.times.units).dimensionality.string
+    t_unit = pq.Quantity(1, evts.units)
+    v_unit = (spatial_scale.units/t_unit.units).dimensionality.string
 
-    wave_ids = np.unique(evts.labels)
+    wave_ids, wave_idx = evts.groups()
 
     velocities = np.zeros((len(wave_ids), 2)) * np.nan
 
@@ -43,10 +45,9 @@ def calc_planar_velocities(evts):
                            figsize=(3*nrows, 3*ncols))
 
     # loop over waves
-    for i, wave_i in enumerate(wave_ids):
+    for i, (wave_i, idx) in enumerate(zip(wave_ids, wave_idx)):
         # Fit wave displacement
-        idx = np.where(evts.labels == wave_i)[0]
-        times = evts.times[idx].magnitude
+        times = evts.times[idx]
         if (times == times[0]).all():
             continue
         x_times, x_locations = center_points(times,
@@ -79,8 +80,7 @@ def calc_planar_velocities(evts):
             cax.set_ylabel('x/y position [{}]'\
                            .format(spatial_scale.dimensionality.string))
         if row == nrows-1:
-            cax.set_xlabel('time [{}]'\
-                           .format(evts.times[idx].dimensionality.string))
+            cax.set_xlabel('time [{}]'.format(evts.units))
         cax.set_title('wave {}'.format(wave_i))
 
     # plot total velocities
@@ -108,10 +108,8 @@ def calc_planar_velocities(evts):
 if __name__ == '__main__':
     args, unknown = CLI.parse_known_args()
 
-    block = load_neo(args.data)
-
-    evts = block.filter(name=args.event_name, objects="Event")[0]
-    evts = evts[evts.labels.astype('str') != '-1']
+    evts = load_event_table(args.data, args.event_name)
+    evts = evts[~evts.is_noise()]
 
     velocities_df = calc_planar_velocities(evts)
     velocities_df[f'{args.event_name}_id'] = np.unique(evts.labels)
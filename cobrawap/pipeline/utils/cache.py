@@ -0,0 +1,385 @@
+"""
+Content-addressed cache for block outputs.
+
+A block execution is identified by the hash of its command line, in which
+all existing input files (including the block script) are replaced by the
+hash of their content and all output paths by their location relative to the
+profile output directory, together with the hash of the utils modules and of
+the scripts next to the block script, which it may import (e.g.
+fused_processing imports the other stage02 blocks). Thus, profiles that run a block with identical
+input data and parameters share the same cache entry, and the results are
+hard-linked from the cache instead of being recomputed.
+
+Usage within a rule (see utils/Snakefile):
+    python3 -m utils.cache --profile_dir <output_path/PROFILE> -- \
+            python3 <script> --data <input> --output <output> ...
+"""
+
+import argparse
+import errno
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+from snakemake.logging import logger
+from .snakefile import get_setting
+
+CACHE_VERSION = 3
+DEFAULT_SIZE_LIMIT = 50  # in GB
+HASH_BLOCK_SIZE = 2**20
+ENV_PREFIX = 'COBRAWAP_'
+UTILS_DIR = Path(__file__).resolve().parent
+
+CLI = argparse.ArgumentParser()
+CLI.add_argument("--profile_dir", nargs='?', type=Path, required=True,
+                 help="output directory of the current profile")
+CLI.add_argument("--cache_dir", nargs='?', type=Path, default=None,
+                 help="cache directory [default: <output_path>/.cache]")
+CLI.add_argument("--size_limit", nargs='?', type=float, default=None,
+                 help="maximal size of the cache in GB")
+CLI.add_argument("command", nargs=argparse.REMAINDER,
+                 help="block command to execute")
+
+
+def get_cache_dir():
+    try:
+        return Path(get_setting('cache_path')).expanduser()
+    except ValueError:
+        # by default on the same file system as the output, for hard links
+        return Path(get_setting('output_path')) / '.cache'
+    except FileNotFoundError:
+        logger.error("No settings file found to locate the cache! "
+                     "Run `cobrawap init` to set up the settings file.")
+        return None
+
+
+def get_size_limit():
+    try:
+        return float(get_setting('cache_size_limit'))
+    except (ValueError, FileNotFoundError):
+        return DEFAULT_SIZE_LIMIT
+
+
+def _delta_parent(path):
+    # files written with write_neo(..., parent=...) depend on their parent
+    try:
+        if path.suffix == '.chunked':
+            with open(path, 'r') as f:
+                parent = json.load(f)['annotations'].get('delta_parent')
+        elif path.suffix == '.nix':
+            import nixio
+            with nixio.File.open(str(path), nixio.FileMode.ReadOnly) as f:
+                metadata = f.blocks[0].metadata
+                parent = metadata['delta_parent'] \
+                         if 'delta_parent' in metadata else None
+        else:
+            return None
+    except Exception:
+        return None
+    if parent is None:
+        return None
+    return path.resolve().parent / str(parent)
+
+
+def _file_hash(path, memo_dir=None):
+    stat = path.stat()
+    signature = f'{stat.st_size} {stat.st_mtime_ns} {stat.st_ino}'
+    memo_file = None
+    if memo_dir is not None:
+        path_id = hashlib.sha1(str(path.resolve()).encode()).hexdigest()
+        memo_file = memo_dir / path_id
+        if memo_file.exists():
+            memo_signature, memo_hash = memo_file.read_text().rsplit(' ', 1)
+            if memo_signature == signature:
+                return memo_hash
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            sha.update(chunk)
+    content_hash = sha.hexdigest()
+
+    if memo_file is not None:
+        memo_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = memo_file.with_suffix(f'.{os.getpid()}')
+        tmp_file.write_text(f'{signature} {content_hash}')
+        os.replace(tmp_file, memo_file)
+    return content_hash
+
+
+def content_hash(path, memo_dir=None):
+    """
+    Hash of the file content, including the content of directories,
+    the array directory of the 'chunked' format, and delta parent files.
+    """
+    path = Path(path)
+    sha = hashlib.sha256()
+    if path.is_dir():
+        for file in sorted(p for p in path.rglob('*') if p.is_file()):
+            sha.update(str(file.relative_to(path)).encode())
+            sha.update(_file_hash(file, memo_dir).encode())
+        return sha.hexdigest()
+
+    sha.update(_file_hash(path, memo_dir).encode())
+    chunk_dir = path.with_name(path.name + '.d')
+    if chunk_dir.is_dir():
+        sha.update(content_hash(chunk_dir, memo_dir).encode())
+    parent = _delta_parent(path)
+    if parent is not None and parent.exists():
+        sha.update(content_hash(parent, memo_dir).encode())
+    return sha.hexdigest()
+
+
+def sources_hash(directory, memo_dir=None):
+    """ Hash of the python sources in the directory """
+    sha = hashlib.sha256()
+    for file in sorted(Path(directory).glob('*.py')):
+        sha.update(file.name.encode())
+        sha.update(_file_hash(file, memo_dir).encode())
+    return sha.hexdigest()
+
+
+def utils_hash(memo_dir=None):
+    """ Hash of the sources of the utils modules, used by all blocks """
+    return sources_hash(UTILS_DIR, memo_dir)
+
+
+def _is_relative_to(path, directory):
+    try:
+        path.resolve().relative_to(directory.resolve())
+        return True
+    except ValueError:
+        return False
+
+
+def parse_command(command, profile_dir, memo_dir=None):
+    """
+    Returns the cache key of the command and its output paths.
+    Outputs are the not (yet) existing paths within the profile directory,
+    since snakemake removes the outputs of a rule before executing it.
+    """
+    key_items = [f'version: {CACHE_VERSION}',
+                 f'utils: {utils_hash(memo_dir)}']
+    # environment settings of the blocks, e.g. COBRAWAP_PRECISION
+    key_items += [f'{key}: {value}' for key, value in sorted(os.environ.items())
+                  if key.startswith(ENV_PREFIX)]
+    outputs = []
+    for arg in command:
+        path = Path(arg)
+        if not len(arg):
+            key_items.append(arg)
+        elif path.is_dir() and _is_relative_to(path, profile_dir):
+            # e.g. the 'dir' wildcard, referring to the stage output folder
+            relative_path = path.resolve().relative_to(profile_dir.resolve())
+            key_items.append(f'directory: {relative_path}')
+        elif path.exists():
+            key_items.append(f'input: {content_hash(path, memo_dir)}')
+            if path.suffix == '.py':
+                # the block script may import its sibling scripts
+                key_items.append('scripts: '
+                                 f'{sources_hash(path.parent, memo_dir)}')
+        elif _is_relative_to(path, profile_dir):
+            outputs.append(path)
+            relative_path = path.resolve().relative_to(profile_dir.resolve())
+            key_items.append(f'output: {relative_path}')
+        else:
+            key_items.append(arg)
+    key = hashlib.sha256('\n'.join(key_items).encode()).hexdigest()
+    return key, outputs
+
+
+def _remove(path):
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    elif path.exists() or path.is_symlink():
+        path.unlink()
+
+
+def _link(source, target):
+    # an existing target may be a hard link of another entry, which must not
+    # be written into
+    _remove(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if source.is_dir():
+        shutil.copytree(source, target, copy_function=_link_file)
+    else:
+        _link_file(source, target)
+
+
+def _link_file(source, target):
+    target = Path(target)
+    if target.exists() or target.is_symlink():
+        target.unlink()
+    try:
+        os.link(source, target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise e
+        # cache and output are on different file systems
+        shutil.copy2(source, target)
+    return target
+
+
+def restore(entry_dir, outputs):
+    with open(entry_dir / 'manifest.json', 'r') as f:
+        manifest = json.load(f)
+    for i, output in enumerate(outputs):
+        stored = entry_dir / str(i)
+        if manifest['outputs'][i]['exists']:
+            _link(stored, output)
+        chunk_dir = entry_dir / f'{i}.d'
+        if chunk_dir.exists():
+            _link(chunk_dir, output.with_name(output.name + '.d'))
+    # mark as recently used, the restored hard links share the modification
+    # time of the entry files, which must not change (see _file_hash)
+    os.utime(entry_dir)
+    return None
+
+
+def store(entry_dir, outputs, command):
+    tmp_dir = entry_dir.with_name(f'{entry_dir.name}.tmp{os.getpid()}')
+    tmp_dir.mkdir(parents=True)
+    manifest = {'command': command, 'outputs': []}
+    for i, output in enumerate(outputs):
+        manifest['outputs'].append({'path': str(output),
+                                    'exists': output.exists()})
+        if output.exists():
+            _link(output, tmp_dir / str(i))
+        chunk_dir = output.with_name(output.name + '.d')
+        if chunk_dir.is_dir():
+            _link(chunk_dir, tmp_dir / f'{i}.d')
+    # stored with the entry, so that the cache size is known without
+    # walking all entries
+    manifest['size'] = _entry_size(tmp_dir)
+    with open(tmp_dir / 'manifest.json', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # stored simultaneously by another process
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return 0
+    return manifest['size']
+
+
+def _entry_size(entry_dir):
+    return sum(p.stat().st_size for p in entry_dir.rglob('*') if p.is_file())
+
+
+def _write_size_index(cache_dir, size):
+    index_file = Path(cache_dir) / 'size'
+    tmp_file = index_file.with_suffix(f'.{os.getpid()}')
+    tmp_file.write_text(str(size))
+    os.replace(tmp_file, index_file)
+    return size
+
+
+def add_to_size_index(cache_dir, size):
+    """
+    Adds `size` (in bytes) to the running total size of the cache, and
+    returns the new total. The total is (re)computed from the entries when
+    there is no index. Concurrent updates may get lost, so the total is only
+    a lower bound, which is corrected by prune_cache().
+    """
+    index_file = Path(cache_dir) / 'size'
+    try:
+        total = int(index_file.read_text()) + size
+    except (OSError, ValueError):
+        total = sum(entry['size'] for entry in list_cache(cache_dir))
+    return _write_size_index(cache_dir, total)
+
+
+def list_cache(cache_dir):
+    """
+    Returns the cache entries as list of dicts, most recently used first.
+    """
+    entries = []
+    object_dir = Path(cache_dir) / 'objects'
+    if not object_dir.exists():
+        return entries
+    for entry_dir in object_dir.iterdir():
+        manifest_file = entry_dir / 'manifest.json'
+        if not manifest_file.exists():
+            continue
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+        size = manifest['size'] if 'size' in manifest \
+               else _entry_size(entry_dir)
+        entries.append({'key': entry_dir.name,
+                        'path': entry_dir,
+                        'size': size,
+                        'last_used': entry_dir.stat().st_mtime,
+                        'outputs': [o['path'] for o in manifest['outputs']]})
+    return sorted(entries, key=lambda e: e['last_used'], reverse=True)
+
+
+def prune_cache(cache_dir, size_limit=None):
+    """
+    Removes the least recently used entries until the cache is smaller than
+    `size_limit` (in GB). Returns the removed entries.
+    """
+    if size_limit is None:
+        size_limit = get_size_limit()
+    entries = list_cache(cache_dir)
+    total_size = sum(entry['size'] for entry in entries)
+    removed = []
+    while entries and total_size > size_limit * 1024**3:
+        entry = entries.pop(-1)
+        shutil.rmtree(entry['path'], ignore_errors=True)
+        total_size -= entry['size']
+        removed.append(entry)
+    if Path(cache_dir).exists():
+        _write_size_index(cache_dir, total_size)
+    return removed
+
+
+def clear_cache(cache_dir):
+    if Path(cache_dir).exists():
+        shutil.rmtree(cache_dir)
+    return None
+
+
+def run_cached(command, profile_dir, cache_dir=None, size_limit=None):
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    if cache_dir is None:
+        return subprocess.run(command).returncode
+    memo_dir = cache_dir / 'hashes'
+
+    key, outputs = parse_command(command, profile_dir, memo_dir=memo_dir)
+    entry_dir = cache_dir / 'objects' / key
+
+    if entry_dir.exists() and outputs:
+        print(f'Cache hit ({key[:12]}): linking the cached results.')
+        restore(entry_dir, outputs)
+        return 0
+
+    t0 = time.time()
+    returncode = subprocess.run(command).returncode
+    if returncode or not outputs:
+        return returncode
+
+    print(f'Storing the results in the cache ({key[:12]}, '
+          f'computed in {time.time()-t0:.1f}s).')
+    entry_size = store(entry_dir, outputs, command)
+    if size_limit is None:
+        size_limit = get_size_limit()
+    # the entries are only listed when the cache (probably) exceeds the limit
+    if add_to_size_index(cache_dir, entry_size) > size_limit * 1024**3:
+        prune_cache(cache_dir, size_limit)
+    return returncode
+
+
+if __name__ == '__main__':
+    args = CLI.parse_args()
+    command = args.command
+    if command and command[0] == '--':
+        command = command[1:]
+    sys.exit(run_cached(command,
+                        profile_dir=args.profile_dir,
+                        cache_dir=args.cache_dir,
+                        size_limit=args.size_limit))
@@ -0,0 +1,369 @@
+"""
+Chunked storage backend for neo Blocks (NEO_FORMAT: 'chunked').
+
+A block stored as `<name>.chunked` consists of a small JSON manifest with
+all (non-array) metadata and annotations, and a sibling directory
+`<name>.chunked.d/` holding one `.npy` file per data array (signal samples,
+event times and labels, array annotations). Signals are read back as
+copy-on-write memory maps, so only the accessed time or channel ranges are
+actually read from disk.
+"""
+
+import json
+import shutil
+import warnings
+from pathlib import Path
+import numpy as np
+import neo
+import quantities as pq
+
+CHUNKED_SUFFIX = '.chunked'
+FORMAT_NAME = 'cobrawap-chunked'
+FORMAT_VERSION = 2
+# maximal size (in bytes) of the chunks, in which arrays are cast when saved
+CAST_CHUNK_BYTES = 2**26
+
+
+def chunk_dir(filename):
+    filename = Path(filename)
+    return filename.with_name(filename.name + '.d')
+
+
+def _encode(value):
+    if isinstance(value, pq.Quantity):
+        return {'__quantity__': _encode(value.magnitude),
+                'units': value.dimensionality.string}
+    if isinstance(value, np.ndarray):
+        return {'__ndarray__': value.tolist(), 'dtype': value.dtype.str}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {str(k): _encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    warnings.warn(f'Annotation value of type {type(value)} is stored as str!')
+    return str(value)
+
+
+def _decode(value):
+    if '__quantity__' in value:
+        return pq.Quantity(value['__quantity__'], value['units'])
+    if '__ndarray__' in value:
+        return np.array(value['__ndarray__'], dtype=value['dtype'])
+    return value
+
+
+def signal_file(filename, segment=0, index=0):
+    # e.g. to write the signal array in place (see utils/streaming.py)
+    return chunk_dir(filename) / f'{_signal_prefix(segment, index)}.npy'
+
+
+def _signal_prefix(segment, index):
+    return f'seg{segment}_asig{index}'
+
+
+def unlink_existing(path):
+    """
+    Removes an existing file before it is rewritten. Writing into the file
+    would change all its hard links (e.g. of the cache, see utils/cache.py),
+    and memory-maps of it, instead of creating a new file.
+    """
+    path = Path(path)
+    if path.exists() or path.is_symlink():
+        path.unlink()
+    return path
+
+
+def _is_mapped_to(value, path):
+    # array that is (entirely) the writable memory-map of the file
+    base = value
+    while base is not None and not isinstance(base, np.memmap):
+        base = base.base
+    return base is not None and base.filename is not None \
+           and base.mode in ['r+', 'w+'] \
+           and Path(base.filename).resolve() == path.resolve() \
+           and base.shape == value.shape and base.dtype == value.dtype \
+           and base.ctypes.data == value.ctypes.data
+
+
+def _save_cast(path, value, dtype):
+    # cast in chunks, to not load memory-mapped arrays entirely
+    out = np.lib.format.open_memmap(unlink_existing(path), mode='w+',
+                                    dtype=dtype, shape=value.shape)
+    row_bytes = max(value[:1].nbytes, 1)
+    step = max(CAST_CHUNK_BYTES // row_bytes, 1)
+    for start in range(0, len(value), step):
+        out[start:start+step] = value[start:start+step]
+    out.flush()
+    del out
+    return path
+
+
+def _save_array(directory, name, value, dtype=None):
+    entry = {'file': f'{name}.npy'}
+    if isinstance(value, pq.Quantity):
+        entry['units'] = value.dimensionality.string
+        value = value.magnitude
+    value = np.asarray(value)
+    if value.dtype == object:
+        value = value.astype(str)
+    if _is_mapped_to(value, directory / entry['file']):
+        # already written in place
+        return entry
+    if dtype is not None and value.ndim and np.dtype(dtype) != value.dtype:
+        _save_cast(directory / entry['file'], value, dtype)
+        return entry
+    np.save(unlink_existing(directory / entry['file']), value,
+            allow_pickle=False)
+    return entry
+
+
+def _load_array(directory, entry, mmap_mode=None):
+    value = np.load(directory / entry['file'], mmap_mode=mmap_mode,
+                    allow_pickle=False)
+    if 'units' in entry:
+        value = pq.Quantity(value, entry['units'], copy=False)
+    return value
+
+
+def _base_attributes(obj):
+    return {'name': obj.name,
+            'description': obj.description,
+            'file_origin': obj.file_origin,
+            'annotations': obj.annotations}
+
+
+def _write_analogsignal(directory, prefix, asig, dtype_func=None):
+    entry = _base_attributes(asig)
+    dtype = None if dtype_func is None else dtype_func(asig.dtype)
+    entry['data'] = _save_array(directory, prefix, asig.magnitude, dtype)
+    entry.update(units=asig.units.dimensionality.string,
+                 t_start=asig.t_start,
+                 sampling_rate=asig.sampling_rate,
+                 array_annotations={key: _save_array(directory,
+                                                     f'{prefix}_{key}', value)
+                                    for key, value
+                                    in asig.array_annotations.items()})
+    return entry
+
+
+def _write_irregularsignal(directory, prefix, isig, dtype_func=None):
+    entry = _base_attributes(isig)
+    dtype = None if dtype_func is None else dtype_func(isig.dtype)
+    entry['data'] = _save_array(directory, prefix, isig.magnitude, dtype)
+    entry.update(times=_save_array(directory, f'{prefix}_times',
+                                   isig.times.magnitude),
+                 units=isig.units.dimensionality.string,
+                 time_units=isig.times.units.dimensionality.string,
+                 array_annotations={key: _save_array(directory,
+                                                     f'{prefix}_{key}', value)
+                                    for key, value
+                                    in isig.array_annotations.items()})
+    return entry
+
+
+def _write_event(directory, prefix, evt):
+    entry = _base_attributes(evt)
+    entry.update(times=_save_array(directory, f'{prefix}_times',
+                                   evt.times.magnitude),
+                 labels=_save_array(directory, f'{prefix}_labels', evt.labels),
+                 units=evt.units.dimensionality.string,
+                 array_annotations={key: _save_array(directory,
+                                                     f'{prefix}_{key}', value)
+                                    for key, value
+                                    in evt.array_annotations.items()})
+    return entry
+
+
+def write_chunked(filename, block, dtype_func=None):
+    """
+    Writes the block in the chunked format. `dtype_func` maps the dtype of
+    a signal to the dtype it is stored with (e.g. to cast the signals to
+    the set PRECISION).
+    """
+    filename = Path(filename)
+    directory = chunk_dir(filename)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    manifest = _base_attributes(block)
+    manifest.update(format=FORMAT_NAME, version=FORMAT_VERSION, segments=[])
+
+    for s, segment in enumerate(block.segments):
+        seg_entry = _base_attributes(segment)
+        seg_entry['analogsignals'] = [
+            _write_analogsignal(directory, _signal_prefix(s, i), asig,
+                                dtype_func)
+            for i, asig in enumerate(segment.analogsignals)]
+        seg_entry['irregularlysampledsignals'] = [
+            _write_irregularsignal(directory, f'seg{s}_isig{i}', isig,
+                                   dtype_func)
+            for i, isig in enumerate(segment.irregularlysampledsignals)]
+        seg_entry['events'] = [
+            _write_event(directory, f'seg{s}_evt{i}', evt)
+            for i, evt in enumerate(segment.events)]
+        for objects in ['spiketrains', 'epochs']:
+            if getattr(segment, objects, None):
+                warnings.warn(f'{objects} are not supported by the chunked '
+                              'format and are not stored!')
+        manifest['segments'].append(seg_entry)
+
+    with open(unlink_existing(filename), 'w') as f:
+        json.dump(_encode(manifest), f, indent=1)
+
+    # remove arrays of a previously written block
+    stored_files = _array_files(manifest)
+    for file in directory.iterdir():
+        if file.name not in stored_files:
+            if file.is_dir():
+                shutil.rmtree(file)
+            else:
+                file.unlink()
+    return True
+
+
+def _array_files(entry):
+    if isinstance(entry, dict):
+        if 'file' in entry and isinstance(entry['file'], str):
+            return {entry['file']}
+        return set().union(*[_array_files(v) for v in entry.values()])
+    if isinstance(entry, list):
+        return set().union(*[_array_files(v) for v in entry])
+    return set()
+
+
+def _time_slice_indices(t_start, sampling_rate, num_samples,
+                        time_slice=None):
+    if time_slice is None:
+        return 0, num_samples
+    start, stop = time_slice
+    i = 0 if start is None else \
+        int(np.rint(((start - t_start) * sampling_rate).simplified.magnitude))
+    j = num_samples if stop is None else \
+        int(np.rint(((stop - t_start) * sampling_rate).simplified.magnitude))
+    return max(i, 0), min(j, num_samples)
+
+
+def _read_analogsignal(directory, entry, time_slice=None,
+                       channel_indexes=None):
+    signal = _load_array(directory, entry['data'], mmap_mode='c')
+    t_start = entry['t_start']
+    sampling_rate = entry['sampling_rate']
+
+    i, j = _time_slice_indices(t_start, sampling_rate, len(signal),
+                               time_slice)
+    signal = signal[i:j]
+    if channel_indexes is not None:
+        signal = signal[:, channel_indexes]
+
+    array_annotations = {}
+    for key, value in entry['array_annotations'].items():
+        value = _load_array(directory, value)
+        if channel_indexes is not None:
+            value = value[channel_indexes]
+        array_annotations[key] = value
+
+    asig = neo.AnalogSignal(signal,
+                            units=entry['units'],
+                            t_start=t_start + i / sampling_rate,
+                            sampling_rate=sampling_rate,
+                            name=entry['name'],
+                            description=entry['description'],
+                            file_origin=entry['file_origin'],
+                            array_annotations=array_annotations,
+                            **entry['annotations'])
+    return asig
+
+
+def _read_irregularsignal(directory, entry, time_slice=None,
+                          channel_indexes=None):
+    signal = _load_array(directory, entry['data'], mmap_mode='c')
+    times = _load_array(directory, entry['times'])
+    if channel_indexes is not None:
+        signal = signal[:, channel_indexes]
+
+    array_annotations = {}
+    for key, value in entry['array_annotations'].items():
+        value = _load_array(directory, value)
+        if channel_indexes is not None:
+            value = value[channel_indexes]
+        array_annotations[key] = value
+
+    isig = neo.IrregularlySampledSignal(times=times,
+                                        signal=signal,
+                                        units=entry['units'],
+                                        time_units=entry['time_units'],
+                                        name=entry['name'],
+                                        description=entry['description'],
+                                        file_origin=entry['file_origin'],
+                                        array_annotations=array_annotations,
+                                        **entry['annotations'])
+    if time_slice is not None:
+        isig = isig.time_slice(*time_slice)
+    return isig
+
+
+def _read_event(directory, entry, time_slice=None):
+    times = _load_array(directory, entry['times'])
+    labels = _load_array(directory, entry['labels'])
+    array_annotations = {key: _load_array(directory, value)
+                         for key, value in entry['array_annotations'].items()}
+
+    evt = neo.Event(times=times,
+                    labels=labels,
+                    units=entry['units'],
+                    name=entry['name'],
+                    description=entry['description'],
+                    file_origin=entry['file_origin'],
+                    array_annotations=array_annotations,
+                    **entry['annotations'])
+    if time_slice is not None:
+        evt = evt.time_slice(*time_slice)
+    return evt
+
+
+def read_chunked(filename, time_slice=None, channel_indexes=None):
+    """
+    Reads a block from the chunked format. The AnalogSignal samples are
+    memory-mapped (copy-on-write) and only the selected `time_slice`
+    (t_start, t_stop) and `channel_indexes` are exposed.
+    """
+    filename = Path(filename)
+    with open(filename, 'r') as f:
+        manifest = json.load(f, object_hook=_decode)
+
+    if manifest.get('format') != FORMAT_NAME:
+        raise IOError(f'{filename} is not a {FORMAT_NAME} file!')
+
+    # resolve sym-links (e.g. stage outputs) to locate the array directory
+    directory = chunk_dir(filename.resolve())
+
+    block = neo.Block(name=manifest['name'],
+                      description=manifest['description'],
+                      file_origin=manifest['file_origin'],
+                      **manifest['annotations'])
+
+    for seg_entry in manifest['segments']:
+        segment = neo.Segment(name=seg_entry['name'],
+                              description=seg_entry['description'],
+                              file_origin=seg_entry['file_origin'],
+                              **seg_entry['annotations'])
+        for entry in seg_entry['analogsignals']:
+            segment.analogsignals.append(
+                _read_analogsignal(directory, entry,
+                                   time_slice=time_slice,
+                                   channel_indexes=channel_indexes))
+        # not contained in files of version 1
+        for entry in seg_entry.get('irregularlysampledsignals', []):
+            segment.irregularlysampledsignals.append(
+                _read_irregularsignal(directory, entry,
+                                      time_slice=time_slice,
+                                      channel_indexes=channel_indexes))
+        for entry in seg_entry['events']:
+            segment.events.append(
+                _read_event(directory, entry, time_slice=time_slice))
+        block.segments.append(segment)
+
+    block.check_relationships()
+    return block
@@ -1,5 +1,4 @@
 import numpy as np
-import itertools
 import warnings
 from scipy.ndimage import convolve as conv
 from types import SimpleNamespace
@@ -88,67 +87,79 @@ def get_kernel(kernel_name):
         return sobel_3x3
 
 
-def nan_conv2d(frame, kernel, kernel_center=None):
+def _shifted_windows(frames, kernel, kernel_center=None):
+    """
+    Yields for each non-zero kernel element (of the inverted kernel, to mimic
+    the behavior of a regular convolution) its value and the correspondingly
+    shifted frames, with nan outside of the frame borders.
+    """
     dx, dy = kernel.shape
-    dimx, dimy = frame.shape
-    dframe = np.empty((dimx, dimy))*np.nan
+    dimx, dimy = frames.shape[-2:]
 
     if kernel_center is None:
         kernel_center = [int((dim-1)/2) for dim in kernel.shape]
 
-    # inverse kernel to mimic behavior or regular convolution algorithm
     k = kernel[::-1, ::-1]
     ci = dx - 1 - kernel_center[0]
     cj = dy - 1 - kernel_center[1]
 
-    # loop over each frame site
-    for i,j in zip(*np.where(np.isfinite(frame))):
-        site = frame[i,j]
-
-        # loop over kernel window for frame site
-        window = np.zeros((dx,dy), dtype=float)*np.nan
-        for di,dj in itertools.product(range(dx), range(dy)):
+    pad_width = [(0, 0)] * (frames.ndim - 2) + [(ci, dx - 1 - ci),
+                                                (cj, dy - 1 - cj)]
+    padded = np.pad(frames, pad_width, mode='constant',
+                    constant_values=np.nan)
+    for di, dj in zip(*np.nonzero(k)):
+        yield k[di, dj], padded[..., di:di+dimx, dj:dj+dimy]
 
-            # kernelsite != 0, framesite within borders and != nan
-            if k[di,dj] and 0 <= i+di-ci < dimx and 0 <= j+dj-cj < dimy \
-                        and np.isfinite(frame[i+di-ci,j+dj-cj]):
-                sign = -1*np.sign(k[di,dj])
-                window[di,dj] = sign * (site - frame[i+di-ci,j+dj-cj])
 
-        xi, yi = np.where(np.logical_not(np.isnan(window)))
-        if np.sum(np.logical_not(np.isnan(window))) > dx*dy/10:
-            dframe[i,j] = np.average(window[xi,yi], weights=abs(k[xi,yi]))
+def nan_conv2d(frame, kernel, kernel_center=None):
+    """
+    Convolution ignoring nan sites. For each finite site, the differences to
+    the finite sites within the kernel window are averaged, weighted by the
+    absolute kernel values. Sites with no more than 10% of the kernel window
+    available are nan. `frame` can also be a stack of frames (..., x, y).
+    """
+    # integer frames can't hold the nan padding
+    frame = np.asarray(frame, dtype=np.result_type(frame, float))
+    dx, dy = kernel.shape
+    is_finite = np.isfinite(frame)
+    values = np.where(is_finite, frame, 0).astype(float)
+
+    weighted_sum = np.zeros(frame.shape, dtype=float)
+    weight_sum = np.zeros(frame.shape, dtype=float)
+    count = np.zeros(frame.shape, dtype=int)
+
+    for k_value, shifted in _shifted_windows(frame, kernel, kernel_center):
+        is_valid = np.isfinite(shifted)
+        # sign(k) * |k| weighting of -(site - neighbour)
+        weighted_sum -= np.where(is_valid,
+                                 k_value * (values - shifted), 0)
+        weight_sum += np.abs(k_value) * is_valid
+        count += is_valid
+
+    dframe = np.full(frame.shape, np.nan, dtype=frame.dtype)
+    is_defined = is_finite & (count > dx*dy/10)
+    dframe[is_defined] = weighted_sum[is_defined] / weight_sum[is_defined]
     return dframe
 
 norm_angle = lambda p: -np.mod(p + np.pi, 2*np.pi) + np.pi
 
 def phase_conv2d(frame, kernel, kernel_center=None):
-    dx, dy = kernel.shape
-    dimx, dimy = frame.shape
-    dframe = np.zeros_like(frame)
-
-    if kernel_center is None:
-        kernel_center = [int((dim-1)/2) for dim in kernel.shape]
+    """
+    Phase gradient: the kernel-weighted circular differences (norm_angle)
+    to the finite sites within the kernel window, normalized by the absolute
+    kernel sum and pi. Non-finite sites are 0. `frame` can also be a stack of
+    frames (..., x, y).
+    """
+    frame = np.asarray(frame, dtype=np.result_type(frame, float))
+    is_finite = np.isfinite(frame)
+    dphase_sum = np.zeros(frame.shape, dtype=float)
+
+    for k_value, shifted in _shifted_windows(frame, kernel, kernel_center):
+        is_valid = np.isfinite(shifted)
+        # pos = clockwise from phase to the neighbour
+        dphase_sum -= np.where(is_valid,
+                               k_value * norm_angle(frame - shifted), 0)
 
-    # inverse kernel to mimic behavior or regular convolution algorithm
-    k = kernel[::-1, ::-1]
-    ci = dx - 1 - kernel_center[0]
-    cj = dy - 1 - kernel_center[1]
-
-    # loop over kernel window for each frame site
-    for i,j in zip(*np.where(np.isfinite(frame))):
-        phase = frame[i,j]
-        dphase = np.zeros((dx,dy), dtype=float)
-
-        for di,dj in itertools.product(range(dx), range(dy)):
-
-            # kernelsite != 0, framesite within borders and != nan
-            if k[di,dj] and 0 <= i+di-ci < dimx and 0 <= j+dj-cj < dimy \
-            and np.isfinite(frame[i+di-ci,j+dj-cj]):
-                sign = -1*np.sign(k[di,dj])
-                # pos = clockwise from phase to frame[..]
-                dphase[di,dj] = sign*norm_angle(phase-frame[i+di-ci,j+dj-cj])
-
-        if dphase.any():
-            dframe[i,j] = np.average(dphase, weights=abs(k)) / np.pi
+    dframe = np.zeros_like(frame)
+    dframe[is_finite] = dphase_sum[is_finite] / np.sum(np.abs(kernel)) / np.pi
     return dframe
@@ -0,0 +1,191 @@
+"""
+Columnar representation of (large) neo.Events, e.g. transitions or wavefronts.
+
+An EventTable holds the event times, labels, and array annotations as plain
+numpy columns. Labels and channels are stored as int32 and the grid
+coordinates as int16, where this is lossless, so that triggers can be grouped
+and selected without string conversions. The table is stored as sidecar file
+`<neo file>.<event name>.npz` next to the neo file it was created from, and is
+converted losslessly from and to neo.Event.
+"""
+
+import json
+import os
+import re
+import numpy as np
+import neo
+import quantities as pq
+from pathlib import Path
+from .chunked_io import _encode, _decode
+
+TABLE_SUFFIX = '.npz'
+# events read by the stage05 blocks, whose tables are written with the neo file
+TABLE_EVENTS = ('wavefronts', 'wavemodes')
+COMPACT_DTYPES = {'labels': np.int32,
+                  'channels': np.int32,
+                  'x_coords': np.int16,
+                  'y_coords': np.int16}
+
+
+def _compact(values, dtype):
+    # cast to the compact dtype only if it can be reverted exactly
+    values = np.asarray(values)
+    try:
+        compact = values.astype(dtype)
+    except (ValueError, TypeError, OverflowError):
+        return values
+    with np.errstate(invalid='ignore'):
+        reverted = compact.astype(values.dtype)
+    if values.shape == reverted.shape and (values == reverted).all():
+        return compact
+    return values
+
+
+def _storable(values):
+    values = np.asarray(values)
+    if values.dtype == object:
+        return values.astype(str)
+    return values
+
+
+class EventTable:
+    """
+    Columns of a neo.Event: `times` (float64, in `units`), `labels`, and
+    `array_annotations`.
+    """
+
+    def __init__(self, times, labels, units='s', array_annotations=None,
+                 name=None, description=None, annotations=None, dtypes=None):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.labels = np.asarray(labels)
+        self.units = units
+        self.array_annotations = {} if array_annotations is None \
+                                 else dict(array_annotations)
+        self.name = name
+        self.description = description
+        self.annotations = {} if annotations is None else dict(annotations)
+        # original dtypes, to restore the neo.Event
+        self.dtypes = {} if dtypes is None else dict(dtypes)
+
+    @classmethod
+    def from_event(cls, evt):
+        dtypes = {'labels': evt.labels.dtype.str}
+        labels = _compact(evt.labels, COMPACT_DTYPES['labels'])
+        array_annotations = {}
+        for key, value in evt.array_annotations.items():
+            value = np.asarray(value)
+            dtypes[key] = value.dtype.str
+            if key in COMPACT_DTYPES:
+                value = _compact(value, COMPACT_DTYPES[key])
+            array_annotations[key] = _storable(value)
+        return cls(times=evt.times.magnitude,
+                   labels=_storable(labels),
+                   units=evt.units.dimensionality.string,
+                   array_annotations=array_annotations,
+                   name=evt.name,
+                   description=evt.description,
+                   annotations=evt.annotations,
+                   dtypes=dtypes)
+
+    def to_event(self):
+        labels = self.labels
+        if 'labels' in self.dtypes:
+            labels = labels.astype(self.dtypes['labels'])
+        array_annotations = {key: value.astype(self.dtypes.get(key,
+                                                               value.dtype))
+                             for key, value in self.array_annotations.items()}
+        return neo.Event(times=self.times,
+                         labels=labels,
+                         units=self.units,
+                         name=self.name,
+                         description=self.description,
+                         array_annotations=array_annotations,
+                         **self.annotations)
+
+    def rescaled_times(self, units):
+        return pq.Quantity(self.times, self.units).rescale(units)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, index):
+        # selection of rows by index array or boolean mask
+        return EventTable(times=self.times[index],
+                          labels=self.labels[index],
+                          units=self.units,
+                          array_annotations={key: value[index] for key, value
+                                             in self.array_annotations.items()},
+                          name=self.name,
+                          description=self.description,
+                          annotations=self.annotations,
+                          dtypes=self.dtypes)
+
+    def is_noise(self):
+        """
+        Mask of the rows labeled '-1', i.e. the unclustered triggers.
+        """
+        # as the string comparison of the labels of the neo.Event
+        labels = self.labels
+        if 'labels' in self.dtypes:
+            labels = labels.astype(self.dtypes['labels'])
+        if labels.dtype.kind in 'iu':
+            return labels == -1
+        return labels.astype(str) == '-1'
+
+    def groups(self):
+        """
+        Returns the unique labels and for each the indices of its rows
+        (in order of occurrence).
+        """
+        order = np.argsort(self.labels, kind='stable')
+        unique_labels, starts = np.unique(self.labels[order],
+                                          return_index=True)
+        return unique_labels, np.split(order, starts[1:])
+
+    def save(self, filename, source=None):
+        meta = {'name': self.name,
+                'description': self.description,
+                'units': self.units,
+                'annotations': self.annotations,
+                'dtypes': self.dtypes,
+                'array_annotations': list(self.array_annotations),
+                'source': source}
+        filename = Path(filename)
+        tmp_file = filename.with_name(f'{filename.name}.tmp{os.getpid()}.npz')
+        np.savez(tmp_file, times=self.times, labels=self.labels,
+                 meta=np.array(json.dumps(_encode(meta))),
+                 **{f'column_{key}': value
+                    for key, value in self.array_annotations.items()})
+        # atomic, since blocks may be executed in parallel
+        os.replace(tmp_file, filename)
+        return None
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename, allow_pickle=False) as table:
+            meta = json.loads(str(table['meta']), object_hook=_decode)
+            array_annotations = {key: table[f'column_{key}']
+                                 for key in meta['array_annotations']}
+            new_table = cls(times=table['times'],
+                            labels=table['labels'],
+                            units=meta['units'],
+                            array_annotations=array_annotations,
+                            name=meta['name'],
+                            description=meta['description'],
+                            annotations=meta['annotations'],
+                            dtypes=meta['dtypes'])
+        new_table.source = meta['source']
+        return new_table
+
+
+def table_file(filename, event_name):
+    # located next to the actual file, when filename is a (stage output) link
+    filename = Path(filename).resolve()
+    event_name = re.sub(r'[^\w\-]', '_', str(event_name))
+    return filename.with_name(f'{filename.name}.{event_name}{TABLE_SUFFIX}')
+
+
+def source_signature(filename):
+    # identifies the version of the neo file the table was created from
+    stat = Path(filename).resolve().stat()
+    return f'{stat.st_size} {stat.st_mtime_ns} {stat.st_ino}'
@@ -1,25 +1,142 @@
 import os
+import numpy as np
 import neo
 import matplotlib.pyplot as plt
 import warnings
 from snakemake.logging import logger
 from pathlib import Path
+from .chunked_io import CHUNKED_SUFFIX, read_chunked, write_chunked
+from .event_table import EventTable, TABLE_EVENTS, table_file, source_signature
 
-def load_neo(filename, object='block', lazy=False, *args, **kwargs):
+DELTA_PARENT = 'delta_parent'
+NEO_CONTAINERS = ['analogsignals', 'irregularlysampledsignals', 'spiketrains',
+                  'events', 'epochs', 'imagesequences']
+# floating point precision of the signals, set by the PRECISION config
+PRECISION_ENV = 'COBRAWAP_PRECISION'
+
+def load_neo(filename, object='block', lazy=False, *args,
+             time_slice=None, channel_indexes=None, **kwargs):
+    block = _load_block(filename, lazy, *args,
+                        time_slice=time_slice,
+                        channel_indexes=channel_indexes,
+                        signal_only=(object == 'analogsignal'),
+                        **kwargs)
+    if not lazy:
+        cast_signals(block)
+    return _select_object(block, object)
+
+
+def get_precision():
+    """
+    Returns the float dtype set by the PRECISION config (via the environment
+    variable COBRAWAP_PRECISION), or None if not set.
+    """
+    precision = os.environ.get(PRECISION_ENV)
+    if not precision or precision.lower() == 'none':
+        return None
+    dtype = np.dtype(precision)
+    if dtype.kind != 'f':
+        raise ValueError(f"PRECISION must be a float type, not '{precision}'!")
+    return dtype
+
+
+def precision_dtype(dtype, precision=None):
+    # float -> precision, complex -> complex of precision, others unchanged
+    if precision is None:
+        precision = get_precision()
+    dtype = np.dtype(dtype)
+    if precision is None or dtype.kind not in 'fc':
+        return dtype
+    if dtype.kind == 'c':
+        return np.result_type(precision, np.complex64)
+    return precision
+
+
+def _is_memmap(array):
+    base = array
+    while base is not None and not isinstance(base, np.memmap):
+        base = base.base
+    return base is not None
+
+
+def cast_signals(block, precision=None, skip_memmaps=True):
+    """
+    Casts the (complex) float AnalogSignals and IrregularlySampledSignals
+    of the block to the set precision, in place. Memory-mapped signals
+    (chunked format) are skipped by default, since the cast would load
+    them into memory entirely. They are cast chunk-wise when written.
+    """
+    if precision is None:
+        precision = get_precision()
+    if precision is None:
+        return block
+    for segment in block.segments:
+        for container in ['analogsignals', 'irregularlysampledsignals']:
+            signals = getattr(segment, container)
+            for i, signal in enumerate(signals):
+                if not hasattr(signal, 'duplicate_with_new_data'):
+                    # proxy objects
+                    continue
+                dtype = precision_dtype(signal.dtype, precision)
+                if dtype == signal.dtype:
+                    continue
+                if skip_memmaps and _is_memmap(signal.magnitude):
+                    continue
+                new_signal = signal.duplicate_with_new_data(
+                                    signal.magnitude.astype(dtype))
+                new_signal.array_annotations = signal.array_annotations
+                new_signal.segment = segment
+                signals[i] = new_signal
+    return block
+
+
+def _load_block(filename, lazy=False, *args, time_slice=None,
+                channel_indexes=None, signal_only=False, metadata_only=False,
+                **kwargs):
+    filename = Path(filename)
+    if filename.suffix == CHUNKED_SUFFIX:
+        if not filename.exists():
+            raise IOError(f'{filename} does not exist!')
+        # signals are always memory-mapped, i.e. loaded lazily
+        block = read_chunked(filename, time_slice=time_slice,
+                             channel_indexes=channel_indexes)
+        return _resolve_delta(filename, block, lazy, time_slice,
+                              channel_indexes, signal_only, metadata_only)
+
+    is_sliced = time_slice is not None or channel_indexes is not None
+    # only the AnalogSignal is loaded from proxies when slicing,
+    # the other objects are not fully supported by the proxy readers
+    use_proxies = lazy or (is_sliced and signal_only)
+    block = None
+    nio = None
     try:
-        filename = Path(filename)
-        if filename.suffix == '.nix':
-            kwargs.update(mode='ro')
+        if filename.suffix == '.nix' and use_proxies:
+            # NixIO doesn't support lazy loading, but the rawio-based
+            # NixIOFr does and returns proxy objects
+            nio = neo.io.NixIOFr(str(filename))
+            block = nio.read_block(lazy=True)
+            if not metadata_only and _has_complex_signals(block):
+                # NixIOFr can't load complex signals (e.g. optical_flow)
+                block, use_proxies = None, False
+                lazy = False
+
+        if block is None:
+            if filename.suffix == '.nix':
+                kwargs.update(mode='ro')
+            nio = neo.io.get_io(str(filename), *args, **kwargs)
 
-        nio = neo.io.get_io(str(filename), *args, **kwargs)
+            if use_proxies and nio.support_lazy:
+                block = nio.read_block(lazy=True)
+            else:
+                lazy = False
+                block = nio.read_block()
 
-        if lazy and nio.support_lazy:
-            block = nio.read_block(lazy=lazy)
-        # elif lazy and isinstance(io, neo.io.nixio.NixIO):
-        #     with neo.NixIOFr(filename, *args, **kwargs) as nio:
-        #         block = nio.read_block(lazy=lazy)
-        else:
-            block = nio.read_block()
+        if use_proxies and not lazy and DELTA_PARENT not in block.annotations:
+            asig = block.segments[0].analogsignals[0]
+            block.segments[0].analogsignals[0] = _load_proxy(asig,
+                                    time_slice=time_slice,
+                                    channel_indexes=channel_indexes)
+            is_sliced = False
 
     except Exception as e:
         # nio.close()
@@ -31,6 +148,68 @@ def load_neo(filename, object='block', lazy=False, *args, **kwargs):
     if block is None:
         raise IOError(f'{filename} does not exist!')
 
+    if not lazy and is_sliced:
+        for segment in block.segments:
+            for i, asig in enumerate(segment.analogsignals):
+                if time_slice is not None:
+                    asig = asig.time_slice(*time_slice)
+                if channel_indexes is not None:
+                    asig = asig[:, channel_indexes]
+                segment.analogsignals[i] = asig
+
+    return _resolve_delta(filename, block, lazy, time_slice,
+                          channel_indexes, signal_only, metadata_only)
+
+
+def _has_complex_signals(block):
+    return any([np.dtype(asig.dtype).kind == 'c'
+                for segment in block.segments
+                for asig in segment.analogsignals
+                           + segment.irregularlysampledsignals])
+
+
+def _load_proxy(proxy, time_slice=None, channel_indexes=None):
+    if time_slice is None:
+        time_slice = (None, None)
+    return proxy.load(time_slice=time_slice, channel_indexes=channel_indexes,
+                      strict_slicing=False)
+
+
+def _resolve_delta(filename, block, lazy=False, time_slice=None,
+                   channel_indexes=None, signal_only=False,
+                   metadata_only=False):
+    # a delta file only contains the objects added to its parent file
+    if DELTA_PARENT not in block.annotations:
+        return block
+
+    delta_block = block
+    parent_file = Path(filename).resolve().parent \
+                / str(delta_block.annotations.pop(DELTA_PARENT))
+    block = _load_block(parent_file, lazy=lazy,
+                        time_slice=time_slice,
+                        channel_indexes=channel_indexes,
+                        signal_only=signal_only,
+                        metadata_only=metadata_only)
+
+    if delta_block.name:
+        block.name = delta_block.name
+    remove_keys = ['nix_name', 'neo_name']
+    block.annotations.update({key: value for key, value
+                              in delta_block.annotations.items()
+                              if key not in remove_keys})
+
+    for i, delta_segment in enumerate(delta_block.segments):
+        if i >= len(block.segments):
+            block.segments.append(neo.Segment(name=delta_segment.name))
+        segment = block.segments[i]
+        for container in NEO_CONTAINERS:
+            objects = getattr(delta_segment, container, [])
+            if len(objects):
+                getattr(segment, container).extend(list(objects))
+    return block
+
+
+def _select_object(block, object='block'):
     if object == 'block':
         return block
     elif object == 'analogsignal':
@@ -39,21 +218,105 @@ def load_neo(filename, object='block', lazy=False, *args, **kwargs):
         raise IOError(f"{object} not recognized! Choose 'block' or 'analogsignal'.")
 
 
-def write_neo(filename, block, *args, **kwargs):
+def write_neo(filename, block, *args, parent=None, **kwargs):
     # muting saving imagesequences for now, since they do not yet
     # support array_annotations
     block.segments[0].imagesequences = []
-    try:
-        # for neo >= 0.12.0 filename can't contain '|'
-        nio = neo.io.get_io(str(filename), *args, **kwargs)
-        nio.write(block)
-    except Exception as e:
-        warnings.warn(str(e))
-    finally:
-        nio.close()
+    is_chunked = Path(filename).suffix == CHUNKED_SUFFIX
+    # the chunked format casts memory-mapped signals chunk-wise
+    cast_signals(block, skip_memmaps=is_chunked)
+    if parent is not None:
+        # only write the objects that are appended to the parent block
+        block = _delta_block(block, parent, filename)
+    if is_chunked:
+        write_chunked(filename, block, dtype_func=precision_dtype)
+    else:
+        try:
+            # for neo >= 0.12.0 filename can't contain '|'
+            nio = neo.io.get_io(str(filename), *args, **kwargs)
+            nio.write(block)
+        except Exception as e:
+            warnings.warn(str(e))
+        finally:
+            nio.close()
+    write_event_tables(filename, [evt for seg in block.segments
+                                  for evt in seg.events])
     return True
 
 
+def write_event_tables(filename, events):
+    """
+    Writes the columnar sidecar tables of the events read by the stage05
+    blocks (TABLE_EVENTS). The tables of other events, or of events of a
+    delta parent file, are created on demand by load_event_table().
+    """
+    source = source_signature(filename)
+    for evt in events:
+        if evt.name in TABLE_EVENTS:
+            EventTable.from_event(evt).save(table_file(filename, evt.name),
+                                            source=source)
+    return None
+
+
+def load_event_table(filename, event_name):
+    """
+    Returns the EventTable of the event `event_name` of the file. When there
+    is no up-to-date sidecar table, it is created from the neo file.
+    """
+    sidecar = table_file(filename, event_name)
+    if sidecar.exists():
+        table = EventTable.load(sidecar)
+        if table.source == source_signature(filename):
+            return table
+
+    block = load_neo(filename)
+    evts = block.filter(name=event_name, objects="Event")
+    if not len(evts):
+        raise ValueError(f"No event '{event_name}' found in {filename}!")
+    table = EventTable.from_event(evts[0])
+    try:
+        table.save(sidecar, source=source_signature(filename))
+    except OSError as e:
+        warnings.warn(f"Could not store the event table: {e}")
+    return table
+
+
+def _delta_block(block, parent, filename):
+    # the proxies are sufficient to determine the parent's objects
+    parent_block = _load_block(parent, lazy=True, metadata_only=True)
+
+    delta_block = neo.Block(name=block.name,
+                            description=block.description,
+                            file_origin=block.file_origin,
+                            **block.annotations)
+    parent_path = os.path.relpath(Path(parent).resolve(),
+                                  Path(filename).resolve().parent)
+    delta_block.annotate(**{DELTA_PARENT: parent_path})
+
+    for i, segment in enumerate(block.segments):
+        delta_segment = neo.Segment(name=segment.name,
+                                    description=segment.description,
+                                    **segment.annotations)
+        delta_block.segments.append(delta_segment)
+        for container in NEO_CONTAINERS:
+            num_parent_objects = 0
+            if i < len(parent_block.segments):
+                num_parent_objects = len(getattr(parent_block.segments[i],
+                                                 container, []))
+            objects = getattr(segment, container, [])
+            # objects are only appended, never removed or replaced
+            for obj in list(objects)[num_parent_objects:]:
+                # copy to keep the relationships of the input block intact
+                getattr(delta_segment, container).append(obj.copy())
+    return delta_block
+
+
+def convert_neo(input_file, output_file, *args, **kwargs):
+    # e.g. from .nix to .chunked and vice versa
+    block = load_neo(input_file, *args, **kwargs)
+    return write_neo(output_file, block)
+
+
 def save_plot(filename, dpi=300, **kwargs):
     dirname = os.path.dirname(filename)
     if not os.path.exists(dirname):
@@ -1,13 +1,13 @@
 import numpy as np
 import neo
 import warnings
-from itertools import product
 import sys
 from copy import copy
 import quantities as pq
 from pathlib import Path
 from snakemake.logging import logger
 from .parse import get_base_type, get_nan_value
+from .spatial_grid import SpatialGrid
 
 
 def remove_annotations(objects, del_keys=['nix_name', 'neo_name']):
@@ -38,7 +38,9 @@ def merge_analogsignals(asigs):
         raise ValueError('The AnalogSignal objects have different '\
                        + 'sampling rates!')
 
-    asig_array = np.empty((min_length, len(asigs)), dtype=float) * np.nan
+    asig_array = np.empty((min_length, len(asigs)),
+                          dtype=np.promote_types(asigs[0].dtype,
+                                                np.float32)) * np.nan
 
     for channel_number, asig in enumerate(asigs):
         asig_array[:, channel_number] = np.squeeze(asig.as_array()[:min_length])
@@ -151,6 +153,8 @@ def time_slice(neo_obj, t_start=None, t_stop=None,
     if not lazy and not hasattr(neo_obj, 'time_slice'):
         raise TypeError(f"{neo_obj} has no function 'time_slice'!")
     if t_start is None and t_stop is None:
+        if lazy and hasattr(neo_obj, 'load'):
+            return neo_obj.load(channel_indexes=channel_indexes)
         return neo_obj
 
     t_start = robust_t(neo_obj, t_start, t_name='t_start')
@@ -163,6 +167,17 @@ def time_slice(neo_obj, t_start=None, t_stop=None,
         return neo_obj.time_slice(t_start, t_stop)
 
 
+def load_channels(asig, channel_indexes):
+    """
+    Returns the selected channels of an AnalogSignal or AnalogSignalProxy,
+    in the latter case only these channels are read from file.
+    """
+    if hasattr(asig, 'load'):
+        return asig.load(channel_indexes=channel_indexes)
+    else:
+        return asig[:, channel_indexes]
+
+
 def imagesequence_to_analogsignal(imgseq):
     dim_t, dim_y, dim_x = imgseq.as_array().shape
 
@@ -206,7 +221,35 @@ def imagesequence_to_analogsignal(imgseq):
     return asig
 
 
-def analogsignal_to_imagesequence(asig):
+def _imagesequence_view(image_data, asig):
+    # the neo.ImageSequence constructor copies the data (np.stack),
+    # instead the array is viewed as ImageSequence and initialized as in
+    # ImageSequence.__new__()
+    imgseq = pq.Quantity(image_data, units=asig.units).view(neo.ImageSequence)
+    imgseq.segment = None
+    imgseq.sampling_rate = asig.sampling_rate
+    imgseq.spatial_scale = asig.annotations.get('spatial_scale')
+    if imgseq.spatial_scale is None:
+        raise ValueError("spatial_scale is required")
+    imgseq._t_start = asig.t_start
+    annotations = {k: v for k, v in asig.annotations.items()
+                   if k != 'spatial_scale'}
+    neo.ImageSequence.__init__(imgseq, image_data,
+                               name=asig.name,
+                               description=asig.description,
+                               file_origin=asig.file_origin,
+                               **annotations)
+    return imgseq
+
+
+def analogsignal_to_imagesequence(asig, copy=True):
+    """
+    Arranges the channels on the grid given by the array_annotations
+    'x_coords' and 'y_coords'. Empty grid sites are filled with nans.
+    With copy=False and the channels already forming the dense grid in
+    row-major order, the ImageSequence is a view on the signal data, which
+    must then not be modified in place.
+    """
     asig_array = asig.as_array()
     dim_t, dim_channels = asig_array.shape
 
@@ -215,42 +258,25 @@ def analogsignal_to_imagesequence(asig):
         logger.error('AnalogSignal has no spatial information '
                    + 'as array_annotations "x_coords" "y_coords"!')
 
-    x_coords = asig.array_annotations['x_coords'].astype(int)
-    y_coords = asig.array_annotations['y_coords'].astype(int)
+    grid = SpatialGrid.from_signal(asig)
+    dim_x, dim_y = grid.dim_x, grid.dim_y
 
-    if len(x_coords) != dim_channels or len(y_coords) != dim_channels:
+    if grid.num_channels != dim_channels:
         logger.error("Number of channels doesn't fit number of coordinates!")
 
-    dim_x, dim_y = np.max(x_coords)+1, np.max(y_coords)+1
-
-    image_data = np.empty((dim_t, dim_y, dim_x), dtype=asig.dtype) * np.nan
-
-    for channel, (x,y) in enumerate(zip(x_coords, y_coords)):
-        image_data[:, y, x] = asig_array[:, channel]
-
-    imgseq = neo.ImageSequence(image_data=image_data,
-                               units=asig.units,
-                               dtype=asig.dtype,
-                               t_start=asig.t_start,
-                               sampling_rate=asig.sampling_rate,
-                               name=asig.name,
-                               description=asig.description,
-                               file_origin=asig.file_origin,
-                               **asig.annotations)
+    # a view on the signal data, if the channels are in row-major grid order
+    image_data = grid.to_grid(asig_array, fill_value=np.nan)
+    if copy and np.may_share_memory(image_data, asig_array):
+        image_data = image_data.copy()
+    imgseq = _imagesequence_view(image_data, asig)
 
     # add dict of array_annotations mapped to the 2D grid
     grid_array_annotations = {}
     for key, value in asig.array_annotations.items():
         dtype = get_base_type(value[0])
         nan_value = get_nan_value(dtype)
-
-        grid_value = np.empty((dim_y, dim_x), dtype=value.dtype)
-        grid_value.fill(nan_value)
-
-        for channel, (x,y) in enumerate(zip(x_coords, y_coords)):
-            grid_value[y, x] = value[channel]
-
-        grid_array_annotations[key] = grid_value
+        grid_array_annotations[key] = np.array(grid.to_grid(value,
+                                                            nan_value))
 
     ys, xs = np.meshgrid(range(dim_y),range(dim_x), indexing='ij')
     # check if -1 in xy_coords
@@ -267,26 +293,18 @@ def analogsignal_to_imagesequence(asig):
 def add_empty_sites_to_analogsignal(asig):
     x_coords = asig.array_annotations['x_coords']
     y_coords = asig.array_annotations['y_coords']
-    dim_x, dim_y = np.max(x_coords)+1, np.max(y_coords)+1
-    yx_coords = list(zip(y_coords, x_coords))
+    y_nan_coords, x_nan_coords = SpatialGrid.from_signal(asig).empty_sites
+    num_nans = len(y_nan_coords)
+
+    if num_nans == 0:
+        return asig
 
     asig_array = asig.as_array()
     dim_t, dim_channels = asig_array.shape
-    num_grid_channels = dim_x * dim_y
-    num_nan_channels = num_grid_channels - dim_channels
-    
-    if num_nan_channels == 0:
-        return asig
 
-    nan_signals = np.empty((dim_t, num_nan_channels)) * np.nan
+    nan_signals = np.full((dim_t, num_nans), np.nan, dtype=asig_array.dtype)
     new_asig_array = np.append(asig_array, nan_signals, axis=1)
 
-    grid_coords = list(product(range(dim_y), range(dim_x)))
-    nan_coords = list(set(grid_coords).difference(yx_coords))
-    y_nan_coords = np.array(nan_coords)[:,0]
-    x_nan_coords = np.array(nan_coords)[:,1]
-    num_nans = len(nan_coords)
-
     new_asig = asig.duplicate_with_new_data(new_asig_array)
 
     # add nans into array_annotations for empty sites
@@ -0,0 +1,94 @@
+"""
+Process pools operating on numpy arrays in shared memory.
+
+A SharedArray is allocated once by the parent process. The worker processes
+attach to it via its descriptor (name, shape, dtype), instead of receiving
+pickled copies of the data with each task, and write their results directly
+into the shared output arrays.
+"""
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+# shared memory blocks attached by the current (worker) process
+_attached = {}
+
+
+class SharedArray:
+    """
+    numpy array (`array`) in a multiprocessing.shared_memory block, which is
+    released when leaving the context.
+    """
+
+    def __init__(self, shape, dtype):
+        self.shape = tuple(int(n) for n in np.atleast_1d(shape))
+        self.dtype = np.dtype(dtype)
+        size = int(np.prod(self.shape)) * self.dtype.itemsize
+        self._shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.array = np.ndarray(self.shape, dtype=self.dtype,
+                                buffer=self._shm.buf)
+
+    @classmethod
+    def from_array(cls, array):
+        shared = cls(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    @classmethod
+    def zeros(cls, shape, dtype):
+        shared = cls(shape, dtype)
+        shared.array[...] = 0
+        return shared
+
+    @property
+    def descriptor(self):
+        """ Picklable reference to the array, see `attach()` """
+        return (self._shm.name, self.shape, self.dtype.str)
+
+    def close(self):
+        # views on the buffer must be released before closing it
+        self.array = None
+        self._shm.close()
+        self._shm.unlink()
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def attach(descriptor):
+    """
+    Returns the shared array of the descriptor within a worker process.
+    The memory block stays attached for the lifetime of the worker.
+    """
+    name, shape, dtype = descriptor
+    if name not in _attached:
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=_attached[name].buf)
+
+
+def get_n_jobs(n_jobs):
+    """ Number of worker processes, n_jobs < 1 for all available CPUs """
+    if n_jobs is None or n_jobs < 1:
+        return os.cpu_count() or 1
+    return int(n_jobs)
+
+
+def run_parallel(function, arg_list, n_jobs):
+    """
+    Calls `function(*args)` for each args in `arg_list` in a pool of `n_jobs`
+    processes, and returns the results in order. Exceptions of the workers
+    are raised in the parent process.
+    """
+    n_jobs = min(get_n_jobs(n_jobs), len(arg_list))
+    if n_jobs <= 1:
+        return [function(*args) for args in arg_list]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = [executor.submit(function, *args) for args in arg_list]
+        return [future.result() for future in futures]
@@ -160,7 +160,10 @@ none_or_path = lambda v: none_or_X(v, Path)
 str_list = lambda v: v.split(",")
 
 
-def parse_plot_channels(channels, input_file):
+def parse_plot_channels(channels, input_file, seed=None):
+    # with a seed, the randomly selected channels are reproducible
+    randint = np.random.randint if seed is None \
+              else np.random.default_rng(seed).integers
     channels = channels if isinstance(channels, list) else [channels]
     channels = [none_or_int(channel) for channel in channels]
     # ToDo:
@@ -172,7 +175,7 @@ def parse_plot_channels(channels, input_file):
         ).shape
         for i, channel in enumerate(channels):
             if channel is None or channel >= channel_num:
-                channels[i] = np.random.randint(0, channel_num)
+                channels[i] = int(randint(0, channel_num))
     return channels
 
 
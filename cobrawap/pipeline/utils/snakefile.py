@@ -239,7 +239,7 @@ def in_quotes(object):
     return any([c in str(object) for c in char])
 
 
-def params(*args, config=None, **kwargs):
+def params(*args, config=None, threads_arg=None, **kwargs):
     '''
     Creates a parameter dictionary that is returned as a string as
     command line argument as `--key value` for each key-value pair in the dict.
@@ -251,6 +251,9 @@ def params(*args, config=None, **kwargs):
           are added to the parameter dict
     config:
         dict from which elements (keys given by args) are selected
+    threads_arg:
+        if given, the number of threads of the rule is added with this key
+        (e.g. 'n_jobs'), see the rule's `threads:` directive
     kwargs:
         kwargs are added as key-value pairs are to the parameter dict
 
@@ -281,7 +284,9 @@ def params(*args, config=None, **kwargs):
 
     param_dict.update(dict(kwargs.items()))
 
-    def add_output_and_wildcards_to_args(wildcards, output):
+    def add_output_and_wildcards_to_args(wildcards, output, threads=None):
+        if threads_arg is not None and threads is not None:
+            param_dict[threads_arg] = threads
         for items in [wildcards, output]:
             item_dict = dict(items.items())
             if 'data' in item_dict.keys():
@@ -0,0 +1,140 @@
+"""
+Mapping between the channels of a signal and the sites of its 2D grid.
+
+The SpatialGrid is built once from the array_annotations 'x_coords' and
+'y_coords' (which are stored with the block) and provides array-based
+lookups channel -> site and site -> channel, the mask of valid sites,
+and neighbour tables, instead of rebuilding this mapping channel by channel.
+"""
+
+import numpy as np
+
+NEIGHBOUR_OFFSETS = {4: [(-1, 0), (0, -1), (0, 1), (1, 0)],
+                     8: [(-1, -1), (-1, 0), (-1, 1), (0, -1),
+                         (0, 1), (1, -1), (1, 0), (1, 1)]}
+
+
+class SpatialGrid:
+    """
+    Grid of `dim_y` x `dim_x` sites, with the channels located at
+    (`y_coords`, `x_coords`). Empty sites are mapped to channel -1.
+    """
+    __slots__ = ('dim_x', 'dim_y', 'x_coords', 'y_coords', 'flat_indices',
+                 'site_channels', 'is_dense', '_neighbours')
+
+    def __init__(self, x_coords, y_coords, dim_x=None, dim_y=None):
+        self.x_coords = np.asarray(x_coords).astype(int)
+        self.y_coords = np.asarray(y_coords).astype(int)
+        if len(self.x_coords) != len(self.y_coords):
+            raise ValueError("x_coords and y_coords differ in length!")
+        self.dim_x = int(np.max(self.x_coords)) + 1 if dim_x is None \
+                     else int(dim_x)
+        self.dim_y = int(np.max(self.y_coords)) + 1 if dim_y is None \
+                     else int(dim_y)
+        # channel -> flat (row-major) site index
+        self.flat_indices = self.y_coords * self.dim_x + self.x_coords
+        # site -> channel, for multiple channels on a site the last one
+        self.site_channels = np.full(self.num_sites, -1)
+        self.site_channels[self.flat_indices] = np.arange(self.num_channels)
+        # channels are already in row-major grid order
+        self.is_dense = self.num_channels == self.num_sites \
+                    and (self.flat_indices == np.arange(self.num_sites)).all()
+        self._neighbours = {}
+
+    @classmethod
+    def from_signal(cls, asig):
+        """
+        Returns the grid of the AnalogSignal, cached on the signal object
+        as long as its coordinates don't change.
+        """
+        x_coords = asig.array_annotations['x_coords']
+        y_coords = asig.array_annotations['y_coords']
+        grid = getattr(asig, '_spatial_grid', None)
+        if grid is None \
+        or not np.array_equal(grid.x_coords, x_coords) \
+        or not np.array_equal(grid.y_coords, y_coords):
+            grid = cls(x_coords, y_coords)
+            asig._spatial_grid = grid
+        return grid
+
+    @classmethod
+    def from_event(cls, evt):
+        """
+        Returns the grid of the channels of an Event (e.g. transitions),
+        with the channels given by the array_annotation 'channels'.
+        The grid channels are the sorted unique channel ids.
+        """
+        channels, idx = np.unique(evt.array_annotations['channels']
+                                                            .astype(int),
+                                  return_index=True)
+        grid = cls(evt.array_annotations['x_coords'][idx],
+                   evt.array_annotations['y_coords'][idx])
+        return grid, channels
+
+    @property
+    def shape(self):
+        return (self.dim_y, self.dim_x)
+
+    @property
+    def num_sites(self):
+        return self.dim_x * self.dim_y
+
+    @property
+    def num_channels(self):
+        return len(self.flat_indices)
+
+    @property
+    def valid_mask(self):
+        """ Boolean grid of the sites occupied by a channel """
+        return (self.site_channels >= 0).reshape(self.shape)
+
+    @property
+    def empty_sites(self):
+        """ (y, x) coordinates of the sites without channel """
+        return np.divmod(np.where(self.site_channels < 0)[0], self.dim_x)
+
+    def channel_at(self, y, x):
+        """ Channel at site (y, x), -1 if empty """
+        return self.site_channels[np.asarray(y) * self.dim_x + np.asarray(x)]
+
+    def to_grid(self, values, fill_value=np.nan):
+        """
+        Arranges the channel values (last axis) on the grid:
+        (..., num_channels) -> (..., dim_y, dim_x).
+        For dense row-major channels, the result is a view on `values`.
+        """
+        values = np.asarray(values)
+        if self.is_dense:
+            return values.reshape(values.shape[:-1] + self.shape)
+        grid = np.take(values, np.maximum(self.site_channels, 0), axis=-1)
+        is_empty = self.site_channels < 0
+        if is_empty.any():
+            grid[..., is_empty] = fill_value
+        return grid.reshape(values.shape[:-1] + self.shape)
+
+    def from_grid(self, grid):
+        """
+        Returns the channel values of the grid:
+        (..., dim_y, dim_x) -> (..., num_channels).
+        """
+        grid = np.asarray(grid)
+        flat_grid = grid.reshape(grid.shape[:-2] + (self.num_sites,))
+        if self.is_dense:
+            return flat_grid
+        return np.take(flat_grid, self.flat_indices, axis=-1)
+
+    def neighbours(self, connectivity=8):
+        """
+        Table (num_channels x connectivity) of the neighbouring channels
+        of each channel, -1 for empty or out-of-grid neighbour sites.
+        """
+        if connectivity not in self._neighbours:
+            offsets = np.array(NEIGHBOUR_OFFSETS[connectivity])
+            ny = self.y_coords[:, np.newaxis] + offsets[:, 0]
+            nx = self.x_coords[:, np.newaxis] + offsets[:, 1]
+            inside = (ny >= 0) & (ny < self.dim_y) \
+                   & (nx >= 0) & (nx < self.dim_x)
+            flat = np.where(inside, ny * self.dim_x + nx, 0)
+            self._neighbours[connectivity] = np.where(
+                                        inside, self.site_channels[flat], -1)
+        return self._neighbours[connectivity]
@@ -0,0 +1,275 @@
+"""
+Streaming execution of processing steps on recordings larger than memory.
+
+The input AnalogSignal (memory-mapped from the 'chunked' NEO_FORMAT) is
+walked in time chunks, and the result is written into a memory-mapped output
+array. When the output file is in the 'chunked' format, this array is already
+the final file, otherwise it is a temporary file, which is converted by
+`write_streamed()`. Thus, the peak memory is determined by the chunk size
+instead of the recording length.
+"""
+
+import os
+import warnings
+import numpy as np
+import scipy.signal
+import quantities as pq
+from pathlib import Path
+from .chunked_io import CHUNKED_SUFFIX, signal_file, unlink_existing
+from .io_utils import load_neo, write_neo, precision_dtype
+
+STREAM_SUFFIX = '.stream.npy'
+
+
+def chunk_size(asig, chunk_duration):
+    """
+    Number of samples of a time chunk of `chunk_duration` (in s).
+    """
+    if not isinstance(chunk_duration, pq.Quantity):
+        chunk_duration = chunk_duration * pq.s
+    size = int((chunk_duration * asig.sampling_rate).simplified.magnitude)
+    return max(size, 1)
+
+
+def iter_chunks(num_samples, size, reverse=False):
+    starts = range(0, num_samples, size)
+    if reverse:
+        starts = reversed(starts)
+    for start in starts:
+        yield start, min(start + size, num_samples)
+
+
+def read_samples(asig, start, stop):
+    # for memory-mapped signals, only these samples are read from disk
+    start, stop = max(start, 0), min(stop, asig.shape[0])
+    return asig.magnitude[start:stop]
+
+
+def load_streamed(filename):
+    """
+    Loads the block, with the signals memory-mapped in the chunked format.
+    Other formats are loaded into memory entirely, since their lazy loading
+    (proxy objects) doesn't preserve all annotations.
+    """
+    if Path(filename).suffix != CHUNKED_SUFFIX:
+        warnings.warn(f"{filename} is loaded into memory entirely! "
+                      "Use NEO_FORMAT 'chunked' for streaming the data "
+                      "from disk.")
+    return load_neo(filename)
+
+
+def create_output(filename, shape, dtype):
+    """
+    Creates the memory-mapped array for the signal of the output file.
+    """
+    filename = Path(filename)
+    if filename.suffix == CHUNKED_SUFFIX:
+        path = signal_file(filename)
+    else:
+        path = filename.with_name(filename.name + STREAM_SUFFIX)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # a new file, not overwriting the (possibly hard-linked) previous one
+    unlink_existing(path)
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                     shape=shape)
+
+
+def _output_dtype(asig):
+    # float32 signals stay float32, unless set otherwise by PRECISION
+    return precision_dtype(np.promote_types(asig.dtype, np.float32))
+
+
+def output_signal(asig, data, units=None):
+    """
+    Returns a copy of the AnalogSignal with the memory-mapped data.
+    """
+    if units is None:
+        units = asig.units
+    new_asig = asig.duplicate_with_new_data(pq.Quantity(data, units,
+                                                        copy=False),
+                                            units=units)
+    new_asig.array_annotations = asig.array_annotations
+    return new_asig
+
+
+def write_streamed(filename, block):
+    write_neo(filename, block)
+    temp_file = Path(filename).with_name(Path(filename).name + STREAM_SUFFIX)
+    if temp_file.exists():
+        os.remove(temp_file)
+    return True
+
+
+def _butter_sos(asig, highpass_frequency, lowpass_frequency, order):
+    # same filter design as elephant.signal_processing.butter
+    Fn = asig.sampling_rate.rescale('Hz').magnitude / 2.
+    if lowpass_frequency and highpass_frequency:
+        if highpass_frequency < lowpass_frequency:
+            Wn = (highpass_frequency / Fn, lowpass_frequency / Fn)
+            btype = 'bandpass'
+        else:
+            Wn = (lowpass_frequency / Fn, highpass_frequency / Fn)
+            btype = 'bandstop'
+    elif lowpass_frequency:
+        Wn, btype = lowpass_frequency / Fn, 'lowpass'
+    elif highpass_frequency:
+        Wn, btype = highpass_frequency / Fn, 'highpass'
+    else:
+        raise ValueError("Either highpass_frequency or lowpass_frequency "
+                         "must be given")
+    return scipy.signal.butter(order, Wn, btype=btype, output='sos')
+
+
+def butter(asig, output, highpass_frequency, lowpass_frequency, order=4,
+           filter_function='filtfilt', chunk_duration=10):
+    """
+    Butterworth filter in second-order sections, carrying the filter state
+    between the time chunks. 'lfilter' applies the filter forward only,
+    'filtfilt' and 'sosfiltfilt' forward and backward, with the same edge
+    padding as scipy.signal.sosfiltfilt.
+    """
+    sos = _butter_sos(asig, highpass_frequency, lowpass_frequency, order)
+    num_samples, num_channels = asig.shape
+    size = chunk_size(asig, chunk_duration)
+    out = create_output(output, asig.shape, _output_dtype(asig))
+
+    zi_base = scipy.signal.sosfilt_zi(sos)[:, :, np.newaxis]
+
+    if filter_function == 'lfilter':
+        zi = np.zeros((len(sos), 2, num_channels))
+        for start, stop in iter_chunks(num_samples, size):
+            out[start:stop], zi = scipy.signal.sosfilt(
+                                        sos, read_samples(asig, start, stop),
+                                        axis=0, zi=zi)
+        out.flush()
+        return output_signal(asig, out)
+
+    # forward-backward filter with odd extension at the edges
+    num_zeros = min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+    padlen = 3 * (2 * len(sos) + 1 - num_zeros)
+    if num_samples <= padlen:
+        raise ValueError("The signal is too short for the filter padding!")
+
+    head = read_samples(asig, 0, padlen + 1)
+    left_ext = 2 * head[0] - head[padlen:0:-1]
+    tail = read_samples(asig, num_samples - padlen - 1, num_samples)
+    right_ext = 2 * tail[-1] - tail[-2::-1]
+
+    # forward pass
+    _, zi = scipy.signal.sosfilt(sos, left_ext, axis=0,
+                                 zi=zi_base * left_ext[0])
+    for start, stop in iter_chunks(num_samples, size):
+        out[start:stop], zi = scipy.signal.sosfilt(
+                                    sos, read_samples(asig, start, stop),
+                                    axis=0, zi=zi)
+    right_forward, _ = scipy.signal.sosfilt(sos, right_ext, axis=0, zi=zi)
+
+    # backward pass
+    _, zi = scipy.signal.sosfilt(sos, right_forward[::-1], axis=0,
+                                 zi=zi_base * right_forward[-1])
+    for start, stop in iter_chunks(num_samples, size, reverse=True):
+        backward, zi = scipy.signal.sosfilt(sos, out[start:stop][::-1],
+                                            axis=0, zi=zi)
+        out[start:stop] = backward[::-1]
+    out.flush()
+    return output_signal(asig, out)
+
+
+def channel_moments(asig, chunk_duration=10):
+    """
+    Mean and variance of each channel, combining the moments of the chunks.
+    """
+    size = chunk_size(asig, chunk_duration)
+    count = 0
+    mean = np.zeros(asig.shape[1])
+    m2 = np.zeros(asig.shape[1])
+    for start, stop in iter_chunks(asig.shape[0], size):
+        chunk = read_samples(asig, start, stop).astype(float)
+        n = len(chunk)
+        chunk_mean = chunk.mean(axis=0)
+        chunk_m2 = ((chunk - chunk_mean)**2).sum(axis=0)
+        delta = chunk_mean - mean
+        mean = mean + delta * n / (count + n)
+        m2 = m2 + chunk_m2 + delta**2 * count * n / (count + n)
+        count += n
+    return mean, m2 / count
+
+
+def zscore(asig, output, chunk_duration=10):
+    mean, var = channel_moments(asig, chunk_duration)
+    std = np.sqrt(var)
+    out = create_output(output, asig.shape, _output_dtype(asig))
+    for start, stop in iter_chunks(asig.shape[0],
+                                   chunk_size(asig, chunk_duration)):
+        chunk = read_samples(asig, start, stop) - mean
+        # as elephant.signal_processing.zscore, channels with zero std are
+        # only centered
+        out[start:stop] = np.divide(chunk, std, out=chunk, where=std != 0)
+    out.flush()
+    return output_signal(asig, out, units=pq.dimensionless)
+
+
+def detrend(asig, output, order=1, chunk_duration=10):
+    """
+    Subtracts the least-squares constant (order 0) or linear (order 1)
+    trend of each channel. Channels containing nans are set to nan.
+    """
+    num_samples, num_channels = asig.shape
+    size = chunk_size(asig, chunk_duration)
+    # centered sample indices, so that the trend parameters are independent
+    t_center = (num_samples - 1) / 2
+    sum_x = np.zeros(num_channels)
+    sum_tx = np.zeros(num_channels)
+    for start, stop in iter_chunks(num_samples, size):
+        chunk = read_samples(asig, start, stop)
+        t = np.arange(start, stop) - t_center
+        sum_x += chunk.sum(axis=0)
+        sum_tx += t @ chunk
+
+    offset = sum_x / num_samples
+    if order:
+        sum_tt = num_samples * (num_samples**2 - 1) / 12
+        slope = sum_tx / sum_tt
+    else:
+        slope = np.zeros(num_channels)
+
+    out = create_output(output, asig.shape, _output_dtype(asig))
+    for start, stop in iter_chunks(num_samples, size):
+        t = np.arange(start, stop) - t_center
+        out[start:stop] = read_samples(asig, start, stop) \
+                        - (offset + np.outer(t, slope))
+    out.flush()
+    return output_signal(asig, out)
+
+
+def hilbert_phase(asig, output, chunk_duration=10, overlap=None):
+    """
+    Phase of the analytic signal by overlap-save: the Hilbert transform of
+    each chunk is calculated including `overlap` (in s, default: the chunk
+    duration) of signal on both sides, of which only the center is kept.
+    """
+    num_samples = asig.shape[0]
+    size = chunk_size(asig, chunk_duration)
+    margin = size if overlap is None else chunk_size(asig, overlap)
+    out = create_output(output, asig.shape, _output_dtype(asig))
+    for start, stop in iter_chunks(num_samples, size):
+        ext_start = max(start - margin, 0)
+        ext_stop = min(stop + margin, num_samples)
+        chunk = read_samples(asig, ext_start, ext_stop)
+        # padding to the next power of 2, as elephant's hilbert
+        n = 2 ** (int(np.log2(len(chunk) - 1)) + 1) if len(chunk) > 1 else 1
+        analytic = scipy.signal.hilbert(chunk, N=n, axis=0)[:len(chunk)]
+        out[start:stop] = np.angle(analytic[start-ext_start:stop-ext_start])
+    out.flush()
+    return output_signal(asig, out)
+
+
+def finite_channels(asig, chunk_duration=10):
+    """
+    Returns the indices of the channels without nan values.
+    """
+    is_finite = np.ones(asig.shape[1], dtype=bool)
+    for start, stop in iter_chunks(asig.shape[0],
+                                   chunk_size(asig, chunk_duration)):
+        is_finite &= np.isfinite(read_samples(asig, start, stop)).all(axis=0)
+    return np.where(is_finite)[0]
@@ -0,0 +1,13 @@
+import sys
+from pathlib import Path
+
+# the pipeline scripts import the utils modules as `utils`
+PIPELINE_PATH = Path(__file__).resolve().parents[1] / 'cobrawap' / 'pipeline'
+sys.path.insert(0, str(PIPELINE_PATH))
+
+
+def add_script_path(stage):
+    """ Makes the block scripts of the stage importable """
+    script_path = str(PIPELINE_PATH / stage / 'scripts')
+    if script_path not in sys.path:
+        sys.path.insert(0, script_path)
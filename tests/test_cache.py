@@ -0,0 +1,56 @@
+import sys
+import textwrap
+
+import utils.snakefile
+from utils.cache import get_cache_dir, run_cached
+
+
+def make_block(script_dir, value):
+    script_dir.mkdir(exist_ok=True)
+    (script_dir / 'helper.py').write_text(f'VALUE = {value!r}\n')
+    block = script_dir / 'block.py'
+    block.write_text(textwrap.dedent('''
+        import sys
+        from helper import VALUE
+        with open(sys.argv[-1], 'w') as f:
+            f.write(VALUE)
+        '''))
+    return block
+
+
+def run_block(block, profile_dir, cache_dir):
+    output = profile_dir / 'stage' / 'output.txt'
+    # snakemake removes the outputs of a rule before executing it
+    if output.exists():
+        output.unlink()
+    output.parent.mkdir(parents=True, exist_ok=True)
+    returncode = run_cached([sys.executable, str(block), '--output',
+                             str(output)],
+                            profile_dir=profile_dir, cache_dir=cache_dir,
+                            size_limit=1)
+    assert returncode == 0
+    return output.read_text()
+
+
+def test_cache_hit_and_imported_script_change(tmp_path, capfd):
+    profile_dir, cache_dir = tmp_path / 'profile', tmp_path / 'cache'
+    block = make_block(tmp_path / 'scripts', 'a')
+
+    assert run_block(block, profile_dir, cache_dir) == 'a'
+    assert 'Storing' in capfd.readouterr().out
+    [stored] = (cache_dir / 'objects').glob('*/0')
+    mtime = stored.stat().st_mtime_ns
+    assert run_block(block, profile_dir, cache_dir) == 'a'
+    assert 'Cache hit' in capfd.readouterr().out
+    # restoring must not modify the (hard-linked) entry files
+    assert stored.stat().st_mtime_ns == mtime
+
+    # the block script itself is unchanged, only the module it imports
+    make_block(tmp_path / 'scripts', 'changed')
+    assert run_block(block, profile_dir, cache_dir) == 'changed'
+    assert 'Storing' in capfd.readouterr().out
+
+
+def test_cache_dir_without_settings(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils.snakefile, 'SETTINGS_PATH', tmp_path / 'config')
+    assert get_cache_dir() is None
@@ -0,0 +1,144 @@
+"""
+Validation of the vectorized nan_conv2d against the previous implementation,
+which loops over the sites and kernel elements.
+"""
+
+import itertools
+import numpy as np
+import pytest
+from utils.convolve import get_kernel, nan_conv2d, phase_conv2d
+
+KERNELS = ['simple_3x3', 'prewitt_3x3', 'scharr_3x3', 'sobel_3x3',
+           'sobel_5x5', 'sobel_7x7']
+
+
+def nan_conv2d_loop(frame, kernel, kernel_center=None):
+    # previous implementation of nan_conv2d
+    dx, dy = kernel.shape
+    dimx, dimy = frame.shape
+    dframe = np.empty((dimx, dimy), dtype=frame.dtype)*np.nan
+
+    if kernel_center is None:
+        kernel_center = [int((dim-1)/2) for dim in kernel.shape]
+
+    # inverse kernel to mimic behavior or regular convolution algorithm
+    k = kernel[::-1, ::-1]
+    ci = dx - 1 - kernel_center[0]
+    cj = dy - 1 - kernel_center[1]
+
+    # loop over each frame site
+    for i,j in zip(*np.where(np.isfinite(frame))):
+        site = frame[i,j]
+
+        # loop over kernel window for frame site
+        window = np.zeros((dx,dy), dtype=float)*np.nan
+        for di,dj in itertools.product(range(dx), range(dy)):
+
+            # kernelsite != 0, framesite within borders and != nan
+            if k[di,dj] and 0 <= i+di-ci < dimx and 0 <= j+dj-cj < dimy \
+                        and np.isfinite(frame[i+di-ci,j+dj-cj]):
+                sign = -1*np.sign(k[di,dj])
+                window[di,dj] = sign * (site - frame[i+di-ci,j+dj-cj])
+
+        xi, yi = np.where(np.logical_not(np.isnan(window)))
+        if np.sum(np.logical_not(np.isnan(window))) > dx*dy/10:
+            dframe[i,j] = np.average(window[xi,yi], weights=abs(k[xi,yi]))
+    return dframe
+
+
+def random_frame(shape, nan_fraction, seed=0):
+    rng = np.random.default_rng(seed)
+    frame = rng.standard_normal(shape)
+    frame[rng.random(shape) < nan_fraction] = np.nan
+    return frame
+
+
+def assert_equal_with_nans(actual, desired):
+    np.testing.assert_array_equal(np.isnan(actual), np.isnan(desired))
+    np.testing.assert_allclose(actual, desired, rtol=0, atol=1e-12,
+                               equal_nan=True)
+
+
+@pytest.mark.parametrize('kernel_name', KERNELS)
+@pytest.mark.parametrize('nan_fraction', [0, 0.2, 0.5, 0.9])
+def test_nan_conv2d(kernel_name, nan_fraction):
+    kernel = get_kernel(kernel_name)
+    frame = random_frame((13, 11), nan_fraction)
+    for k in [kernel.x, kernel.y]:
+        assert_equal_with_nans(nan_conv2d(frame, k),
+                               nan_conv2d_loop(frame, k))
+
+
+@pytest.mark.parametrize('shape', [(1, 1), (1, 7), (2, 2), (7, 1), (4, 9)])
+def test_nan_conv2d_small_frames(shape):
+    frame = random_frame(shape, 0.3)
+    for kernel_name in KERNELS:
+        k = get_kernel(kernel_name).x
+        assert_equal_with_nans(nan_conv2d(frame, k),
+                               nan_conv2d_loop(frame, k))
+
+
+def test_nan_conv2d_kernel_center():
+    frame = random_frame((10, 10), 0.2)
+    k = get_kernel('sobel_5x5').y
+    for kernel_center in [(0, 0), (1, 3), (4, 4), (2, 0)]:
+        assert_equal_with_nans(nan_conv2d(frame, k, kernel_center),
+                               nan_conv2d_loop(frame, k, kernel_center))
+
+
+def test_nan_conv2d_valid_window_fraction():
+    # more than 2.5 of the 25 sites (10%) of the window must be valid
+    k = np.ones((5, 5))
+    frame = np.full((5, 5), np.nan)
+    frame[2, 2] = 1
+    frame[2, 3] = 2
+    frame[3, 2] = 4
+    # 3 valid sites in the window of the center, including itself
+    dframe = nan_conv2d(frame, k)
+    assert_equal_with_nans(dframe, nan_conv2d_loop(frame, k))
+    assert np.isfinite(dframe[2, 2])
+    frame[3, 2] = np.nan
+    dframe = nan_conv2d(frame, k)
+    assert_equal_with_nans(dframe, nan_conv2d_loop(frame, k))
+    assert np.isnan(dframe).all()
+
+
+def test_nan_conv2d_abs_kernel_weights():
+    # asymmetric kernel with different magnitudes and signs
+    k = np.array([[0, -3, 0],
+                  [1, 0, -0.5],
+                  [0, 2, 0]])
+    frame = random_frame((8, 9), 0.25, seed=3)
+    dframe = nan_conv2d(frame, k)
+    assert_equal_with_nans(dframe, nan_conv2d_loop(frame, k))
+
+    # average of the signed differences weighted by abs(k)
+    frame = np.arange(9, dtype=float).reshape(3, 3)
+    kinv = k[::-1, ::-1]
+    diffs = [-np.sign(kinv[i, j]) * (frame[1, 1] - frame[i, j])
+             for i, j in zip(*np.nonzero(kinv))]
+    weights = [abs(kinv[i, j]) for i, j in zip(*np.nonzero(kinv))]
+    assert np.isclose(nan_conv2d(frame, k)[1, 1],
+                      np.average(diffs, weights=weights))
+
+
+def test_nan_conv2d_stack():
+    # (t, y, x) stacks are convolved frame by frame
+    frames = random_frame((6, 9, 12), 0.3, seed=1)
+    frames[2] = np.nan
+    frames[3, :, :4] = np.nan
+    for kernel_name in ['scharr_3x3', 'sobel_5x5']:
+        k = get_kernel(kernel_name).x
+        dframes = nan_conv2d(frames, k)
+        assert dframes.shape == frames.shape
+        for frame, dframe in zip(frames, dframes):
+            assert_equal_with_nans(dframe, nan_conv2d_loop(frame, k))
+
+
+@pytest.mark.parametrize('dtype', [np.int16, np.int64])
+def test_nan_conv2d_integer_frames(dtype):
+    frame = np.arange(13*11).reshape(13, 11).astype(dtype)
+    k = get_kernel('sobel_3x3').x
+    assert_equal_with_nans(nan_conv2d(frame, k), nan_conv2d_loop(frame, k))
+    assert_equal_with_nans(phase_conv2d(frame, k),
+                           phase_conv2d(frame.astype(float), k))
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from conftest import add_script_path
+
+add_script_path('stage04_wave_detection')
+from critical_points import (analyze_frames, calc_winding_number,
+                             classify_critical_point, find_zero_crossings)
+from critical_point_tracking import track_critical_points
+
+
+def vector_field(u, v, dim_y=10, dim_x=20):
+    y, x = np.mgrid[0:dim_y, 0:dim_x].astype(float)
+    return (u(x, y) + 1j*v(x, y))[np.newaxis]
+
+
+@pytest.mark.parametrize('x0, y0', [(12.3, 3.7), (12, 3.5), (12.5, 3),
+                                    (12, 3), (0, 0), (19, 0), (0, 9),
+                                    (19, 9)])
+@pytest.mark.parametrize('u, v', [
+    # node
+    (lambda x, y: x, lambda x, y: y),
+    # saddle
+    (lambda x, y: x, lambda x, y: -y),
+    # both components decrease away from the zero in the cell with the
+    # zero at its s=0, t=0 corner
+    (lambda x, y: -x, lambda x, y: -y),
+])
+def test_single_zero_found_once(x0, y0, u, v):
+    frames = vector_field(lambda x, y: u(x - x0, y - y0),
+                          lambda x, y: v(x - x0, y - y0))
+    t, x, y = find_zero_crossings(frames)
+    np.testing.assert_array_equal(t, [0])
+    np.testing.assert_allclose(x, [x0])
+    np.testing.assert_allclose(y, [y0])
+
+
+def test_no_zero():
+    frames = vector_field(lambda x, y: x + 1, lambda x, y: y + 1)
+    t, x, y = find_zero_crossings(frames)
+    assert len(t) == len(x) == len(y) == 0
+
+
+# linear fields (U, V) of the offsets (dx, dy) to the critical point, the
+# jacobian() is [[dU/dy, dU/dx], [dV/dy, dV/dx]]
+LINEAR_FIELDS = [
+    # trace 3, det 2
+    ('node stable', lambda dx, dy: (2*dy, dx), 1),
+    ('node unstable', lambda dx, dy: (-2*dy, -dx), 1),
+    # trace 2, det 2
+    ('focus stable', lambda dx, dy: (dy - dx, dx + dy), 1),
+    ('focus unstable', lambda dx, dy: (dx - dy, -dx - dy), 1),
+    # det -1
+    ('saddle', lambda dx, dy: (dy, -dx), -1),
+]
+
+
+@pytest.mark.parametrize('label, field, winding_number', LINEAR_FIELDS)
+def test_analyze_frames_linear_fields(label, field, winding_number):
+    x0, y0 = 11.3, 8.6
+    frames = vector_field(lambda x, y: field(x - x0, y - y0)[0],
+                          lambda x, y: field(x - x0, y - y0)[1],
+                          dim_y=20, dim_x=24)
+    points = analyze_frames(frames)
+    np.testing.assert_array_equal(points['labels'], [label])
+    np.testing.assert_allclose(points['x'], [x0])
+    np.testing.assert_allclose(points['y'], [y0])
+    np.testing.assert_array_equal(points['winding_number'], [winding_number])
+    # the rings grow until they reach the grid border
+    np.testing.assert_array_equal(points['extend'], [8])
+
+
+def test_classify_critical_point():
+    det = np.array([2, 2, 2, 2, -1, 0])
+    trace = np.array([3, -3, 2, -2, 0, 1])
+    np.testing.assert_array_equal(
+        classify_critical_point(det=det, trace=trace),
+        ['node stable', 'node unstable', 'focus stable', 'focus unstable',
+         'saddle', 'saddle'])
+
+
+def test_winding_number_without_critical_point():
+    frames = vector_field(lambda x, y: np.ones_like(x),
+                          lambda x, y: 0.1*y)
+    _, winding_number = calc_winding_number(frames, np.array([0]),
+                                            np.array([10.]), np.array([5.]))
+    np.testing.assert_array_equal(winding_number, [0])
+
+
+def track(frame_ids, x, labels=None, max_distance=1, max_frame_gap=1):
+    frame_ids, x = np.asarray(frame_ids), np.asarray(x, dtype=float)
+    if labels is None:
+        labels = np.full(len(x), 'saddle')
+    return track_critical_points(frame_ids, x, np.zeros(len(x)),
+                                 np.asarray(labels), max_distance,
+                                 max_frame_gap)
+
+
+def test_tracking_continues_next_nearest_track_end():
+    # the point at 0.9 is closest to both ends, the point at 2.2 can only
+    # continue the end at 1.5
+    track_ids = track([0, 0, 1, 1], [0.0, 1.5, 0.9, 2.2])
+    np.testing.assert_array_equal(track_ids, [0, 1, 0, 1])
+
+
+def test_tracking_prefers_smaller_total_distance():
+    track_ids = track([0, 0, 1, 1], [0.0, 1.0, 0.4, 1.3])
+    np.testing.assert_array_equal(track_ids, [0, 1, 0, 1])
+
+
+def test_tracking_limits():
+    # too far, different type, and frame gap
+    track_ids = track([0, 1, 1, 3], [0.0, 1.5, 0.5, 0.5],
+                      labels=['saddle', 'saddle', 'node stable', 'saddle'])
+    assert len(np.unique(track_ids)) == 4
+    track_ids = track([0, 2], [0.0, 0.5], max_frame_gap=2)
+    np.testing.assert_array_equal(track_ids, [0, 0])
@@ -0,0 +1,45 @@
+import numpy as np
+import neo
+import quantities as pq
+import pytest
+from utils.event_table import EventTable, table_file
+from utils.io_utils import load_event_table, write_neo
+
+
+def event(labels, name='wavefronts'):
+    labels = np.asarray(labels)
+    return neo.Event(np.arange(len(labels))*pq.s, labels=labels, name=name,
+                     array_annotations={'channels': np.arange(len(labels))})
+
+
+@pytest.mark.parametrize('labels', [
+    # compacted to int32
+    ['-1', '0', '1', '-1'],
+    [-1, 0, 1, -1],
+    # not exactly revertible from int32, kept as strings
+    ['-1', '00', '1', '-1'],
+    ['-1', 'a', 'b', '-1'],
+])
+def test_is_noise(labels, tmp_path):
+    table = EventTable.from_event(event(labels))
+    expected = [True, False, False, True]
+    np.testing.assert_array_equal(table.is_noise(), expected)
+    table.save(tmp_path / 'table.npz')
+    table = EventTable.load(tmp_path / 'table.npz')
+    np.testing.assert_array_equal(table.is_noise(), expected)
+
+
+def test_tables_written_for_stage05_events(tmp_path):
+    block = neo.Block()
+    block.segments.append(neo.Segment())
+    block.segments[0].events += [event(['0', '1']),
+                                 event(['0', '1'], name='transitions')]
+    filename = tmp_path / 'waves.nix'
+    write_neo(filename, block)
+
+    assert table_file(filename, 'wavefronts').exists()
+    assert not table_file(filename, 'transitions').exists()
+    # created on demand
+    table = load_event_table(filename, 'transitions')
+    assert table_file(filename, 'transitions').exists()
+    np.testing.assert_array_equal(table.to_event().labels, ['0', '1'])
@@ -0,0 +1,92 @@
+"""
+Conversions between AnalogSignals and ImageSequences on the channel grid.
+"""
+
+import numpy as np
+import neo
+import quantities as pq
+from conftest import add_script_path
+from utils.neo_utils import (analogsignal_to_imagesequence,
+                             imagesequence_to_analogsignal,
+                             _imagesequence_view)
+
+add_script_path('stage02_processing')
+from roi_selection import roi_selection
+
+
+def grid_signal(dim_t=20, dim_y=12, dim_x=14, permute=False):
+    rng = np.random.default_rng(0)
+    y, x = np.meshgrid(np.arange(dim_y), np.arange(dim_x), indexing='ij')
+    x, y = x.ravel(), y.ravel()
+    # bright disk in the center, for the roi selection
+    intensity = np.exp(-((x - dim_x/2)**2 + (y - dim_y/2)**2) / 20)
+    signal = intensity + 0.01 * rng.standard_normal((dim_t, dim_y*dim_x))
+    order = rng.permutation(len(x)) if permute else np.arange(len(x))
+    asig = neo.AnalogSignal(signal[:, order], units='dimensionless',
+                            sampling_rate=10*pq.Hz, spatial_scale=1*pq.mm,
+                            description='test signal. ')
+    asig.array_annotate(x_coords=x[order], y_coords=y[order])
+    return asig
+
+
+def test_imagesequence_grid():
+    for permute in [False, True]:
+        asig = grid_signal(permute=permute)
+        frames = analogsignal_to_imagesequence(asig).as_array()
+        x = asig.array_annotations['x_coords']
+        y = asig.array_annotations['y_coords']
+        np.testing.assert_array_equal(frames[:, y, x], asig.magnitude)
+
+
+def test_imagesequence_copy():
+    asig = grid_signal()
+    imgseq = analogsignal_to_imagesequence(asig)
+    assert not np.may_share_memory(imgseq.magnitude, asig.magnitude)
+
+    imgseq = analogsignal_to_imagesequence(asig, copy=False)
+    assert np.may_share_memory(imgseq.magnitude, asig.magnitude)
+    new_asig = imagesequence_to_analogsignal(imgseq)
+    np.testing.assert_array_equal(new_asig.magnitude, asig.magnitude)
+
+
+def test_imagesequence_view_equals_constructor():
+    # _imagesequence_view() mimics neo.ImageSequence.__new__/__init__
+    asig = grid_signal()
+    asig.name = 'signal'
+    asig.file_origin = 'test.nix'
+    asig.t_start = 1.5*pq.s
+    asig.annotate(source='test', order=3)
+    image_data = asig.magnitude.reshape(len(asig), 12, 14)
+
+    view = _imagesequence_view(image_data, asig)
+    imgseq = neo.ImageSequence(image_data=image_data,
+                               units=asig.units,
+                               dtype=asig.dtype,
+                               t_start=asig.t_start,
+                               sampling_rate=asig.sampling_rate,
+                               name=asig.name,
+                               description=asig.description,
+                               file_origin=asig.file_origin,
+                               **asig.annotations)
+
+    assert type(view) is type(imgseq)
+    np.testing.assert_array_equal(view.magnitude, imgseq.magnitude)
+    assert view.units == imgseq.units
+    assert view.dtype == imgseq.dtype
+    for attr in ['name', 'description', 'file_origin', 'segment',
+                 'annotations', 'array_annotations']:
+        assert getattr(view, attr) == getattr(imgseq, attr), attr
+    for attr in ['sampling_rate', 'spatial_scale', 't_start', 't_stop',
+                 'frame_duration']:
+        assert getattr(view, attr) == getattr(imgseq, attr), attr
+    np.testing.assert_array_equal(view.times, imgseq.times)
+    assert view.times.units == imgseq.times.units
+    assert sorted(vars(view)) == sorted(vars(imgseq))
+
+
+def test_roi_selection_keeps_input():
+    asig = grid_signal()
+    signal = asig.magnitude.copy()
+    new_asig, _, _ = roi_selection(asig, intensity_threshold=0.5, crop=False)
+    assert np.isnan(new_asig.magnitude).any()
+    np.testing.assert_array_equal(asig.magnitude, signal)
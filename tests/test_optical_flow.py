@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from conftest import add_script_path
+from utils.convolve import get_kernel
+
+add_script_path('stage04_wave_detection')
+import optical_flow
+from optical_flow import horn_schunck
+
+
+def wave_frames(dim_t=41, dim_y=16, dim_x=18):
+    rng = np.random.default_rng(0)
+    t = np.arange(dim_t)[:, np.newaxis, np.newaxis] / 100
+    y, x = np.meshgrid(np.arange(dim_y), np.arange(dim_x), indexing='ij')
+    frames = np.sin(2*np.pi * (2*t - 0.1*x - 0.05*y)) \
+           + 0.1 * rng.standard_normal((dim_t, dim_y, dim_x))
+    frames[:, 3, 4] = np.nan
+    return frames
+
+
+def optical_flow_results(frames, n_jobs, **kwargs):
+    kernel = get_kernel('scharr_3x3')
+    kernelHS = np.array([[1, 2, 1],
+                         [2, 0, 2],
+                         [1, 2, 1]], dtype=float) * 1/12
+    kernelT = np.ones_like(kernel.x, dtype=float)
+    kernelT /= np.sum(kernelT)
+    return horn_schunck(frames=frames.copy(), alpha=0.1, max_Niter=40,
+                        convergence_limit=1e-4, kernelX=kernel.x,
+                        kernelY=kernel.y, kernelT=kernelT, kernelHS=kernelHS,
+                        n_jobs=n_jobs, **kwargs)
+
+
+@pytest.mark.parametrize('solver', ['jacobi', 'multigrid'])
+@pytest.mark.parametrize('warm_start', [False, True])
+def test_parallel_equals_serial(solver, warm_start, monkeypatch):
+    # several batches of frame pairs per shard
+    monkeypatch.setattr(optical_flow, 'FRAME_CHUNK_SIZE', 6)
+    frames = wave_frames()
+    serial = optical_flow_results(frames, n_jobs=1, solver=solver,
+                                  warm_start=warm_start)
+    parallel = optical_flow_results(frames, n_jobs=3, solver=solver,
+                                    warm_start=warm_start)
+    for serial_result, parallel_result in zip(serial, parallel):
+        assert np.array_equal(serial_result, parallel_result, equal_nan=True)
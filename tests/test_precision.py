@@ -0,0 +1,139 @@
+"""
+Regression of the float32 PRECISION against the float64 results.
+"""
+
+import numpy as np
+import neo
+import quantities as pq
+import pytest
+from conftest import add_script_path
+from utils.io_utils import (PRECISION_ENV, cast_signals, get_precision,
+                            load_neo, write_neo, _is_memmap)
+from utils.convolve import get_kernel
+
+add_script_path('stage02_processing')
+add_script_path('stage04_wave_detection')
+from detrending import detrend
+from frequency_filter import frequency_filter
+from optical_flow import horn_schunck
+
+
+def wave_signal(dtype, dim_t=400, dim_y=8, dim_x=10, sampling_rate=100):
+    # planar waves with noise on a dim_y x dim_x grid
+    rng = np.random.default_rng(42)
+    t = np.arange(dim_t)[:, np.newaxis, np.newaxis] / sampling_rate
+    y, x = np.meshgrid(np.arange(dim_y), np.arange(dim_x), indexing='ij')
+    frames = np.sin(2*np.pi * (2*t - 0.1*x - 0.05*y)) + 0.5*t \
+           + 0.1 * rng.standard_normal((dim_t, dim_y, dim_x))
+    asig = neo.AnalogSignal(frames.reshape(dim_t, -1).astype(dtype),
+                            units='mV', sampling_rate=sampling_rate*pq.Hz,
+                            description='test signal. ',
+                            spatial_scale=1*pq.mm)
+    asig.array_annotate(x_coords=np.tile(np.arange(dim_x), dim_y),
+                        y_coords=np.repeat(np.arange(dim_y), dim_x))
+    return asig
+
+
+def signal_block(asig):
+    block = neo.Block()
+    block.segments.append(neo.Segment())
+    block.segments[0].analogsignals.append(asig)
+    return block
+
+
+def process(asig):
+    asig = detrend(asig, order=1)
+    return frequency_filter(asig, highpass_frequency=0.5,
+                            lowpass_frequency=10, order=2,
+                            filter_function='filtfilt')
+
+
+def optical_flow(asig):
+    frames = asig.magnitude.reshape(len(asig), 8, 10)
+    kernel = get_kernel('scharr_3x3')
+    kernelHS = np.array([[1, 2, 1],
+                         [2, 0, 2],
+                         [1, 2, 1]], dtype=frames.dtype) * 1/12
+    kernelT = np.ones_like(kernel.x, dtype=frames.dtype)
+    kernelT /= np.sum(kernelT)
+    vector_frames, _, _ = horn_schunck(frames=frames, alpha=0.1,
+                                       max_Niter=50, convergence_limit=1e-4,
+                                       kernelX=kernel.x.astype(frames.dtype),
+                                       kernelY=kernel.y.astype(frames.dtype),
+                                       kernelT=kernelT, kernelHS=kernelHS)
+    return vector_frames
+
+
+def test_precision_setting(monkeypatch):
+    monkeypatch.setenv(PRECISION_ENV, 'None')
+    assert get_precision() is None
+    monkeypatch.setenv(PRECISION_ENV, 'float32')
+    assert get_precision() == np.float32
+    monkeypatch.setenv(PRECISION_ENV, 'int16')
+    with pytest.raises(ValueError):
+        get_precision()
+
+
+def test_no_precision_keeps_dtype(monkeypatch, tmp_path):
+    monkeypatch.delenv(PRECISION_ENV, raising=False)
+    block = signal_block(wave_signal(np.float32))
+    cast_signals(block)
+    assert block.segments[0].analogsignals[0].dtype == np.float32
+
+    write_neo(tmp_path / 'signal.nix', block)
+    asig = load_neo(tmp_path / 'signal.nix', object='analogsignal')
+    assert asig.dtype == np.float32
+
+
+@pytest.mark.parametrize('signal_dtype', [np.float32, np.float64])
+def test_precision_cast(monkeypatch, tmp_path, signal_dtype):
+    monkeypatch.setenv(PRECISION_ENV, 'float32')
+    asig = wave_signal(signal_dtype)
+    block = signal_block(asig.copy())
+    block.segments[0].irregularlysampledsignals.append(
+        neo.IrregularlySampledSignal(times=np.arange(5)*pq.s,
+                                     signal=np.ones((5, 2)) * (1+1j),
+                                     units='dimensionless'))
+    write_neo(tmp_path / 'signal.nix', block)
+
+    block = load_neo(tmp_path / 'signal.nix')
+    segment = block.segments[0]
+    assert segment.analogsignals[0].dtype == np.float32
+    assert segment.irregularlysampledsignals[0].dtype == np.complex64
+    np.testing.assert_allclose(segment.analogsignals[0].magnitude,
+                               asig.magnitude, rtol=1e-6)
+
+
+def test_memmaps_are_cast_when_written(monkeypatch, tmp_path):
+    block = signal_block(wave_signal(np.float64))
+    write_neo(tmp_path / 'signal.chunked', block)
+
+    monkeypatch.setenv(PRECISION_ENV, 'float32')
+    block = load_neo(tmp_path / 'signal.chunked')
+    asig = block.segments[0].analogsignals[0]
+    # not loaded into memory by the cast
+    assert asig.dtype == np.float64
+    assert _is_memmap(asig.magnitude)
+
+    write_neo(tmp_path / 'cast.chunked', block)
+    cast_asig = load_neo(tmp_path / 'cast.chunked', object='analogsignal')
+    assert cast_asig.dtype == np.float32
+    np.testing.assert_allclose(cast_asig.magnitude, asig.magnitude,
+                               rtol=1e-6)
+
+
+def test_float32_processing_regression():
+    asig32 = process(wave_signal(np.float32))
+    asig64 = process(wave_signal(np.float64))
+    signal_range = np.ptp(asig64.magnitude)
+    assert np.max(np.abs(asig32.magnitude - asig64.magnitude)) \
+           < 1e-5 * signal_range
+
+
+def test_float32_optical_flow_regression():
+    vectors32 = optical_flow(wave_signal(np.float32))
+    vectors64 = optical_flow(wave_signal(np.float64))
+    assert vectors32.dtype == np.complex64
+    assert vectors64.dtype == np.complex128
+    vector_range = np.max(np.abs(vectors64))
+    assert np.max(np.abs(vectors32 - vectors64)) < 1e-4 * vector_range
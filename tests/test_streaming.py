@@ -0,0 +1,25 @@
+import numpy as np
+import neo
+import quantities as pq
+from conftest import add_script_path
+
+add_script_path('stage02_processing')
+from z_score import z_score
+
+
+def test_streamed_zscore_equals_in_memory(tmp_path):
+    rng = np.random.default_rng(0)
+    signal = rng.standard_normal((1000, 4)) + 3
+    # constant, zero, and nan channels
+    signal[:, 1] = 2.5
+    signal[:, 2] = 0
+    signal[10, 3] = np.nan
+    asig = neo.AnalogSignal(signal, units='mV', sampling_rate=100*pq.Hz)
+
+    streamed = z_score(asig.copy(), chunk_duration=1.3,
+                       output=tmp_path / 'zscore.chunked')
+    in_memory = z_score(asig.copy())
+    np.testing.assert_allclose(streamed.magnitude, in_memory.magnitude,
+                               rtol=1e-10, atol=1e-12)
+    np.testing.assert_array_equal(np.isnan(streamed.magnitude),
+                                  np.isnan(in_memory.magnitude))
@@ -0,0 +1,69 @@
+"""
+The windowed and the precomputed-graph DBSCAN must give the labels of a single
+sklearn.cluster.DBSCAN fit.
+"""
+
+import numpy as np
+import pytest
+from sklearn.cluster import DBSCAN
+from conftest import add_script_path
+
+add_script_path('stage04_wave_detection')
+from trigger_clustering import dbscan_labels, dbscan_windowed, neighbour_graph
+
+
+def random_triggers(seed, num_triggers=300, dim_x=8, dim_y=8, num_frames=12):
+    # integer coordinates and frames, for ties among the distances,
+    # in random (i.e. not time sorted) order
+    rng = np.random.default_rng(seed)
+    points = np.stack([rng.integers(0, dim_x, num_triggers),
+                       rng.integers(0, dim_y, num_triggers),
+                       rng.integers(0, num_frames, num_triggers)],
+                      axis=-1).astype(float)
+    return points[rng.permutation(num_triggers)]
+
+
+def reference_labels(points, eps, min_samples, metric):
+    return DBSCAN(eps=eps, min_samples=min_samples,
+                  metric=metric).fit(points).labels_
+
+
+@pytest.mark.parametrize('metric', ['euclidean', 'manhattan', 'chebyshev'])
+@pytest.mark.parametrize('eps, min_samples', [(1, 3), (1.5, 5), (2, 10)])
+# windows shorter than eps, and windows of several eps
+@pytest.mark.parametrize('window_length', [0.5, 1, 7, 100])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_windowed_equals_global_fit(metric, eps, min_samples, window_length,
+                                    seed):
+    points = random_triggers(seed)
+    labels = dbscan_windowed(points, eps=eps, min_samples=min_samples,
+                             metric=metric, window_length=window_length)
+    np.testing.assert_array_equal(
+        labels, reference_labels(points, eps, min_samples, metric))
+
+
+def test_windowed_parallel_equals_global_fit():
+    points = random_triggers(2)
+    labels = dbscan_windowed(points, eps=1.5, min_samples=5,
+                             metric='euclidean', window_length=5, n_jobs=2)
+    np.testing.assert_array_equal(
+        labels, reference_labels(points, 1.5, 5, 'euclidean'))
+
+
+def test_windowed_empty():
+    labels = dbscan_windowed(np.empty((0, 3)), eps=1, min_samples=3,
+                             metric='euclidean', window_length=1)
+    assert len(labels) == 0
+
+
+@pytest.mark.parametrize('metric', ['euclidean', 'manhattan', 'chebyshev'])
+@pytest.mark.parametrize('eps, min_samples', [(1, 3), (1.5, 5), (2, 10)])
+@pytest.mark.parametrize('radius_factor', [1, 1.5, 3])
+def test_precomputed_graph_equals_global_fit(metric, eps, min_samples,
+                                             radius_factor):
+    # a graph with a larger radius is reused for smaller eps in the sweep
+    points = random_triggers(3)
+    graph = neighbour_graph(points, radius=radius_factor*eps, metric=metric)
+    np.testing.assert_array_equal(
+        dbscan_labels(graph, eps=eps, min_samples=min_samples),
+        reference_labels(points, eps, min_samples, metric))